@@ -0,0 +1,96 @@
+"""
+Text analysis shared by indexing and querying.
+
+The same Analyzer must be used to index documents and to analyze queries against them so both sides produce the
+same terms. Text is split into word tokens with a compiled regular expression, case folded, stop words are removed
+and tokens are optionally stemmed. The term produced for each distinct token is memoized because the vocabulary of
+a corpus is small compared to its number of tokens.
+"""
+import re
+
+from aiasearch.stopwords import STOP_WORDS
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def s_stem(word: str) -> str:
+    """
+    Harman's S stemmer. Conservatively reduces English plurals to their singular form.
+    :param word: A lower case word.
+    :return: The stemmed word.
+    """
+    if len(word) > 3 and word.endswith("ies") and not word.endswith(("eies", "aies")):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("es") and not word.endswith(("aes", "ees", "oes")):
+        return word[:-1]
+    if len(word) > 2 and word.endswith("s") and not word.endswith(("us", "ss")):
+        return word[:-1]
+    return word
+
+
+class Analyzer:
+    """
+    Converts text to a list of terms for indexing and searching.
+    """
+
+    def __init__(self, stop_words: frozenset = STOP_WORDS, stem=False, max_token_length=64, cache_size=1000000):
+        """
+        :param stop_words: Case folded words to remove.
+        :param stem: Reduce plural words to their singular form.
+        :param max_token_length: Longer tokens, such as encoded data, are dropped.
+        :param cache_size: Maximum number of distinct tokens whose terms are memoized.
+        """
+        self._stop_words = stop_words
+        self._stem = stem
+        self._max_token_length = max_token_length
+        self._cache_size = cache_size
+        self._terms: dict[str, str] = {}
+
+    @property
+    def name(self) -> str:
+        """
+        :return: A description of the analysis settings. Indexes built with a different name are incompatible.
+        """
+        return (f"standard:stem={self._stem}:max_token_length={self._max_token_length}"
+                f":stop_words={len(self._stop_words)}")
+
+    def analyze(self, text: str) -> list[str]:
+        """
+        :param text: Text to analyze.
+        :return: The terms of the text in order of occurrence.
+        """
+        terms = self._terms
+        result = []
+        for token in _TOKEN_PATTERN.findall(text):
+            term = terms.get(token)
+            if term is None:
+                term = self._term(token)
+                if len(terms) < self._cache_size:
+                    terms[token] = term
+            if term:
+                result.append(term)
+        return result
+
+    def remove_stop_words(self, text: str) -> str:
+        """
+        Removes stop words from text without otherwise changing it, for use with models that embed the text.
+        :param text: Text to filter.
+        :return: The words of the text that are not stop words, separated by spaces.
+        """
+        return " ".join(word for word in text.split() if word.casefold() not in self._stop_words)
+
+    def _term(self, token: str) -> str:
+        """
+        :return: The term for a token, an empty string if the token is dropped.
+        """
+        if len(token) > self._max_token_length:
+            return ""
+        term = token.casefold()
+        if term in self._stop_words:
+            return ""
+        if self._stem:
+            term = s_stem(term)
+        return term
+
+
+DEFAULT_ANALYZER = Analyzer()
@@ -0,0 +1,196 @@
+"""
+Benchmarks loading, indexing, search and grounded question answering on synthetic permit data.
+Documents and queries are embedded in process by HashingEmbeddingBackend and a fake chat model answers questions,
+so no Ollama or Anthropic connection is needed and results can be compared between releases.
+
+python -m aiasearch.benchmarks.run --rows 10000 100000 --output benchmark.json
+"""
+import argparse
+import json
+import logging
+import platform
+import shutil
+import tempfile
+import time
+from importlib import metadata
+from pathlib import Path
+
+import numpy as np
+from langchain_core.language_models import FakeListChatModel
+
+from aiasearch.benchmarks.synthetic_data import generate_questions, write_permits_csv
+from aiasearch.data.bm25_keyword_store import Bm25KeywordStore
+from aiasearch.data.chroma_vector_store import ChromaVectorStore
+from aiasearch.data.csv_loader import CsvLoader
+from aiasearch.data.embedding_backend import HashingEmbeddingBackend
+from aiasearch.data.flat_vector_store import FlatVectorStore
+from aiasearch.data.hybrid_retriever import HybridRetriever
+from aiasearch.log import PROJECT_NAME
+from aiasearch.models.ollama_provider import OllamaProvider
+
+BENCHMARK_VERSION = 2
+
+LABEL_COLUMNS = {"permitnumber": "Permit Number",
+                 "declared_valuation": "Valuation",
+                 "worktype": "Work Type",
+                 "issued_date": "Issued Date"}
+COMBINE_COLUMNS = ["permittypedescr", "description", "comments", "address", "city", "state", "zip"]
+METADATA_COLUMNS = ["permitnumber"]
+
+
+def summarize(latencies: [float], items: int) -> dict:
+    """
+    :param latencies: Seconds taken by each operation.
+    :param items: Number of items, such as rows or queries, processed by all operations.
+    :return: Operation count, total time, items per second and latency percentiles in milliseconds.
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    total = float(latencies.sum())
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if len(latencies) > 0 else (0.0, 0.0, 0.0)
+    return {
+        "operations": len(latencies),
+        "items": items,
+        "total_seconds": round(total, 6),
+        "throughput_per_second": round(items / total, 3) if total > 0 else None,
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+
+def timed(function, *args, **kwargs) -> tuple:
+    """
+    :return: The result of the function and the seconds it took.
+    """
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def run_benchmarks(rows: int, work_dir, queries=200, vector_rows=100000, add_batch_size=1000, load_repeats=3,
+                   embedding_size=384, k=10, seed=0) -> dict:
+    """
+    Runs every benchmark on a synthetic CSV.
+    :param rows: Number of rows of the synthetic CSV.
+    :param work_dir: Directory for the CSV and the stores. It is emptied first.
+    :param queries: Number of questions searched and answered.
+    :param vector_rows: Maximum number of documents added to the Chroma vector store, which is much slower to build
+    than the other stages.
+    :param add_batch_size: Documents per add_documents call.
+    :param load_repeats: Number of times the CSV is loaded.
+    :param embedding_size: Dimension of the in process hashing embeddings.
+    :param k: Documents returned per search.
+    :param seed: Random seed of the data and questions.
+    :return: Results of each stage.
+    """
+    work_dir = Path(work_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+    csv_path = work_dir / "permits.csv"
+    write_permits_csv(csv_path, rows, seed=seed)
+    questions = generate_questions(queries, seed=seed)
+    results = {}
+
+    loader = CsvLoader()
+    latencies = []
+    documents = []
+    for _ in range(load_repeats):
+        documents, seconds = timed(loader.load, file_path=str(csv_path), label_columns=LABEL_COLUMNS,
+                                   combine_columns=COMBINE_COLUMNS, metadata_columns=METADATA_COLUMNS)
+        latencies.append(seconds)
+    results["csv_load"] = summarize(latencies, rows * load_repeats)
+
+    vector_documents = documents[:vector_rows]
+    vector_store = ChromaVectorStore(vectorstore_dir=str(work_dir / "vectorstore"), overwrite=True,
+                                     id_key="permitnumber",
+                                     embedding_backend=HashingEmbeddingBackend(dimension=embedding_size))
+    latencies = [timed(vector_store.add_documents, vector_documents[start:start + add_batch_size])[1]
+                 for start in range(0, len(vector_documents), add_batch_size)]
+    results["vector_add_documents"] = summarize(latencies, len(vector_documents))
+
+    flat_store = FlatVectorStore(store_dir=work_dir / "flat_vectorstore", id_key="permitnumber",
+                                 embedding_backend=HashingEmbeddingBackend(dimension=embedding_size))
+    latencies = [timed(flat_store.add_documents, documents[start:start + add_batch_size])[1]
+                 for start in range(0, len(documents), add_batch_size)]
+    results["flat_vector_add_documents"] = summarize(latencies, len(documents))
+
+    keyword_store = Bm25KeywordStore(id_key="permitnumber", max_segments=len(documents) // add_batch_size + 1)
+    latencies = [timed(keyword_store.add_documents, documents[start:start + add_batch_size])[1]
+                 for start in range(0, len(documents), add_batch_size)]
+    latencies.append(timed(keyword_store.compact)[1])
+    results["keyword_add_documents"] = summarize(latencies, len(documents))
+
+    results["vector_search"] = summarize(
+        [timed(vector_store.search_documents, question, k)[1] for question in questions], len(questions))
+    results["flat_vector_search"] = summarize(
+        [timed(flat_store.search_documents, question, k)[1] for question in questions], len(questions))
+    results["keyword_search"] = summarize(
+        [timed(keyword_store.search_documents, question, k)[1] for question in questions], len(questions))
+
+    retriever = HybridRetriever(vector_store, keyword_store, dedupe_key="permitnumber")
+    results["hybrid_search"] = summarize(
+        [timed(retriever.search_documents, question, k)[1] for question in questions], len(questions))
+
+    provider = OllamaProvider(model_name="llama3.1",
+                              chat_model=FakeListChatModel(responses=["The permits list interior and exterior work."]))
+    latencies = []
+    for question in questions:
+        started = time.perf_counter()
+        provider.query_grounded(question, retriever.search_documents(question, k))
+        latencies.append(time.perf_counter() - started)
+    results["grounded_qa"] = summarize(latencies, len(questions))
+    retriever.close()
+
+    return {"rows": rows, "vector_rows": len(vector_documents), "queries": queries, "k": k, "seed": seed,
+            "results": results}
+
+
+def environment() -> dict:
+    """
+    :return: Python, platform and dependency versions the benchmarks ran with.
+    """
+    versions = {}
+    for package in ["numpy", "pandas", "chromadb", "langchain-core", "langchain-chroma"]:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.machine(),
+            "packages": versions}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark aiasearch on synthetic permit data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="Rows of each synthetic CSV.")
+    parser.add_argument("--queries", type=int, default=200, help="Questions searched and answered per run.")
+    parser.add_argument("--vector-rows", type=int, default=100000,
+                        help="Maximum number of documents added to the Chroma vector store.")
+    parser.add_argument("--load-repeats", type=int, default=3, help="Times each CSV is loaded.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the data and questions.")
+    parser.add_argument("--work-dir", help="Directory for generated files. Defaults to a temporary directory.")
+    parser.add_argument("--output", help="Path of the JSON results. Defaults to standard output.")
+    args = parser.parse_args(argv)
+
+    logging.getLogger(PROJECT_NAME).setLevel(logging.WARNING)
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="aiasearch-benchmark-"))
+    runs = []
+    try:
+        for rows in args.rows:
+            runs.append(run_benchmarks(rows, work_dir / str(rows), queries=args.queries,
+                                       vector_rows=args.vector_rows, load_repeats=args.load_repeats,
+                                       seed=args.seed))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = json.dumps({"benchmark_version": BENCHMARK_VERSION, "environment": environment(), "runs": runs},
+                        indent=2)
+    if args.output:
+        Path(args.output).write_text(report + "\n", encoding="utf-8")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
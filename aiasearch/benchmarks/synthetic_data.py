@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+# columns of data.csv, the Boston building permit export
+COLUMNS = ["permitnumber", "worktype", "permittypedescr", "description", "comments", "applicant",
+           "declared_valuation", "total_fees", "issued_date", "expiration_date", "status", "occupancytype", "sq_feet",
+           "address", "city", "state", "zip", "property_id", "parcel_id", "gpsy", "gpsx", "y_latitude",
+           "x_longitude"]
+
+# (worktype, description, weight) in roughly the proportions of data.csv
+WORK_TYPES = [
+    ("INTEXT", "Interior/Exterior Work", 29),
+    ("INTREN", "Renovations - Interior NSC", 17),
+    ("OTHER", "Other", 17),
+    ("FA", "Fire Alarm", 14),
+    ("EXTREN", "Renovations - Exterior", 8),
+    ("ADDITION", "Addition", 5),
+    ("SPRINK", "Fire Protection/Sprinkler", 5),
+    ("VIOL", "Application to Correct a Violation", 2),
+    ("SIGNES", "Signs", 2),
+    ("COB", "City of Boston", 1),
+]
+PERMIT_TYPES = ["Short Form Bldg Permit", "Long Form/Alteration Permit", "Amendment to a Long Form",
+                "Erect/New Construction", "Certificate of Occupancy"]
+PERMIT_PREFIXES = ["A", "ALT", "SF", "ERT", "U"]
+CITIES = [("Boston", "02108", 30), ("Dorchester", "02124", 15), ("Roxbury", "02119", 11),
+          ("South Boston", "02127", 10), ("East Boston", "02128", 7), ("Jamaica Plain", "02130", 7),
+          ("Brighton", "02135", 6), ("West Roxbury", "02132", 5), ("Roslindale", "02131", 5),
+          ("Charlestown", "02129", 4)]
+STREETS = ["Newbury", "Boylston", "Commonwealth", "Tremont", "Washington", "Beacon", "Dorchester", "Centre",
+           "Columbus", "Massachusetts", "Huntington", "Blue Hill", "Hyde Park", "Cambridge", "Hanover", "State",
+           "Summer", "Marlborough", "Adams", "Bennington", "Meridian", "Savin Hill", "Harrison", "Shawmut", "Cabot"]
+STREET_SUFFIXES = ["ST", "AV", "RD", "PL", "TE", "WY"]
+FIRST_NAMES = ["Patrick", "Maria", "John", "Renee", "David", "Linda", "Michael", "Susan", "James", "Karen", "Robert",
+               "Lisa", "William", "Nancy", "Joseph", "Carol"]
+LAST_NAMES = ["Sharkey", "Santeusanio", "Walsh", "Nguyen", "Murphy", "Garcia", "O'Brien", "Chen", "Kelly", "Silva",
+              "Sullivan", "Johnson", "Lee", "Rodriguez", "Brown", "Flaherty"]
+COMMENT_WORDS = ["install", "replace", "new", "existing", "kitchen", "bathroom", "roof", "windows", "doors", "deck",
+                 "porch", "siding", "fire", "alarm", "sprinkler", "system", "renovate", "interior", "exterior",
+                 "walls", "ceiling", "flooring", "cabinets", "stairs", "egress", "basement", "unit", "units", "floor",
+                 "second", "third", "rear", "front", "demolition", "framing", "insulation", "drywall", "electrical",
+                 "plumbing", "hvac", "per", "plans", "as", "with", "and", "the", "of", "to", "in", "on"]
+STATUSES = ["Open", "Closed", "Issued", "Stop Work"]
+OCCUPANCY_TYPES = ["1-2FAM", "1-3FAM", "Multi", "Comm", "Mixed", "VacLd", "1-4FAM"]
+
+
+def _choice(rng: np.random.Generator, values: list, size: int, weights: list = None) -> np.ndarray:
+    probabilities = None
+    if weights is not None:
+        probabilities = np.asarray(weights, dtype=np.float64)
+        probabilities /= probabilities.sum()
+    return rng.choice(len(values), size=size, p=probabilities)
+
+
+def generate_permits(rows: int, seed=0, start=0) -> pd.DataFrame:
+    """
+    Generates synthetic building permits with the columns and value formats of data.csv.
+    :param rows: Number of permits.
+    :param seed: Random seed. The same seed and start always generate the same permits.
+    :param start: Number of the first permit, used to generate a large file in chunks.
+    :return: A data frame of string columns.
+    """
+    rng = np.random.default_rng([seed, start])
+    numbers = np.arange(start, start + rows)
+
+    work = _choice(rng, WORK_TYPES, rows, [weight for _, _, weight in WORK_TYPES])
+    cities = _choice(rng, CITIES, rows, [weight for _, _, weight in CITIES])
+    prefixes = np.asarray(PERMIT_PREFIXES, dtype=object)[numbers % len(PERMIT_PREFIXES)]
+
+    word_counts = rng.integers(4, 16, size=rows)
+    word_indexes = rng.integers(0, len(COMMENT_WORDS), size=(rows, 15))
+    words = np.asarray(COMMENT_WORDS, dtype=object)
+    comments = [" ".join(words[indexes[:count]]) for indexes, count in zip(word_indexes, word_counts)]
+
+    valuation = np.round(rng.lognormal(9.5, 1.5, size=rows), 2)
+    issued = pd.Timestamp("2010-01-01") + pd.to_timedelta(rng.integers(0, 15 * 365 * 86400, size=rows), unit="s")
+    latitude = 42.36 + rng.normal(0, 0.04, size=rows)
+    longitude = -71.06 + rng.normal(0, 0.05, size=rows)
+
+    def column(values) -> pd.Series:
+        return pd.Series(values).astype(str)
+
+    def formatted(values, format_spec: str) -> pd.Series:
+        return pd.Series(values).map(format_spec.format)
+
+    table = {
+        "permitnumber": prefixes + column(100000 + numbers),
+        "worktype": column(np.asarray([name for name, _, _ in WORK_TYPES], dtype=object)[work]),
+        "permittypedescr": column(np.asarray(PERMIT_TYPES, dtype=object)[
+                                      _choice(rng, PERMIT_TYPES, rows, [40, 30, 15, 10, 5])]),
+        "description": column(np.asarray([description for _, description, _ in WORK_TYPES], dtype=object)[work]),
+        "comments": column(comments),
+        "applicant": column(np.asarray(FIRST_NAMES, dtype=object)[rng.integers(0, len(FIRST_NAMES), size=rows)] +
+                            " " +
+                            np.asarray(LAST_NAMES, dtype=object)[rng.integers(0, len(LAST_NAMES), size=rows)]),
+        "declared_valuation": formatted(valuation, "${:,.2f}"),
+        "total_fees": formatted(np.round(valuation * 0.01 + 20, 2), "${:,.2f}"),
+        "issued_date": column(issued.astype(str)) + "+00",
+        "expiration_date": column((issued.normalize() + pd.Timedelta(days=181, hours=4)).astype(str)) + "+00",
+        "status": column(np.asarray(STATUSES, dtype=object)[_choice(rng, STATUSES, rows, [60, 30, 9, 1])]),
+        "occupancytype": column(np.asarray(OCCUPANCY_TYPES, dtype=object)[
+                                    rng.integers(0, len(OCCUPANCY_TYPES), size=rows)]),
+        "sq_feet": column(rng.integers(0, 5000, size=rows)),
+        "address": column(rng.integers(1, 1500, size=rows)) + " " +
+                   column(np.asarray(STREETS, dtype=object)[rng.integers(0, len(STREETS), size=rows)]) + " " +
+                   column(np.asarray(STREET_SUFFIXES, dtype=object)[
+                              rng.integers(0, len(STREET_SUFFIXES), size=rows)]),
+        "city": column(np.asarray([city for city, _, _ in CITIES], dtype=object)[cities]),
+        "state": column(np.full(rows, "MA", dtype=object)),
+        "zip": column(np.asarray([zip_code for _, zip_code, _ in CITIES], dtype=object)[cities]),
+        "property_id": column(rng.integers(1, 200000, size=rows)),
+        "parcel_id": formatted(rng.integers(100000000, 2300000000, size=rows), "{:010d}"),
+        "gpsy": column(np.round(2956234 + (latitude - 42.36) * 364000, 8)),
+        "gpsx": column(np.round(777000 + (longitude + 71.06) * 270000, 8)),
+        "y_latitude": column(latitude),
+        "x_longitude": column(longitude),
+    }
+    return pd.DataFrame(table, columns=COLUMNS)
+
+
+def write_permits_csv(file_path, rows: int, seed=0, chunk_rows=100000):
+    """
+    Writes a synthetic permit CSV shaped like data.csv, generating it in chunks so memory use stays flat.
+    :param file_path: Path of the CSV file to write.
+    :param rows: Number of permits.
+    :param seed: Random seed.
+    :param chunk_rows: Number of permits generated at a time.
+    """
+    for start in range(0, rows, chunk_rows):
+        frame = generate_permits(min(chunk_rows, rows - start), seed=seed, start=start)
+        frame.to_csv(file_path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+    if rows == 0:
+        pd.DataFrame(columns=COLUMNS).to_csv(file_path, index=False)
+
+
+def generate_questions(count: int, seed=0) -> [str]:
+    """
+    Generates questions about synthetic permits, such as "List fire alarm work on Newbury ST".
+    :param count: Number of questions.
+    :param seed: Random seed.
+    :return: A list of questions.
+    """
+    rng = np.random.default_rng([seed, 1])
+    templates = ["List {work} work on {street} {suffix}", "What {work} permits were issued in {city}",
+                 "Which permits {verb} {thing} on {street} {suffix}", "Show {thing} permits in {city}"]
+    questions = []
+    for _ in range(count):
+        template = templates[rng.integers(len(templates))]
+        questions.append(template.format(
+            work=WORK_TYPES[rng.integers(len(WORK_TYPES))][1].lower(),
+            street=STREETS[rng.integers(len(STREETS))],
+            suffix=STREET_SUFFIXES[rng.integers(len(STREET_SUFFIXES))],
+            city=CITIES[rng.integers(len(CITIES))][0],
+            verb=["install", "replace", "renovate"][rng.integers(3)],
+            thing=COMMENT_WORDS[rng.integers(4, 40)]))
+    return questions
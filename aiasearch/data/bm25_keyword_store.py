@@ -0,0 +1,626 @@
+import json
+import logging
+import shutil
+import threading
+from collections import Counter, defaultdict
+from itertools import chain, count
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from aiasearch.analyzer import Analyzer, DEFAULT_ANALYZER
+from aiasearch.data.document_id import get_document_id, with_normalized_text
+from aiasearch.data.document_store import DocumentStore, DocumentStoreTable, load_documents
+from aiasearch.data.document_table import DocumentTable
+from aiasearch.data.keyword_store import KeywordStore
+from aiasearch.log import PROJECT_NAME
+from aiasearch.metrics import DOCUMENTS, span
+
+
+class Bm25Index:
+    """
+    An inverted index over a list of token lists. Postings are held in compact arrays in the compressed sparse row
+    layout: the postings of the term at position t in the sorted vocabulary are
+    postings_docs[term_offsets[t]:term_offsets[t + 1]] with term frequencies at the same positions in postings_tf.
+    """
+
+    _ARRAYS = ("terms", "term_offsets", "postings_docs", "postings_tf", "doc_lengths")
+
+    def __init__(self, terms: np.ndarray, term_offsets: np.ndarray, postings_docs: np.ndarray,
+                 postings_tf: np.ndarray, doc_lengths: np.ndarray):
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.doc_lengths = doc_lengths
+
+    @classmethod
+    def build(cls, token_lists: list[list[str]]) -> "Bm25Index":
+        """
+        Builds an index from the tokens of each document.
+        :param token_lists: One list of tokens per document. The position in the list is the document number.
+        :return: A new index
+        """
+        doc_lengths = np.fromiter(map(len, token_lists), dtype=np.int32, count=len(token_lists))
+        vocabulary = defaultdict(count().__next__)
+        token_ids = np.fromiter(map(vocabulary.__getitem__, chain.from_iterable(token_lists)), dtype=np.int64,
+                                count=int(doc_lengths.sum()))
+
+        # renumber terms in sorted order so the vocabulary can be searched with searchsorted
+        terms = np.array(list(vocabulary), dtype=str)
+        sorted_order = np.argsort(terms, kind="stable")
+        ranks = np.empty(len(terms), dtype=np.int64)
+        ranks[sorted_order] = np.arange(len(terms))
+
+        # each distinct (term, document) pair is one posting, its count is the term frequency
+        docs = np.repeat(np.arange(len(token_lists), dtype=np.int64), doc_lengths)
+        pairs, postings_tf = np.unique(ranks[token_ids] * len(token_lists) + docs, return_counts=True)
+        term_ids = pairs // max(len(token_lists), 1)
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=term_offsets[1:])
+        return cls(terms[sorted_order], term_offsets, (pairs - term_ids * len(token_lists)).astype(np.int32),
+                   postings_tf.astype(np.int32), doc_lengths)
+
+    def save(self, directory):
+        """
+        Saves the index arrays as .npy files.
+        :param directory: Directory to save the index files to. It is created if needed.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in self._ARRAYS:
+            np.save(directory / (name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def merge(cls, indexes: list["Bm25Index"], keep: list[np.ndarray]) -> "Bm25Index":
+        """
+        Merges indexes into a new index without re-tokenizing. Documents are renumbered in order, dropping the
+        documents that are not kept.
+        :param indexes: Indexes to merge.
+        :param keep: One boolean array per index marking the documents to keep.
+        :return: A new index
+        """
+        terms = np.unique(np.concatenate([index.terms for index in indexes]))
+        doc_count = sum(int(mask.sum()) for mask in keep)
+        keys = []
+        tf = []
+        doc_lengths = []
+        base = 0
+        for index, mask in zip(indexes, keep):
+            renumbered = np.cumsum(mask, dtype=np.int64) - 1 + base
+            posting_terms = np.repeat(np.searchsorted(terms, index.terms), np.diff(index.term_offsets))
+            live = mask[index.postings_docs]
+            keys.append(posting_terms[live] * doc_count + renumbered[index.postings_docs[live]])
+            tf.append(index.postings_tf[live])
+            doc_lengths.append(index.doc_lengths[mask])
+            base += int(mask.sum())
+
+        keys = np.concatenate(keys)
+        order = np.argsort(keys)
+        keys = keys[order]
+        term_ids = keys // max(doc_count, 1)
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=term_offsets[1:])
+        # drop terms that only occurred in removed documents
+        used = np.diff(term_offsets) > 0
+        term_offsets = np.concatenate([[0], term_offsets[1:][used]])
+        return cls(terms[used], term_offsets, (keys - term_ids * doc_count).astype(np.int32),
+                   np.concatenate(tf)[order].astype(np.int32), np.concatenate(doc_lengths).astype(np.int32))
+
+    @classmethod
+    def load(cls, directory) -> "Bm25Index":
+        """
+        Opens a saved index. The arrays are memory-mapped, not read into memory.
+        :param directory: Directory the index was saved to.
+        :return: The index
+        """
+        directory = Path(directory)
+        return cls(*[np.load(directory / (name + ".npy"), mmap_mode="r") for name in cls._ARRAYS])
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.doc_lengths)
+
+    def lookup(self, terms: list[str]) -> np.ndarray:
+        """
+        :return: The vocabulary positions of the terms, -1 for terms not in the index.
+        """
+        if len(self.terms) == 0 or len(terms) == 0:
+            return np.full(len(terms), -1, dtype=np.int64)
+        query_terms = np.array(terms)
+        positions = np.searchsorted(self.terms, query_terms)
+        positions = np.minimum(positions, len(self.terms) - 1)
+        return np.where(self.terms[positions] == query_terms, positions, -1)
+
+    def postings(self, term_position: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: The document numbers and term frequencies of the term at the vocabulary position.
+        """
+        start = self.term_offsets[term_position]
+        end = self.term_offsets[term_position + 1]
+        return self.postings_docs[start:end], self.postings_tf[start:end]
+
+
+class _Segment:
+    """
+    An immutable index over a batch of added documents. Deleted documents are marked in a tombstone array.
+    """
+
+    def __init__(self, name: str, index: Bm25Index, documents, ids: list[str], deleted: np.ndarray):
+        """
+        :param documents: A DocumentTable, or a DocumentStoreTable when the store has a DocumentStore.
+        """
+        self.name = name
+        self.index = index
+        self.documents = documents
+        self.ids = ids
+        self.deleted = deleted
+
+    @property
+    def live_count(self) -> int:
+        return self.index.doc_count - int(self.deleted.sum())
+
+    @property
+    def live_length(self) -> int:
+        return int(self.index.doc_lengths[~self.deleted].sum())
+
+    def searchable(self, filter: dict = None) -> np.ndarray:
+        """
+        :return: A boolean array marking the live documents that match the filter.
+        """
+        live = ~self.deleted
+        if filter:
+            live &= self.documents.mask(filter)
+        return live
+
+    def save(self, directory: Path):
+        self.index.save(directory)
+        self.documents.save(directory)
+        np.save(directory / "ids.npy", np.array(self.ids, dtype=str))
+        self.save_deleted(directory)
+
+    def save_deleted(self, directory: Path):
+        np.save(directory / "deleted.npy", self.deleted)
+
+    @classmethod
+    def load(cls, name: str, directory: Path, document_store: DocumentStore = None) -> "_Segment":
+        documents = load_documents(directory, document_store)
+        if (directory / "ids.npy").exists():
+            ids = np.load(directory / "ids.npy").tolist()
+        else:
+            ids = [document.id for document in documents]
+        return cls(name, Bm25Index.load(directory), documents, ids, np.load(directory / "deleted.npy"))
+
+
+class Bm25KeywordStore(KeywordStore):
+    """
+    Keyword store that ranks documents with Okapi BM25 using an inverted index. Only the postings of the query terms
+    are scored, so query time depends on how common the query terms are rather than on the size of the corpus.
+
+    Each call to add_documents adds a segment; deleted documents are marked as deleted in their segment. Corpus
+    statistics only count live documents. Segments are merged in a background thread when there are too many of
+    them or too many deleted documents.
+
+    Given a DocumentStore, segments keep only the numbers of their documents and read them from the DocumentStore.
+    """
+
+    _MANIFEST_FILE = "manifest.json"
+    _FORMAT_VERSION = 2
+
+    def __init__(self, index_dir=None, id_key=None, k1=1.5, b=0.75, max_segments=8, max_deleted_ratio=0.2,
+                 background_compaction=True, analyzer: Analyzer = DEFAULT_ANALYZER,
+                 document_store: DocumentStore = None):
+        """
+        If the index_dir contains a saved index it is opened with its files memory-mapped.
+        :param index_dir: A directory to save the index files. None keeps the index in memory only.
+        :param id_key: Metadata key identifying a document's source row, used to create IDs for documents without one.
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 document length normalization.
+        :param max_segments: Segments are merged when there are more than this number.
+        :param max_deleted_ratio: Segments are merged when more than this fraction of documents is deleted.
+        :param background_compaction: Merge segments in a background thread rather than in the calling thread.
+        :param analyzer: Analyzer used for documents and queries.
+        :param document_store: Store holding the documents, shared with other stores. It must have a store_dir if
+        the index has an index_dir. None keeps the documents in the index.
+        """
+        self._logger = logging.getLogger(PROJECT_NAME)
+        if index_dir is not None and document_store is not None and not document_store.persistent:
+            raise ValueError("A keyword index with an index_dir needs a DocumentStore with a store_dir")
+        self._document_store = document_store
+        self._index_dir = Path(index_dir) if index_dir is not None else None
+        self._id_key = id_key
+        self._k1 = k1
+        self._b = b
+        self._max_segments = max_segments
+        self._max_deleted_ratio = max_deleted_ratio
+        self._background_compaction = background_compaction
+        self._analyzer = analyzer
+
+        self._lock = threading.RLock()
+        self._segments: list[_Segment] = []
+        self._locations: dict[str, tuple[_Segment, int]] = {}
+        self._next_segment = 0
+        self._live_count = 0
+        self._live_length = 0
+        # incremented whenever documents are added or deleted
+        self.version = 0
+        self._compaction_thread = None
+        # held by the running compaction, so compactions never overlap
+        self._compaction_lock = threading.Lock()
+        if self._index_dir is not None and (self._index_dir / self._MANIFEST_FILE).exists():
+            self._open()
+
+    def add_documents(self, documents: [Document]):
+        """
+        Indexes a list of Documents in a new segment. Documents with the ID of an indexed document replace it.
+        The index is saved to the index_dir if one was given.
+        :param documents: List of Langchain Document objects
+        """
+        segment = self._index_documents(documents)
+        if segment is None:
+            return
+        if self._document_store is not None:
+            self._share_documents(segment)
+        with self._lock:
+            segment.name = self._new_segment_name()
+            self._add_segment(segment)
+            if self._index_dir is not None:
+                segment.save(self._index_dir / segment.name)
+                self._save_manifest()
+        self._logger.info(f"Indexed {segment.index.doc_count} documents, {len(segment.index.terms)} terms")
+        self._maybe_compact()
+
+    def build_segment(self, documents: [Document], directory) -> int:
+        """
+        Indexes a list of Documents in a segment saved to a directory without adding it to the store, so worker
+        processes can index parts of a corpus in parallel. The segments are then added with add_segments. The
+        segment holds its documents, add_segments moves them to the DocumentStore of the store they are added to.
+        :param documents: List of Langchain Document objects
+        :param directory: Directory to save the segment files to.
+        :return: The number of documents indexed.
+        """
+        segment = self._index_documents(documents)
+        if segment is None:
+            return 0
+        segment.save(Path(directory))
+        return segment.index.doc_count
+
+    def add_segments(self, directories: list):
+        """
+        Adds segments saved by build_segment, in order. Documents with the ID of an indexed document replace it.
+        Segment files are moved into the index_dir if one was given, otherwise they are read into memory.
+        :param directories: Directories of the segments. Directories without a segment are skipped.
+        """
+        added = 0
+        for directory in directories:
+            directory = Path(directory)
+            if not (directory / "deleted.npy").exists():
+                continue
+            with self._lock:
+                name = self._new_segment_name()
+                if self._index_dir is not None:
+                    self._index_dir.mkdir(parents=True, exist_ok=True)
+                    shutil.move(directory, self._index_dir / name)
+                    directory = self._index_dir / name
+                segment = _Segment.load(name, directory)
+                if self._document_store is not None:
+                    self._share_documents(segment)
+                    if self._index_dir is not None:
+                        segment.documents.save(directory)
+                        for file_name in (DocumentTable._RECORDS_FILE, DocumentTable._OFFSETS_FILE):
+                            (directory / file_name).unlink()
+                elif self._index_dir is None:
+                    segment.documents = DocumentTable.from_records([segment.documents.record(number)
+                                                                    for number in range(len(segment.documents))])
+                if self._index_dir is None:
+                    segment.index = Bm25Index(*[np.array(getattr(segment.index, array))
+                                                for array in Bm25Index._ARRAYS])
+                self._add_segment(segment)
+                if self._index_dir is not None:
+                    self._save_manifest()
+            added += segment.index.doc_count
+        self._logger.info(f"Added {added} documents in {len(directories)} keyword index segments")
+        self._maybe_compact()
+
+    def _index_documents(self, documents: [Document]):
+        """
+        :return: An unnamed segment indexing the documents, or None if there are no documents.
+        """
+        unique_documents = {}
+        for document in documents:
+            unique_documents[get_document_id(document, self._id_key)] = document
+        if len(unique_documents) == 0:
+            return None
+        ids = list(unique_documents.keys())
+        documents = [Document(id=document_id, page_content=document.page_content,
+                              metadata=with_normalized_text(document.page_content, document.metadata))
+                     for document_id, document in unique_documents.items()]
+        with span("keyword_index", store="bm25"):
+            index = Bm25Index.build([self._analyzer.analyze(document.page_content) for document in documents])
+        DOCUMENTS.inc(len(documents), stage="indexed", store="bm25")
+        return _Segment(None, index, DocumentTable(documents), ids, np.zeros(len(ids), dtype=bool))
+
+    def _share_documents(self, segment: _Segment):
+        """
+        Moves the documents of a new segment to the DocumentStore, keeping their numbers in the segment.
+        """
+        segment.documents = self._document_store.table(self._document_store.add(list(segment.documents)))
+
+    def _new_segment_name(self) -> str:
+        name = f"segment_{self._next_segment:06d}"
+        self._next_segment += 1
+        return name
+
+    def _add_segment(self, segment: _Segment):
+        """
+        Makes a segment searchable, deleting indexed documents with the same IDs. Must be called holding the lock.
+        """
+        self.delete_documents([document_id for document_id in segment.ids if document_id in self._locations])
+        self._segments = self._segments + [segment]
+        for number, document_id in enumerate(segment.ids):
+            if not segment.deleted[number]:
+                self._locations[document_id] = (segment, number)
+        self._live_count += segment.live_count
+        self._live_length += segment.live_length
+        self.version += 1
+
+    def delete_documents(self, ids: [str]):
+        """
+        Deletes documents from the index. Unknown IDs are ignored.
+        :param ids: IDs of the documents to delete.
+        """
+        with self._lock:
+            changed = set()
+            for document_id in ids:
+                location = self._locations.pop(document_id, None)
+                if location is None:
+                    continue
+                segment, number = location
+                segment.deleted[number] = True
+                self._live_count -= 1
+                self._live_length -= int(segment.index.doc_lengths[number])
+                changed.add(segment)
+            if len(changed) > 0:
+                self.version += 1
+            if self._index_dir is not None:
+                for segment in changed:
+                    segment.save_deleted(self._index_dir / segment.name)
+        if len(changed) > 0:
+            self._maybe_compact()
+
+    def sync_documents(self, documents: [Document]):
+        """
+        Makes the index match the list of Documents. New and changed documents are indexed, unchanged documents are
+        skipped and documents no longer in the list are deleted.
+        :param documents: The complete list of Langchain Document objects
+        """
+        current = {get_document_id(document, self._id_key): document for document in documents}
+        with self._lock:
+            stale_ids = [document_id for document_id in self._locations if document_id not in current]
+            new_documents = [document for document_id, document in current.items()
+                             if document_id not in self._locations]
+            self.delete_documents(stale_ids)
+            self.add_documents(new_documents)
+        self._logger.info(f"Synced keyword index: {len(new_documents)} added, {len(stale_ids)} deleted")
+
+    def search_documents(self, text: str, k=10, filter: dict = None) -> list[Document]:
+        """
+        Searches for documents containing the words in text ranked by BM25 score.
+        :param text: Text to search for.
+        :param k: Maximum number of results to return. default: 10
+        :param filter: Only documents whose metadata matches the filter are scored. Corpus statistics still count
+        every live document, so a document scores the same with or without a filter.
+        :return: A list of matched documents, highest score first.
+        """
+        with span("keyword_search", store="bm25"):
+            segments = self._segments
+            segment_numbers, doc_numbers, scores = self._score(segments, self._analyzer.analyze(text), filter)
+            top = self._top_k(scores, k)
+            documents = [segments[segment_number].documents[doc_number]
+                         for segment_number, doc_number in zip(segment_numbers[top].tolist(),
+                                                               doc_numbers[top].tolist())]
+        DOCUMENTS.inc(len(documents), stage="retrieved", store="bm25")
+        return documents
+
+    def get_document_count(self) -> int:
+        """
+        :return: Number of documents
+        """
+        return self._live_count
+
+    def document_numbers(self) -> np.ndarray:
+        """
+        :return: The numbers of the live documents in the DocumentStore, for DocumentStore.compact.
+        """
+        if self._document_store is None:
+            raise ValueError("The keyword index does not have a DocumentStore")
+        with self._lock:
+            return np.concatenate([np.zeros(0, dtype=np.int64)] +
+                                  [segment.documents.numbers[~segment.deleted] for segment in self._segments])
+
+    def compact(self):
+        """
+        Merges all segments into one, removing deleted documents. Runs in the calling thread, after a compaction
+        already running has finished.
+        """
+        self._compact(wait=True)
+
+    def _compact(self, wait: bool):
+        """
+        :param wait: Wait for a running compaction to finish. Otherwise return at once if one is running, which
+        callers holding the lock must do, as the running compaction needs the lock to finish.
+        """
+        if not self._compaction_lock.acquire(blocking=wait):
+            return
+        try:
+            self._merge_segments()
+        finally:
+            self._compaction_lock.release()
+
+    def _merge_segments(self):
+        """
+        Merges the current segments into one. Must be called holding the compaction lock, so the merged segments
+        are still in the store when they are replaced.
+        """
+        with self._lock:
+            segments = self._segments
+            if len(segments) == 0 or (len(segments) == 1 and not segments[0].deleted.any()):
+                return
+            name = self._new_segment_name()
+            keep = [~segment.deleted for segment in segments]
+
+        index = Bm25Index.merge([segment.index for segment in segments], keep)
+        kept = [(segment, number) for segment, mask in zip(segments, keep)
+                for number in np.flatnonzero(mask).tolist()]
+        if self._document_store is None:
+            documents = DocumentTable.from_records([segment.documents.record(number)
+                                                    for segment, number in kept])
+        else:
+            documents = self._document_store.table(np.concatenate([segment.documents.numbers[mask]
+                                                                   for segment, mask in zip(segments, keep)]))
+        ids = [segment.ids[number] for segment, number in kept]
+        merged = _Segment(name, index, documents, ids, np.zeros(len(ids), dtype=bool))
+        if self._index_dir is not None:
+            merged.save(self._index_dir / name)
+
+        with self._lock:
+            # documents deleted or replaced while the segments were merged no longer point into the merged segments
+            for number, (document_id, (segment, old_number)) in enumerate(zip(ids, kept)):
+                location = self._locations.get(document_id)
+                if location is not None and location[0] is segment and location[1] == old_number:
+                    self._locations[document_id] = (merged, number)
+                else:
+                    merged.deleted[number] = True
+            # segments added while merging stay, only the merged segments are replaced
+            merged_segments = {id(segment) for segment in segments}
+            self._segments = [merged] + [segment for segment in self._segments if id(segment) not in merged_segments]
+            if self._index_dir is not None:
+                merged.save_deleted(self._index_dir / name)
+                self._save_manifest()
+                for segment in segments:
+                    shutil.rmtree(self._index_dir / segment.name, ignore_errors=True)
+        self._logger.info(f"Merged {len(segments)} keyword index segments into {name}")
+
+    def wait_for_compaction(self):
+        """
+        Blocks until a running background compaction has finished.
+        """
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join()
+
+    def _maybe_compact(self):
+        with self._lock:
+            segments = self._segments
+            total = sum(segment.index.doc_count for segment in segments)
+            deleted_ratio = 1.0 - self._live_count / total if total > 0 else 0.0
+            if len(segments) <= self._max_segments and deleted_ratio <= self._max_deleted_ratio:
+                return
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            if not self._background_compaction:
+                self._compaction_thread = None
+            else:
+                self._compaction_thread = threading.Thread(target=self.compact, name="bm25-compaction", daemon=True)
+                self._compaction_thread.start()
+                return
+        self._compact(wait=False)
+
+    def _save_manifest(self):
+        manifest = {"format_version": self._FORMAT_VERSION,
+                    "analyzer": self._analyzer.name,
+                    "segments": [segment.name for segment in self._segments],
+                    "next_segment": self._next_segment}
+        temp_path = self._index_dir / (self._MANIFEST_FILE + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        temp_path.replace(self._index_dir / self._MANIFEST_FILE)
+
+    def _open(self):
+        with open(self._index_dir / self._MANIFEST_FILE, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != self._FORMAT_VERSION:
+            self._logger.warning(f"Keyword index in {self._index_dir} has an unsupported format and was not opened")
+            return
+        if manifest.get("analyzer") != self._analyzer.name:
+            self._logger.warning(f"Keyword index in {self._index_dir} was built with analyzer "
+                                 f"{manifest.get('analyzer')}, searching with {self._analyzer.name}")
+        self._next_segment = manifest["next_segment"]
+        for name in manifest["segments"]:
+            segment = _Segment.load(name, self._index_dir / name, self._document_store)
+            self._segments.append(segment)
+            for number in np.flatnonzero(~segment.deleted).tolist():
+                self._locations[segment.ids[number]] = (segment, number)
+            self._live_count += segment.live_count
+            self._live_length += segment.live_length
+        self._logger.info(f"Opened keyword index with {self._live_count} documents in {len(self._segments)} segments")
+
+    def _score(self, segments: list[_Segment], query_tokens: list[str],
+               filter: dict = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Computes BM25 scores over the live postings of the query terms, keeping only the postings of documents that
+        match the filter.
+        :return: Segment numbers and document numbers of the documents that contain at least one query term, and
+        their scores.
+        """
+        empty = (np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float32))
+        doc_count = self._live_count
+        if doc_count == 0 or len(query_tokens) == 0:
+            return empty
+        average_length = max(self._live_length, 1) / doc_count
+        query_counts = Counter(query_tokens)
+        query_terms = list(query_counts.keys())
+
+        # live postings of every query term in every segment
+        postings = {term: [] for term in query_terms}
+        matched = {}
+        for segment_number, segment in enumerate(segments):
+            positions = segment.index.lookup(query_terms)
+            for term, position in zip(query_terms, positions.tolist()):
+                if position < 0:
+                    continue
+                docs, tf = segment.index.postings(position)
+                if filter:
+                    if segment_number not in matched:
+                        matched[segment_number] = segment.searchable(filter)
+                    live = matched[segment_number][docs]
+                else:
+                    live = ~segment.deleted[docs]
+                if live.any():
+                    postings[term].append((segment_number, segment, docs[live], tf[live]))
+
+        # document numbers are made unique across segments by adding the total size of the preceding segments
+        bases = np.cumsum([0] + [segment.index.doc_count for segment in segments])
+        key_parts = []
+        score_parts = []
+        for term, query_count in query_counts.items():
+            document_frequency = sum(len(docs) for _, _, docs, _ in postings[term])
+            if document_frequency == 0:
+                continue
+            idf = np.log(1.0 + (doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            for segment_number, segment, docs, tf in postings[term]:
+                tf = tf.astype(np.float32)
+                norm = self._k1 * (1.0 - self._b + self._b * segment.index.doc_lengths[docs] / average_length)
+                key_parts.append(docs + bases[segment_number])
+                score_parts.append(query_count * idf * tf * (self._k1 + 1.0) / (tf + norm))
+        if len(key_parts) == 0:
+            return empty
+
+        keys, inverse = np.unique(np.concatenate(key_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts), minlength=len(keys))
+        segment_numbers = np.searchsorted(bases, keys, side="right") - 1
+        return segment_numbers, keys - bases[segment_numbers], scores
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """
+        :return: Positions of the k highest scores, highest first.
+        """
+        if k <= 0:
+            return np.array([], dtype=np.int64)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(-scores[top], kind="stable")]
@@ -0,0 +1,227 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.documents import Document
+
+from aiasearch.data.keyword_store import KeywordStore
+from aiasearch.data.metadata_filter import filter_key
+from aiasearch.data.vector_store import VectorStore
+from aiasearch.log import PROJECT_NAME
+from aiasearch.metrics import record_cache
+
+
+class QueryCache:
+    """
+    A thread safe least recently used cache whose entries expire after a time to live.
+    """
+
+    def __init__(self, max_size=1024, ttl=300.0, name="query"):
+        """
+        :param max_size: Maximum number of entries.
+        :param ttl: Seconds an entry is valid for. None keeps entries until they are evicted.
+        :param name: Name of the cache in the cache metrics.
+        """
+        self._name = name
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :return: The cached value, or None if the key is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    record_cache(self._name, True)
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            record_cache(self._name, False)
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            expires = time.monotonic() + self._ttl if self._ttl is not None else None
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _CachedStore:
+    """
+    Search result caching shared by CachedVectorStore and CachedKeywordStore. Results are keyed by the query text with
+    runs of whitespace collapsed, k and the filter. The cache is cleared whenever the store's version changes, which
+    stores increment on every add or delete, so writes made directly to the wrapped store also invalidate it.
+    """
+
+    def __init__(self, store, max_size=1024, ttl=300.0, name="search"):
+        self._logger = logging.getLogger(PROJECT_NAME)
+        self._store = store
+        self._cache = QueryCache(max_size=max_size, ttl=ttl, name=name)
+        self._version = self._store_version()
+        # incremented by invalidate, so results of searches that started before it are not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def hits(self) -> int:
+        return self._cache.hits
+
+    @property
+    def misses(self) -> int:
+        return self._cache.misses
+
+    def add_documents(self, documents: [Document]):
+        self._store.add_documents(documents)
+        self.invalidate()
+
+    def search_documents(self, text: str, k=10, filter: dict = None) -> list[Document]:
+        """
+        Returns cached results for the query, searching the wrapped store on a miss.
+        :param text: Text to search for.
+        :param k: Maximum number of results to return. default: 10
+        :param filter: Filter on metadata passed to the wrapped store.
+        :return: A list of matched documents.
+        """
+        key = self._key(text, k, filter)
+        documents = self._cache.get(key)
+        if documents is None:
+            snapshot = self._snapshot()
+            documents = self._store.search_documents(text, k, filter=filter)
+            self._put(key, documents, snapshot)
+        return list(documents)
+
+    def search_documents_batch(self, texts: [str], k=10, filter: dict = None) -> list[list[Document]]:
+        """
+        Returns cached results for each query, searching the wrapped store for the missed queries in one batch.
+        :param texts: Texts to search for.
+        :param k: Maximum number of results per query. default: 10
+        :param filter: Filter on metadata passed to the wrapped store.
+        :return: A list of matched documents for each query.
+        """
+        keys = [self._key(text, k, filter) for text in texts]
+        results = [self._cache.get(key) for key in keys]
+        missed = [number for number, documents in enumerate(results) if documents is None]
+        if len(missed) > 0:
+            snapshot = self._snapshot()
+            searched = self._store.search_documents_batch([texts[number] for number in missed], k, filter=filter)
+            for number, documents in zip(missed, searched):
+                self._put(keys[number], documents, snapshot)
+                results[number] = documents
+        return [list(documents) for documents in results]
+
+    async def asearch_documents(self, text: str, k=10, filter: dict = None) -> list[Document]:
+        """
+        Async search_documents. Cached results are returned without awaiting the wrapped store.
+        """
+        key = self._key(text, k, filter)
+        documents = self._cache.get(key)
+        if documents is None:
+            snapshot = self._snapshot()
+            documents = await self._store.asearch_documents(text, k, filter=filter)
+            self._put(key, documents, snapshot)
+        return list(documents)
+
+    def _key(self, text: str, k: int, filter: dict = None) -> tuple:
+        """
+        :return: The cache key of a query. The cache is cleared first if the store has changed.
+        """
+        with self._lock:
+            if self._store_version() != self._version:
+                self._clear()
+        return self._normalize(text), k, filter_key(filter)
+
+    def _normalize(self, text: str) -> str:
+        return " ".join(text.split())
+
+    def invalidate(self):
+        """
+        Removes every cached result.
+        """
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        # called with the lock held
+        self._generation += 1
+        self._cache.clear()
+        self._version = self._store_version()
+
+    def _snapshot(self) -> tuple:
+        """
+        :return: The state of the cache and the store before a search.
+        """
+        return self._generation, self._store_version()
+
+    def _put(self, key: tuple, documents: list[Document], snapshot: tuple):
+        """
+        Caches the results of a search unless the store changed while it ran, as they may be stale.
+        """
+        with self._lock:
+            if snapshot == (self._generation, self._store_version()):
+                self._cache.put(key, documents)
+
+    def _store_version(self):
+        return getattr(self._store, "version", None)
+
+    def __getattr__(self, name):
+        # other store methods such as sync_documents and save are passed through
+        return getattr(self._store, name)
+
+
+class CachedVectorStore(_CachedStore, VectorStore):
+    """
+    Caches the search results of a VectorStore. Repeated queries are answered without embedding the query. Queries
+    differing in case are cached apart, as their embeddings differ.
+    """
+
+    def __init__(self, store: VectorStore, max_size=1024, ttl=300.0):
+        """
+        :param store: Vector store to cache.
+        :param max_size: Maximum number of cached queries.
+        :param ttl: Seconds a cached result is valid for. None keeps results until they are evicted or invalidated.
+        """
+        super().__init__(store, max_size, ttl, "vector_search")
+
+    def get_document_count(self) -> int:
+        return self._store.get_document_count()
+
+
+class CachedKeywordStore(_CachedStore, KeywordStore):
+    """
+    Caches the search results of a KeywordStore. Queries differing only in case share their results, as the analyzer
+    folds case.
+    """
+
+    def __init__(self, store: KeywordStore, max_size=1024, ttl=300.0):
+        """
+        :param store: Keyword store to cache.
+        :param max_size: Maximum number of cached queries.
+        :param ttl: Seconds a cached result is valid for. None keeps results until they are evicted or invalidated.
+        """
+        super().__init__(store, max_size, ttl, "keyword_search")
+
+    def delete_documents(self, ids: [str]):
+        self._store.delete_documents(ids)
+        self.invalidate()
+
+    def _normalize(self, text: str) -> str:
+        return " ".join(text.casefold().split())
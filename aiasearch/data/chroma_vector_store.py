@@ -1,44 +1,83 @@
+import asyncio
 import logging
 import os
 import shutil
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional
 
+import numpy as np
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
-from langchain_ollama import OllamaEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.embeddings import Embeddings
 
 from aiasearch import stopwords
+from aiasearch.analyzer import Analyzer, DEFAULT_ANALYZER
+from aiasearch.data.document_id import split_documents
+from aiasearch.data.document_store import DocumentStore
+from aiasearch.data.embedding_backend import EmbeddingBackend, OllamaEmbeddingBackend
+from aiasearch.data.embedding_cache import CachedEmbeddings
+from aiasearch.data.metadata_filter import MetadataIndex, to_chroma_where
 from aiasearch.data.vector_store import VectorStore
 from aiasearch.log import PROJECT_NAME
+from aiasearch.metrics import CHUNKS, DOCUMENTS, span
 
 
 class ChromaVectorStore(VectorStore):
     """
     Vector store for similarity searching a repository of text. The search result documents are intended to be fed
     to an LLM with the user's question and the answer to be found without in the documents.
+
+    Given a DocumentStore, Chroma stores the embeddings and metadata of the chunks but not their text, and the chunks
+    returned by a search are read from the DocumentStore.
     """
 
-    def __init__(self, vectorstore_dir, overwrite=False):
+    # Maximum number of IDs sent to Chroma in a single get or delete call.
+    _ID_BATCH_SIZE = 1000
+
+    def __init__(self, vectorstore_dir, overwrite=False, id_key=None, embedding_batch_size=64, embedding_workers=4,
+                 progress_callback: Optional[Callable[[int, int], None]] = None, embeddings: Embeddings = None,
+                 embedding_cache_dir=None, embedding_cache_size=1000000, analyzer: Analyzer = DEFAULT_ANALYZER,
+                 embedding_backend: EmbeddingBackend = None, document_store: DocumentStore = None):
         """
         Creates a vector store that wraps the Langchain Chroma implementation.
-        Ollama and the nomic-embed-text model are used for generating word embeddings.
+        By default Ollama and the nomic-embed-text model are used for generating word embeddings.
         The Ollama host is set using the "OLLAMA_HOST" environment variable.
         If the vectorstore_dir exists the existing vector store will be loaded.
         :param vectorstore_dir: A directory to save the vector store files.
         :param overwrite: Will first delete the vector store directory
+        :param id_key: Metadata key identifying a document's source row, such as "permitnumber". Each chunk is stored
+        under "<source>:<content hash>" so unchanged chunks are never embedded twice.
+        :param embedding_batch_size: Number of chunks sent to the embedding model in one request.
+        :param embedding_workers: Maximum number of embedding requests in flight at the same time.
+        :param progress_callback: Called with (embedded chunk count, total chunk count) after each batch is stored.
+        :param embeddings: Embeddings used for documents and queries. Defaults to nomic-embed-text on Ollama.
+        :param embedding_cache_dir: A directory to cache embeddings in. Identical text is then embedded only once,
+        across rebuilds of the vector store and across repeated queries.
+        :param embedding_cache_size: Maximum number of embeddings kept in the cache.
+        :param analyzer: Analyzer used to remove stop words from queries.
+        :param embedding_backend: Backend used for documents and queries, such as HashingEmbeddingBackend to embed
+        in process without Ollama. Defaults to OllamaEmbeddingBackend. Ignored if embeddings is given.
+        :param document_store: Store holding the text of the chunks, shared with other stores. It should have a
+        store_dir, as Chroma does not keep the text. None keeps the text in Chroma.
         """
         self._logger = logging.getLogger(PROJECT_NAME)
         self._vectorstore = None
+        self._document_store = document_store
+        # incremented whenever documents are added or deleted
+        self.version = 0
+        # (version, ids, MetadataIndex) of the stored metadata for filters Chroma cannot evaluate
+        self._metadata_index = None
         self._vectorstore_dir = vectorstore_dir
-        self._ollama_host = "127.0.0.1:11434"
-        try:
-            host: str = os.environ["OLLAMA_HOST"]
-            if host is not None:
-                self._ollama_host = host
-        except KeyError:
-            self._logger.info("key OLLAMA_HOST not found in environment variables")
-
-        self._local_embeddings = OllamaEmbeddings(model="nomic-embed-text", base_url=self._ollama_host)
+        self._id_key = id_key
+        self._embedding_batch_size = embedding_batch_size
+        self._embedding_workers = embedding_workers
+        self._progress_callback = progress_callback
+
+        if embeddings is None:
+            embeddings = embedding_backend if embedding_backend is not None else OllamaEmbeddingBackend()
+        if embedding_cache_dir is not None:
+            embeddings = CachedEmbeddings(embeddings, embedding_cache_dir, max_entries=embedding_cache_size)
+        self._local_embeddings = embeddings
         if overwrite:
             self.delete_vectorstore()
         if os.path.exists(self._vectorstore_dir):
@@ -47,37 +86,248 @@ class ChromaVectorStore(VectorStore):
                 embedding_function=self._local_embeddings
             )
 
-        self.stop_words = stopwords.load_stop_words()
+        self.stop_words = stopwords.STOP_WORDS
+        self._analyzer = analyzer
 
     def add_documents(self, documents: [Document]) -> None:
         """
         Adds a list of Documents to the vector store. If the store does not exist it will be created.
+        Chunks already stored with the same ID are skipped.
         :param documents: List of Langchain Document objects
         """
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-        split_documents = text_splitter.split_documents(documents)
+        with span("vector_add_documents", store="chroma"):
+            self._add_split_documents(self._split_documents(documents))
+        DOCUMENTS.inc(len(documents), stage="indexed", store="chroma")
+
+    def add_split_documents(self, split_documents: [Document]) -> None:
+        """
+        Adds chunks already split and given IDs by split_documents, for example by worker processes. Chunks already
+        stored with the same ID are skipped.
+        :param split_documents: List of chunks
+        """
+        with span("vector_add_documents", store="chroma"):
+            self._add_split_documents(split_documents)
+
+    def _add_split_documents(self, split_documents: [Document]) -> None:
+        """
+        Embeds and stores the chunks that are not already in the vector store.
+        """
         if self._vectorstore is None:
-            self._vectorstore = Chroma.from_documents(documents=split_documents, embedding=self._local_embeddings,
-                                                  persist_directory=self._vectorstore_dir)
-        else:
-            self._vectorstore.add_documents(split_documents)
+            self._vectorstore = Chroma(persist_directory=self._vectorstore_dir,
+                                       embedding_function=self._local_embeddings)
+
+        if self._document_store is not None:
+            # chunks already in Chroma are stored too, the DocumentStore may be newer than the vector store
+            self._document_store.add(split_documents)
+        existing_ids = self._get_existing_ids([document.id for document in split_documents])
+        new_documents = [document for document in split_documents if document.id not in existing_ids]
+        self._logger.info(f"Adding {len(new_documents)} of {len(split_documents)} chunks to the vector store")
+        if len(new_documents) > 0:
+            self._embed_and_store(new_documents)
+            self.version += 1
+
+    def _embed_and_store(self, documents: [Document]) -> None:
+        """
+        Embeds chunks in batches on a pool of workers and writes each batch to Chroma as soon as it is embedded.
+        At most two batches per worker are pending so finished embeddings do not pile up in memory.
+        """
+        batches = [documents[start:start + self._embedding_batch_size]
+                   for start in range(0, len(documents), self._embedding_batch_size)]
+        max_pending = self._embedding_workers * 2
+        embedded_count = 0
+        with ThreadPoolExecutor(max_workers=self._embedding_workers) as executor:
+            pending = {}
+            next_batch = 0
+            while next_batch < len(batches) or len(pending) > 0:
+                while next_batch < len(batches) and len(pending) < max_pending:
+                    texts = [document.page_content for document in batches[next_batch]]
+                    pending[executor.submit(self._embed_batch, texts)] = batches[next_batch]
+                    next_batch += 1
 
-    def search_documents(self, text: str, k=10) -> list[Document]:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    with span("vector_upsert", store="chroma"):
+                        self._vectorstore._collection.upsert(
+                            ids=[document.id for document in batch],
+                            embeddings=future.result(),
+                            documents=[document.page_content for document in batch]
+                            if self._document_store is None else None,
+                            metadatas=[document.metadata or None for document in batch]
+                        )
+                    CHUNKS.inc(len(batch), stage="embedded", store="chroma")
+                    embedded_count += len(batch)
+                    self._logger.debug(f"Embedded {embedded_count} of {len(documents)} chunks")
+                    if self._progress_callback is not None:
+                        self._progress_callback(embedded_count, len(documents))
+
+    def _embed_batch(self, texts: [str]) -> list[list[float]]:
+        with span("embed", store="chroma"):
+            return self._local_embeddings.embed_documents(texts)
+
+    def sync_documents(self, documents: [Document]) -> None:
+        """
+        Makes the vector store match the list of Documents. New and changed chunks are embedded, unchanged chunks are
+        skipped and chunks whose source documents are no longer in the list are deleted.
+        :param documents: The complete list of Langchain Document objects
+        """
+        split_documents = self._split_documents(documents)
+        self._add_split_documents(split_documents)
+        current_ids = {document.id for document in split_documents}
+        stale_ids = [stored_id for stored_id in self._vectorstore.get(include=[])["ids"]
+                     if stored_id not in current_ids]
+        self.delete_documents(stale_ids)
+
+    def delete_documents(self, ids: [str]) -> None:
+        """
+        Deletes chunks from the vector store.
+        :param ids: IDs of the chunks to delete.
+        """
+        if self._vectorstore is None or len(ids) == 0:
+            return
+        self._logger.info(f"Deleting {len(ids)} chunks from the vector store")
+        for start in range(0, len(ids), self._ID_BATCH_SIZE):
+            self._vectorstore.delete(ids=ids[start:start + self._ID_BATCH_SIZE])
+        self.version += 1
+
+    def _split_documents(self, documents: [Document]) -> [Document]:
+        """
+        Splits documents into chunks and assigns each chunk its stable ID. Duplicate chunks are dropped.
+        """
+        with span("split", store="chroma"):
+            chunks = split_documents(documents, self._id_key)
+        CHUNKS.inc(len(chunks), stage="split", store="chroma")
+        return chunks
+
+    def _get_existing_ids(self, ids: [str]) -> set[str]:
+        """
+        :return: The subset of ids already stored in the vector store.
+        """
+        existing_ids = set()
+        for start in range(0, len(ids), self._ID_BATCH_SIZE):
+            result = self._vectorstore.get(ids=ids[start:start + self._ID_BATCH_SIZE], include=[])
+            existing_ids.update(result["ids"])
+        return existing_ids
+
+    def search_documents(self, text: str, k=10, filter: dict = None) -> list[Document]:
         """
         Performs a similarity search on the vector store using the provided text.
         :param text: Text to search for.
         :param k: Maximum number of results to return. default: 10
+        :param filter: Only documents whose metadata matches the filter are searched.
         :return: A list of matched documents.
         """
 
         # semantic search
-        words = text.split()
-        filtered_words = [word for word in words if word.lower() not in self.stop_words]
-        filtered_question = ' '.join(filtered_words)
-        search_result_documents: list[Document] = self._vectorstore.similarity_search(filtered_question, k=k)
+        with span("vector_search", store="chroma"):
+            filtered_question = self._analyzer.remove_stop_words(text)
+            if filter or self._document_store is not None:
+                search_result_documents = self._query([self._local_embeddings.embed_query(filtered_question)], k,
+                                                      filter)[0]
+            else:
+                search_result_documents: list[Document] = self._vectorstore.similarity_search(filtered_question, k=k)
+        DOCUMENTS.inc(len(search_result_documents), stage="retrieved", store="chroma")
 
         return search_result_documents
 
+    def search_documents_batch(self, texts: [str], k=10, filter: dict = None) -> list[list[Document]]:
+        """
+        Performs similarity searches for several queries. The queries are embedded in a single batch and looked up
+        with a single Chroma query.
+        :param texts: Texts to search for.
+        :param k: Maximum number of results per query. default: 10
+        :param filter: Only documents whose metadata matches the filter are searched.
+        :return: A list of matched documents for each query.
+        """
+        if len(texts) == 0:
+            return []
+        with span("vector_search_batch", store="chroma"):
+            embeddings = self._local_embeddings.embed_documents(
+                [self._analyzer.remove_stop_words(text) for text in texts])
+            results = self._query(embeddings, k, filter)
+        DOCUMENTS.inc(sum(len(documents) for documents in results), stage="retrieved", store="chroma")
+        return results
+
+    async def asearch_documents(self, text: str, k=10, filter: dict = None) -> list[Document]:
+        """
+        Performs a similarity search without blocking the event loop. The query is embedded with the async
+        embedding client and the Chroma lookup runs in a worker thread.
+        :param text: Text to search for.
+        :param k: Maximum number of results to return. default: 10
+        :param filter: Only documents whose metadata matches the filter are searched.
+        :return: A list of matched documents.
+        """
+        with span("vector_search", store="chroma"):
+            embedding = await self._local_embeddings.aembed_query(self._analyzer.remove_stop_words(text))
+            if filter or self._document_store is not None:
+                documents = (await asyncio.to_thread(self._query, [embedding], k, filter))[0]
+            else:
+                documents = await asyncio.to_thread(self._vectorstore.similarity_search_by_vector, embedding, k=k)
+        DOCUMENTS.inc(len(documents), stage="retrieved", store="chroma")
+        return documents
+
+    def _query(self, embeddings: list[list[float]], k: int, filter: dict = None) -> list[list[Document]]:
+        """
+        Looks up query embeddings with a single Chroma query. The filter is translated to a Chroma where clause so
+        Chroma only scores matching documents. Filters Chroma cannot evaluate, such as $prefix, are evaluated here on
+        an index of the stored metadata and the matching IDs are passed to Chroma instead.
+        :return: The matched documents of each query embedding.
+        """
+        where = None
+        ids = None
+        if filter:
+            where = to_chroma_where(filter)
+            if where is None:
+                stored_ids, index = self._stored_metadata_index()
+                ids = [stored_ids[number] for number in index.mask(filter).nonzero()[0]]
+                if len(ids) == 0:
+                    return [[] for _ in embeddings]
+        if self._document_store is not None:
+            results = self._vectorstore._collection.query(query_embeddings=embeddings, n_results=k, where=where,
+                                                          ids=ids, include=[])
+            return [self._stored_documents(result_ids) for result_ids in results["ids"]]
+        results = self._vectorstore._collection.query(query_embeddings=embeddings, n_results=k, where=where, ids=ids,
+                                                      include=["documents", "metadatas"])
+        return [[Document(id=document_id, page_content=page_content, metadata=metadata or {})
+                 for document_id, page_content, metadata in zip(result_ids, page_contents, metadatas)]
+                for result_ids, page_contents, metadatas in zip(results["ids"], results["documents"],
+                                                                results["metadatas"])]
+
+    def _stored_metadata_index(self) -> tuple[list[str], MetadataIndex]:
+        """
+        :return: The IDs of the stored chunks and an index of their metadata. The index is read from Chroma once and
+        kept until documents are added or deleted.
+        """
+        cached = self._metadata_index
+        if cached is not None and cached[0] == self.version:
+            return cached[1], cached[2]
+        version = self.version
+        stored = self._vectorstore._collection.get(include=["metadatas"])
+        index = MetadataIndex([metadata or {} for metadata in stored["metadatas"]])
+        self._metadata_index = (version, stored["ids"], index)
+        return stored["ids"], index
+
+    def _stored_documents(self, ids: [str]) -> list[Document]:
+        """
+        :return: The chunks with the IDs read from the DocumentStore. Chunks missing from it are skipped.
+        """
+        numbers = self._document_store.lookup(ids)
+        if (numbers < 0).any():
+            self._logger.warning(f"{int((numbers < 0).sum())} chunks are missing from the document store, sync the "
+                                 f"vector store to add them")
+        return self._document_store.get(numbers[numbers >= 0])
+
+    def document_numbers(self) -> np.ndarray:
+        """
+        :return: The numbers of the stored chunks in the DocumentStore, for DocumentStore.compact.
+        """
+        if self._document_store is None:
+            raise ValueError("The vector store does not have a DocumentStore")
+        if self._vectorstore is None:
+            return np.zeros(0, dtype=np.int64)
+        numbers = self._document_store.lookup(self._vectorstore.get(include=[])["ids"])
+        return numbers[numbers >= 0]
+
     def delete_vectorstore(self):
         """
         Deletes the vector store directory.
@@ -91,4 +341,4 @@ class ChromaVectorStore(VectorStore):
         """
         if self._vectorstore is None:
             return 0
-        return len(self._vectorstore.get())
+        return self._vectorstore._collection.count()
@@ -1,7 +1,12 @@
+import io
+import os
+from typing import BinaryIO, Iterator
+
 import pandas as pd
 from langchain_core.documents import Document
 
 from aiasearch.data.loader import Loader
+from aiasearch.metrics import DOCUMENTS, span
 
 
 # noinspection GrazieInspection
@@ -10,10 +15,14 @@ class CsvLoader(Loader):
     Class used to load data from a csv file.
     """
 
+    # bytes read at a time when partitioning a file
+    _BLOCK_SIZE = 1 << 24
+
     def __init__(self):
         pass
 
-    def load(self, file_path="", label_columns=None, combine_columns=None, metadata_columns=None, max_rows=-1):
+    def load(self, file_path="", label_columns=None, combine_columns=None, metadata_columns=None, max_rows=-1,
+             metadata_types=None):
         """
         Loads data from a csv file. The file must contain a header row with column names. Each column's value will be
         appended to the document's content.
@@ -23,32 +32,227 @@ class CsvLoader(Loader):
         :param combine_columns: List of columns to load. An empty list will return all columns.
         :param metadata_columns: List of columns to add to the document's metadata.
         :param max_rows: Limit the number of rows to load. -1 will return all rows.
+        :param metadata_types: Dictionary of metadata columns to convert from text, so they can be filtered on.
+        {"declared_valuation": "float", "issued_date": "datetime"}, see documents_from_frame.
         :return A document list
         """
+        documents = []
+        with span("csv_load"):
+            for batch in self.load_iter(file_path=file_path, label_columns=label_columns,
+                                        combine_columns=combine_columns, metadata_columns=metadata_columns,
+                                        max_rows=max_rows, chunksize=None, metadata_types=metadata_types):
+                documents.extend(batch)
+        return documents
 
-        if max_rows == -1:
-            df = pd.read_csv(file_path, on_bad_lines="skip")
-        else:
-            df = pd.read_csv(file_path, on_bad_lines="skip", nrows=max_rows)
-
+    def load_iter(self, file_path="", label_columns=None, combine_columns=None, metadata_columns=None, max_rows=-1,
+                  chunksize=100000, metadata_types=None, byte_range=None) -> Iterator[list[Document]]:
+        """
+        Loads data from a csv file in batches of documents so memory use does not grow with the file size.
+        Only the label, combine and metadata columns are read from the file. Values are read as text, missing
+        values become empty strings.
+        :param file_path: full path to file including file name
+        :param label_columns: Dictionary of columns to map to labels at the beginning of the text.
+        :param combine_columns: List of columns to load. None will load all columns.
+        :param metadata_columns: List of columns to add to the document's metadata.
+        :param max_rows: Limit the number of rows to load. -1 will return all rows.
+        :param chunksize: Number of rows per yielded batch. None reads the file in a single batch.
+        :param metadata_types: Dictionary of metadata columns to convert from text.
+        :param byte_range: (start, end) byte offsets of the records to read, from partition. None reads the file.
+        :return: A generator of document lists
+        """
         if label_columns is None:
-            label_columns = []
-        if combine_columns is None:
-            combine_columns = list(df.columns)
+            label_columns = {}
         if metadata_columns is None:
             metadata_columns = []
 
-        documents = []
-        for index, row in df.iterrows():
-            page_content = ""
-            for column_name in label_columns:
-                page_content += str(label_columns[column_name]) + ": " + str(row[column_name]) + "\n"
-            for column_name in combine_columns:
-                page_content += str(row[column_name]) + " "
-            page_content.rstrip(' ')
-            metadata = {}
-            for column_name in metadata_columns:
-                metadata[column_name] = str(row[column_name])
-            documents.append(Document(page_content=page_content, metadata=metadata))
+        usecols = None
+        if combine_columns is not None:
+            usecols = list(dict.fromkeys([*label_columns, *combine_columns, *metadata_columns]))
 
-        return documents
+        source = file_path
+        if byte_range is not None:
+            with open(file_path, "rb") as f:
+                header_end = self._record_end(f, 0)
+                f.seek(0)
+                header = f.read(header_end)
+                f.seek(byte_range[0])
+                source = io.BytesIO(header + f.read(byte_range[1] - byte_range[0]))
+
+        reader = pd.read_csv(source, on_bad_lines="skip", usecols=usecols, dtype=str, keep_default_na=False,
+                             nrows=None if max_rows == -1 else max_rows, chunksize=chunksize)
+        if chunksize is None:
+            reader = [reader]
+
+        for df in reader:
+            documents = self.documents_from_frame(df, label_columns, combine_columns, metadata_columns,
+                                                  metadata_types)
+            DOCUMENTS.inc(len(documents), stage="loaded")
+            yield documents
+
+    @staticmethod
+    def partition(file_path, partitions: int) -> list[tuple[int, int]]:
+        """
+        Splits the records of a csv file into byte ranges of about equal size that can be loaded in parallel with
+        load_iter. Ranges end at record boundaries: a newline inside a quoted value, such as a multi line comment,
+        does not end a record. Quotes are tracked from the start of the file to tell whether a position is inside a
+        quoted value, which takes one pass over the file.
+        :param file_path: full path to file including file name
+        :param partitions: Number of ranges to split the file into. Fewer are returned for small files.
+        :return: A list of (start, end) byte offsets, the first starting after the header row.
+        """
+        size = os.path.getsize(file_path)
+        with open(file_path, "rb") as f:
+            scanner = _QuoteScanner()
+            boundaries = [CsvLoader._record_end(f, 0, scanner)]
+            targets = [boundaries[0] + (size - boundaries[0]) * number // partitions for number in range(1, partitions)]
+            position = boundaries[0]
+            for target in targets:
+                if target <= position:
+                    continue
+                f.seek(position)
+                while position < target:
+                    block = f.read(min(CsvLoader._BLOCK_SIZE, target - position))
+                    scanner.scan(block)
+                    position += len(block)
+                end = CsvLoader._record_end(f, position, scanner)
+                position = end
+                if end < size:
+                    boundaries.append(end)
+        boundaries.append(size)
+        return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+    @staticmethod
+    def _record_end(f: BinaryIO, position: int, scanner: "_QuoteScanner" = None) -> int:
+        """
+        :param position: Offset to scan from.
+        :param scanner: Quote state at the position, which is advanced to the returned offset. None for a position
+        at the start of a record.
+        :return: The offset after the first newline that is not inside a quoted value, or the file size.
+        """
+        if scanner is None:
+            scanner = _QuoteScanner()
+        f.seek(position)
+        while True:
+            block = f.read(CsvLoader._BLOCK_SIZE >> 8)
+            if len(block) == 0:
+                return position
+            index = scanner.scan(block, find_newline=True)
+            if index >= 0:
+                return position + index
+            position += len(block)
+
+    @staticmethod
+    def documents_from_frame(df: pd.DataFrame, label_columns: dict, combine_columns, metadata_columns,
+                             metadata_types: dict = None) -> [Document]:
+        """
+        Builds documents from a data frame of text columns using vectorized column operations.
+
+        Metadata columns are kept as text unless metadata_types gives their type: "int" or "float", ignoring "$", ","
+        and spaces so "$36,500.00" becomes 36500.0, or "datetime", stored as seconds since the epoch so dates can be
+        compared as numbers. Values that cannot be converted are left out of the document's metadata.
+        :param df: Data frame with all values read as strings.
+        :param label_columns: Dictionary of columns to map to labels at the beginning of the text.
+        :param combine_columns: List of columns appended to the text. None will use all columns.
+        :param metadata_columns: List of columns to add to the document's metadata.
+        :param metadata_types: Dictionary of metadata columns to types, "str", "int", "float" or "datetime".
+        :return: A document list
+        """
+        if combine_columns is None:
+            combine_columns = list(df.columns)
+
+        parts = [str(label) + ": " + df[column_name] + "\n" for column_name, label in label_columns.items()]
+        if len(combine_columns) > 0:
+            combined = df[combine_columns[0]]
+            if len(combine_columns) > 1:
+                combined = combined.str.cat([df[column_name] for column_name in combine_columns[1:]], sep=" ")
+            parts.append(combined)
+
+        if len(parts) == 0:
+            page_contents = [""] * len(df)
+        else:
+            page_contents = parts[0]
+            for part in parts[1:]:
+                page_contents = page_contents + part
+            page_contents = page_contents.tolist()
+
+        if len(metadata_columns) > 0:
+            metadata = df[list(metadata_columns)]
+            converted = {column_name: CsvLoader._convert_column(metadata[column_name], column_type)
+                         for column_name, column_type in (metadata_types or {}).items()
+                         if column_name in metadata.columns}
+            metadatas = metadata.assign(**converted).to_dict("records")
+            if any(column.isna().any() for column in converted.values()):
+                metadatas = [{key: value for key, value in record.items() if value is not None}
+                             for record in metadatas]
+        else:
+            metadatas = [{} for _ in range(len(df))]
+
+        return [Document(page_content=page_content, metadata=metadata)
+                for page_content, metadata in zip(page_contents, metadatas)]
+
+    @staticmethod
+    def _convert_column(column: pd.Series, column_type: str) -> pd.Series:
+        """
+        :return: The column converted to Python values of the type, with None where a value cannot be converted.
+        """
+        if column_type == "str":
+            return column
+        if column_type in ("int", "float"):
+            values = pd.to_numeric(column.str.replace(r"[$,\s]", "", regex=True), errors="coerce")
+            if column_type == "int":
+                values = values.round().astype("Int64")
+        elif column_type == "datetime":
+            times = pd.to_datetime(column, utc=True, errors="coerce", format="ISO8601")
+            values = ((times - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)).astype("Int64")
+        else:
+            raise ValueError(f"Unsupported metadata type {column_type}, use str, int, float or datetime")
+        return values.astype(object).where(values.notna(), None)
+
+
+class _QuoteScanner:
+    """
+    Tracks whether the bytes of a csv file scanned so far end inside a quoted value, the way pandas reads quotes: a
+    quote opens a quoted value only at the start of a field, so the quote of an unquoted value such as 3/4" pipe is
+    text, and two quotes inside a quoted value are an escaped quote.
+    """
+
+    _QUOTE = ord('"')
+    _FIELD_START = {ord(","), ord("\n"), ord("\r")}
+
+    def __init__(self):
+        self.in_quotes = False
+        # the byte before the next block, and whether it closed a quoted value
+        self._previous = ord("\n")
+        self._closed = False
+
+    def scan(self, block: bytes, find_newline=False) -> int:
+        """
+        Advances the state over a block of the file.
+        :param block: The bytes following the bytes scanned so far.
+        :param find_newline: Stop after the first newline that is not inside a quoted value.
+        :return: The offset in the block after that newline, or -1 if the whole block was scanned.
+        """
+        index = 0
+        closed_at = -1 if self._closed else -2
+        while True:
+            quote = block.find(b'"', index)
+            if find_newline and not self.in_quotes:
+                newline = block.find(b"\n", index)
+                if newline >= 0 and (quote < 0 or newline < quote):
+                    self._previous = ord("\n")
+                    self._closed = False
+                    return newline + 1
+            if quote < 0:
+                break
+            previous = block[quote - 1] if quote > 0 else self._previous
+            if self.in_quotes:
+                self.in_quotes = False
+                closed_at = quote
+            elif previous in self._FIELD_START or (previous == self._QUOTE and closed_at == quote - 1):
+                # the start of a quoted value, or an escaped quote right after the quote that seemed to close it
+                self.in_quotes = True
+            index = quote + 1
+        if len(block) > 0:
+            self._previous = block[-1]
+            self._closed = closed_at == len(block) - 1
+        return -1
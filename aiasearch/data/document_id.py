@@ -0,0 +1,94 @@
+"""
+Functions for splitting documents into chunks and assigning them stable IDs.
+
+An ID is built from a source key in the document's metadata, such as a permit number, and a hash of the document's
+text and metadata. Unchanged documents always map to the same ID so stores can skip work for documents they already
+hold, while a document whose metadata changed, for example after adding a metadata column, is stored again.
+
+Documents are given their whitespace-normalized text when they are stored, see with_normalized_text, so prompts are
+built from it without normalizing on every query. It is derived from the text and is not part of the ID.
+"""
+import hashlib
+import json
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+
+# metadata key of the text with runs of whitespace collapsed to single spaces, set if it differs from page_content
+NORMALIZED_TEXT_KEY = "normalized_text"
+
+
+def content_hash(text: str) -> str:
+    """
+    :param text: Text to hash.
+    :return: A short hex digest of the text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def document_id(document: Document, id_key: str = None) -> str:
+    """
+    Returns a stable ID for a document. The hash covers the text and the metadata.
+    :param document: Document to create the ID for.
+    :param id_key: Metadata key identifying the document's source row. The content hash alone is used when the key is
+    None or missing from the metadata.
+    :return: "<source>:<content hash>" or "<content hash>"
+    """
+    metadata = {key: value for key, value in document.metadata.items() if key != NORMALIZED_TEXT_KEY}
+    digest = content_hash(document.page_content + "\0" + json.dumps(metadata, sort_keys=True, default=str))
+    if id_key is not None and id_key in document.metadata:
+        return f"{document.metadata[id_key]}:{digest}"
+    return digest
+
+
+def get_document_id(document: Document, id_key: str = None) -> str:
+    """
+    Returns the ID already assigned to a document, or a stable ID derived from its source key and content.
+    :param document: A document returned from a store.
+    :param id_key: Metadata key identifying the document's source row.
+    :return: The document's ID.
+    """
+    if document.id:
+        return document.id
+    return document_id(document, id_key)
+
+
+def with_normalized_text(text: str, metadata: dict) -> dict:
+    """
+    :param text: The page_content of a document.
+    :param metadata: The metadata of the document.
+    :return: The metadata with the whitespace-normalized text under NORMALIZED_TEXT_KEY, which is left out when it
+    equals the text.
+    """
+    normalized = " ".join(text.split())
+    if normalized != text:
+        return {**metadata, NORMALIZED_TEXT_KEY: normalized}
+    if NORMALIZED_TEXT_KEY in metadata:
+        return {key: value for key, value in metadata.items() if key != NORMALIZED_TEXT_KEY}
+    return metadata
+
+
+def normalized_text(document: Document) -> str:
+    """
+    :return: The whitespace-normalized text of a document given it by with_normalized_text.
+    """
+    return document.metadata.get(NORMALIZED_TEXT_KEY, document.page_content)
+
+
+def split_documents(documents: [Document], id_key: str = None, chunk_size=1000) -> [Document]:
+    """
+    Splits documents into chunks, giving each chunk its stable ID and its normalized text. Duplicate chunks are
+    dropped.
+    :param documents: Documents to split.
+    :param id_key: Metadata key identifying the document's source row.
+    :param chunk_size: Maximum number of characters of a chunk.
+    :return: The chunks, in document order.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=0)
+    chunks = {}
+    for chunk in text_splitter.split_documents(documents):
+        chunk.metadata = with_normalized_text(chunk.page_content, chunk.metadata)
+        chunk.id = document_id(chunk, id_key)
+        chunks.setdefault(chunk.id, chunk)
+    return list(chunks.values())
@@ -0,0 +1,569 @@
+"""
+A columnar store of documents shared by the vector and keyword stores.
+
+Each document is stored once and addressed by its number, the position it was added at. Stores given a
+DocumentStore keep only the numbers of their documents, in a DocumentStoreTable, and Documents are built when a search
+returns them. Documents are stored in batches laid out like Arrow record batches: the IDs and texts of a batch are
+each one UTF-8 buffer with an array of offsets, and each metadata key is a typed array with a validity mask. Saved
+batches are memory-mapped, so opening a store reads no documents and processes opening the same store share the
+pages.
+
+Adding a document with the ID of a stored document returns the stored document's number, so stores sharing a
+DocumentStore share documents with equal IDs, such as a document and its only chunk. Documents no store uses any more
+are removed by compact. Numbers are never reused, so the numbers the stores hold stay valid.
+"""
+import json
+import logging
+import shutil
+import threading
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from aiasearch.data.document_id import get_document_id
+from aiasearch.data.document_table import DocumentTable
+from aiasearch.data.metadata_filter import MetadataColumn, MetadataIndex, TextColumn
+from aiasearch.log import PROJECT_NAME
+
+_logger = logging.getLogger(PROJECT_NAME)
+
+
+class _Strings(TextColumn):
+    """
+    The strings of a batch, such as its IDs, texts or a metadata column, saved as their offsets and UTF-8 buffer.
+    """
+
+    def __getitem__(self, number: int) -> str:
+        return self.data[self.offsets[number]:self.offsets[number + 1]].tobytes().decode("utf-8")
+
+    def tolist(self) -> list[str]:
+        data = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return [data[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+    def save(self, directory: Path, name: str):
+        np.save(directory / f"{name}.offsets.npy", self.offsets)
+        np.save(directory / f"{name}.data.npy", self.data)
+
+    @classmethod
+    def load(cls, directory: Path, name: str) -> "_Strings":
+        return cls(np.load(directory / f"{name}.offsets.npy", mmap_mode="r"),
+                   np.load(directory / f"{name}.data.npy", mmap_mode="r"))
+
+
+class _Field:
+    """
+    The values of one metadata key in a batch, with a validity mask marking the documents that have the key.
+    Integers, floats and booleans are held in arrays, strings in a _Strings buffer and any other values as JSON text.
+    """
+
+    _ARRAY_TYPES = {"int": np.int64, "float": np.float64, "bool": bool}
+
+    def __init__(self, kind: str, valid: np.ndarray, values):
+        self.kind = kind
+        self.valid = valid
+        self.values = values
+
+    @classmethod
+    def build(cls, values: list) -> "_Field":
+        """
+        :param values: The value of each document, None where a document does not have the key.
+        """
+        valid = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+        present = [value for value in values if value is not None]
+        if all(type(value) is bool for value in present):
+            kind = "bool"
+        elif all(isinstance(value, (int, np.integer)) and type(value) is not bool for value in present):
+            kind = "int"
+        elif all(isinstance(value, (int, float, np.integer, np.floating)) and type(value) is not bool
+                 for value in present):
+            kind = "float"
+        elif all(isinstance(value, str) for value in present):
+            kind = "str"
+        else:
+            kind = "json"
+        if kind in cls._ARRAY_TYPES:
+            array = np.array([value if value is not None else 0 for value in values], dtype=cls._ARRAY_TYPES[kind])
+            return cls(kind, valid, array)
+        if kind == "json":
+            values = [json.dumps(value) if value is not None else None for value in values]
+        return cls(kind, valid, _Strings.build([value if value is not None else "" for value in values]))
+
+    @classmethod
+    def missing(cls, count: int) -> "_Field":
+        return cls("bool", np.zeros(count, dtype=bool), np.zeros(count, dtype=bool))
+
+    @classmethod
+    def concatenate(cls, parts: list["_Field"]) -> "_Field":
+        kinds = {part.kind for part in parts if part.valid.any()} or {"bool"}
+        if len(kinds) > 1:
+            # kinds differ, the values are typed again
+            return cls.build([value for part in parts for value in part.tolist()])
+        kind = kinds.pop()
+        valid = np.concatenate([part.valid for part in parts])
+        if kind in cls._ARRAY_TYPES:
+            return cls(kind, valid, np.concatenate([np.asarray(part.values, dtype=cls._ARRAY_TYPES[kind])
+                                                    if part.kind == kind else np.zeros(len(part), dtype=
+                                                    cls._ARRAY_TYPES[kind]) for part in parts]))
+        return cls(kind, valid, _Strings.concatenate([part.values if part.kind == kind else
+                                                      _Strings.build([""] * len(part)) for part in parts]))
+
+    def __len__(self):
+        return len(self.valid)
+
+    def __getitem__(self, number: int):
+        if not self.valid[number]:
+            return None
+        value = self.values[number]
+        if self.kind in self._ARRAY_TYPES:
+            return value.item()
+        return json.loads(value) if self.kind == "json" else value
+
+    def tolist(self) -> list:
+        return [self[number] for number in range(len(self))]
+
+    def column(self) -> MetadataColumn:
+        """
+        :return: The values as a column for evaluating filters.
+        """
+        count = len(self)
+        if self.kind in self._ARRAY_TYPES:
+            numbers = np.where(self.valid, self.values, np.nan).astype(np.float64)
+            return MetadataColumn(np.array(self.valid), numbers, np.zeros(count, dtype=bool),
+                                  TextColumn.empty(count))
+        if self.kind == "str":
+            # the strings are compared in their memory-mapped buffer
+            return MetadataColumn(np.zeros(count, dtype=bool), np.full(count, np.nan), np.array(self.valid),
+                                  self.values)
+        return MetadataColumn.from_values(self.tolist())
+
+    def save(self, directory: Path, name: str):
+        np.save(directory / f"{name}.valid.npy", self.valid)
+        if self.kind in self._ARRAY_TYPES:
+            np.save(directory / f"{name}.values.npy", self.values)
+        else:
+            self.values.save(directory, name)
+
+    @classmethod
+    def load(cls, directory: Path, name: str, kind: str) -> "_Field":
+        if kind in cls._ARRAY_TYPES:
+            values = np.load(directory / f"{name}.values.npy", mmap_mode="r")
+        else:
+            values = _Strings.load(directory, name)
+        return cls(kind, np.load(directory / f"{name}.valid.npy", mmap_mode="r"), values)
+
+
+class _Batch:
+    """
+    Documents added together, stored column by column.
+    """
+
+    _COLUMNS_FILE = "columns.json"
+
+    def __init__(self, name: str, ids: _Strings, texts: _Strings, fields: dict[str, _Field]):
+        self.name = name
+        self.ids = ids
+        self.texts = texts
+        self.fields = fields
+
+    @classmethod
+    def build(cls, name: str, documents: [Document]) -> "_Batch":
+        keys = {}
+        for document in documents:
+            keys.update(dict.fromkeys(document.metadata))
+        fields = {key: _Field.build([document.metadata.get(key) for document in documents]) for key in keys}
+        return cls(name, _Strings.build([document.id for document in documents]),
+                   _Strings.build([document.page_content for document in documents]), fields)
+
+    @classmethod
+    def concatenate(cls, name: str, batches: list["_Batch"]) -> "_Batch":
+        keys = {}
+        for batch in batches:
+            keys.update(dict.fromkeys(batch.fields))
+        fields = {key: _Field.concatenate([batch.fields[key] if key in batch.fields else _Field.missing(len(batch))
+                                           for batch in batches]) for key in keys}
+        return cls(name, _Strings.concatenate([batch.ids for batch in batches]),
+                   _Strings.concatenate([batch.texts for batch in batches]), fields)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def document(self, number: int) -> Document:
+        metadata = {}
+        for key, field in self.fields.items():
+            value = field[number]
+            if value is not None:
+                metadata[key] = value
+        return Document(id=self.ids[number], page_content=self.texts[number], metadata=metadata)
+
+    def column(self, key: str) -> MetadataColumn:
+        field = self.fields.get(key)
+        return (field if field is not None else _Field.missing(len(self))).column()
+
+    def save(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.ids.save(directory, "id")
+        self.texts.save(directory, "text")
+        for number, field in enumerate(self.fields.values()):
+            field.save(directory, f"metadata_{number}")
+        with open(directory / self._COLUMNS_FILE, "w", encoding="utf-8") as f:
+            json.dump({"count": len(self), "metadata": [[key, field.kind] for key, field in self.fields.items()]}, f)
+
+    @classmethod
+    def load(cls, name: str, directory: Path) -> "_Batch":
+        with open(directory / cls._COLUMNS_FILE, "r", encoding="utf-8") as f:
+            columns = json.load(f)
+        fields = {key: _Field.load(directory, f"metadata_{number}", kind)
+                  for number, (key, kind) in enumerate(columns["metadata"])}
+        return cls(name, _Strings.load(directory, "id"), _Strings.load(directory, "text"), fields)
+
+
+class _BatchMetadata(MetadataIndex):
+    """
+    Evaluates filters on the metadata columns of a batch.
+    """
+
+    def __init__(self, batch: _Batch):
+        super().__init__()
+        self._batch = batch
+        self._count = len(batch)
+
+    def _column(self, key: str) -> MetadataColumn:
+        column = self._columns.get(key)
+        if column is None:
+            column = self._batch.column(key)
+            self._columns[key] = column
+        return column
+
+
+class DocumentStore:
+    """
+    Documents held once for every store, addressed by number. See the module documentation.
+    """
+
+    _MANIFEST_FILE = "manifest.json"
+    _FORMAT_VERSION = 1
+
+    def __init__(self, store_dir=None, overwrite=False, read_only=False):
+        """
+        If the store_dir contains a saved store it is opened with its files memory-mapped.
+        :param store_dir: A directory to save the store files. None keeps the documents in memory, in the same
+        columnar layout.
+        :param overwrite: Will first delete the store directory.
+        :param read_only: Open the store for reading only, for worker processes that only search.
+        """
+        self._store_dir = Path(store_dir) if store_dir is not None else None
+        self._read_only = read_only
+        self._lock = threading.RLock()
+        self._set_batches([])
+        self._next_batch = 0
+        # document ID -> number, built on the first add so opening a store for searching stays instant
+        self._numbers = None
+        # batch name -> the metadata columns of the batch built for filters, kept while the batch is stored
+        self._metadata: dict[str, _BatchMetadata] = {}
+        if overwrite:
+            self.delete_store()
+        if self._store_dir is not None and (self._store_dir / self._MANIFEST_FILE).exists():
+            self._open()
+
+    @property
+    def persistent(self) -> bool:
+        return self._store_dir is not None
+
+    def __len__(self):
+        return int(self._state[1][-1])
+
+    def __getitem__(self, number: int) -> Document:
+        return self.get([number])[0]
+
+    def add(self, documents: [Document]) -> np.ndarray:
+        """
+        Adds documents that are not stored yet. A document without an ID is given its content hash.
+        :param documents: List of Langchain Document objects
+        :return: The number of each document, in the order of documents.
+        """
+        if self._read_only:
+            raise PermissionError(f"Document store {self._store_dir} was opened read only")
+        with self._lock:
+            numbers = self._number_map()
+            result = np.empty(len(documents), dtype=np.int64)
+            new_documents = []
+            next_number = len(self)
+            for position, document in enumerate(documents):
+                document_id = get_document_id(document)
+                number = numbers.get(document_id)
+                if number is None:
+                    number = next_number
+                    next_number += 1
+                    numbers[document_id] = number
+                    new_documents.append(Document(id=document_id, page_content=document.page_content,
+                                                  metadata=document.metadata))
+                result[position] = number
+            if len(new_documents) > 0:
+                self._add_batch(_Batch.build(self._new_batch_name(), new_documents))
+        return result
+
+    def get(self, numbers) -> list[Document]:
+        """
+        Builds Documents from the stored columns.
+        :param numbers: Document numbers.
+        :return: The documents, in the order of numbers.
+        """
+        batches, starts = self._state
+        numbers = np.asarray(numbers, dtype=np.int64)
+        positions = np.searchsorted(starts, numbers, side="right") - 1
+        return [batches[position].document(number - int(starts[position]))
+                for position, number in zip(positions.tolist(), numbers.tolist())]
+
+    def ids(self, numbers) -> list[str]:
+        """
+        :return: The IDs of the documents, in the order of numbers.
+        """
+        batches, starts = self._state
+        numbers = np.asarray(numbers, dtype=np.int64)
+        positions = np.searchsorted(starts, numbers, side="right") - 1
+        return [batches[position].ids[number - int(starts[position])]
+                for position, number in zip(positions.tolist(), numbers.tolist())]
+
+    def lookup(self, ids: [str]) -> np.ndarray:
+        """
+        :return: The number of each document ID, -1 for IDs that are not stored.
+        """
+        with self._lock:
+            numbers = self._number_map()
+            return np.fromiter((numbers.get(document_id, -1) for document_id in ids), dtype=np.int64,
+                               count=len(ids))
+
+    def mask(self, filter: dict) -> np.ndarray:
+        """
+        :param filter: Filter on metadata, described in aiasearch.data.metadata_filter.
+        :return: A boolean array marking the documents that match the filter, indexed by number.
+        """
+        with self._lock:
+            batches = self._state[0]
+            # only batches added or merged since the last filter have their columns built
+            self._metadata = {batch.name: self._metadata.get(batch.name) or _BatchMetadata(batch)
+                              for batch in batches}
+            metadatas = [self._metadata[batch.name] for batch in batches]
+        return np.concatenate([np.zeros(0, dtype=bool)] + [metadata.mask(filter) for metadata in metadatas])
+
+    def compact(self, referenced: list) -> int:
+        """
+        Removes the documents that are not referenced: their IDs, text and metadata are dropped and the batches
+        holding them are rewritten. The numbers of removed documents stay taken, so the numbers held by the stores
+        stay valid. The stores sharing the DocumentStore must not add documents while their references are gathered
+        and compacted.
+        :param referenced: The document numbers each store sharing the DocumentStore uses, from the stores'
+        document_numbers.
+        :return: The number of documents removed.
+        """
+        if self._read_only:
+            raise PermissionError(f"Document store {self._store_dir} was opened read only")
+        with self._lock:
+            batches, starts = self._state
+            keep = np.zeros(len(self), dtype=bool)
+            for numbers in referenced:
+                keep[np.asarray(numbers, dtype=np.int64)] = True
+            compacted = []
+            removed_ids = []
+            for position, (batch, start) in enumerate(zip(batches, starts.tolist())):
+                ids = batch.ids.tolist()
+                removed = [number for number, document_id in enumerate(ids)
+                           if document_id != "" and not keep[start + number]]
+                if len(removed) == 0:
+                    continue
+                removed_ids.extend(ids[number] for number in removed)
+                documents = [batch.document(number) if keep[start + number] else Document(id="", page_content="")
+                             for number in range(len(batch))]
+                replacement = _Batch.build(self._new_batch_name(), documents)
+                if self._store_dir is not None:
+                    replacement.save(self._store_dir / replacement.name)
+                    replacement = _Batch.load(replacement.name, self._store_dir / replacement.name)
+                compacted.append(batch)
+                batches = batches[:position] + [replacement] + batches[position + 1:]
+            if len(removed_ids) == 0:
+                return 0
+            self._set_batches(batches)
+            if self._numbers is not None:
+                for document_id in removed_ids:
+                    del self._numbers[document_id]
+            if self._store_dir is not None:
+                self._save_manifest()
+                for batch in compacted:
+                    shutil.rmtree(self._store_dir / batch.name, ignore_errors=True)
+        _logger.info(f"Removed {len(removed_ids)} documents no store uses from the document store")
+        return len(removed_ids)
+
+    def table(self, numbers=None) -> "DocumentStoreTable":
+        """
+        :param numbers: Numbers of the documents in the table.
+        :return: A table of stored documents, used by a store in place of a DocumentTable.
+        """
+        return DocumentStoreTable(self, numbers)
+
+    def delete_store(self):
+        """
+        Deletes the store directory.
+        """
+        if self._store_dir is not None and self._store_dir.exists():
+            shutil.rmtree(self._store_dir)
+
+    def _add_batch(self, batch: _Batch):
+        """
+        Adds a batch, merging the last batches while a batch is no larger than the batch after it, which keeps the
+        number of batches logarithmic in the number of documents. Must be called holding the lock.
+        """
+        batches, _ = self._state
+        batches = batches + [batch]
+        merged = []
+        while len(batches) > 1 and len(batches[-2]) <= len(batches[-1]):
+            merged.extend(batches[-2:])
+            batches = batches[:-2] + [_Batch.concatenate(self._new_batch_name(), batches[-2:])]
+        if self._store_dir is not None:
+            batch = batches[-1]
+            batch.save(self._store_dir / batch.name)
+            batches[-1] = _Batch.load(batch.name, self._store_dir / batch.name)
+        self._set_batches(batches)
+        if self._store_dir is not None:
+            self._save_manifest()
+            for batch in merged:
+                shutil.rmtree(self._store_dir / batch.name, ignore_errors=True)
+
+    def _set_batches(self, batches: list[_Batch]):
+        # the batches and the number of the first document of each batch, with the total count at the end, are
+        # replaced together so readers never see one without the other
+        self._state = (batches, np.cumsum([0] + [len(batch) for batch in batches], dtype=np.int64))
+
+    def _new_batch_name(self) -> str:
+        name = f"batch_{self._next_batch:06d}"
+        self._next_batch += 1
+        return name
+
+    def _number_map(self) -> dict:
+        if self._numbers is None:
+            self._numbers = {}
+            batches, starts = self._state
+            for start, batch in zip(starts.tolist(), batches):
+                self._numbers.update((document_id, number) for number, document_id
+                                     in enumerate(batch.ids.tolist(), start) if document_id != "")
+        return self._numbers
+
+    def _save_manifest(self):
+        manifest = {"format_version": self._FORMAT_VERSION,
+                    "batches": [batch.name for batch in self._state[0]],
+                    "next_batch": self._next_batch}
+        temp_path = self._store_dir / (self._MANIFEST_FILE + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        temp_path.replace(self._store_dir / self._MANIFEST_FILE)
+
+    def _open(self):
+        with open(self._store_dir / self._MANIFEST_FILE, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != self._FORMAT_VERSION:
+            raise ValueError(f"Document store in {self._store_dir} has an unsupported format")
+        self._next_batch = manifest["next_batch"]
+        self._set_batches([_Batch.load(name, self._store_dir / name) for name in manifest["batches"]])
+        _logger.info(f"Opened document store {self._store_dir} with {len(self)} documents")
+
+
+class DocumentStoreTable:
+    """
+    The documents of a vector or keyword store held as numbers of documents in a DocumentStore. It has the methods
+    of a DocumentTable the stores use, so a store uses it in place of one.
+    """
+
+    _NUMBERS_FILE = "document_numbers.npy"
+
+    def __init__(self, document_store: DocumentStore, numbers=None):
+        """
+        :param document_store: Store holding the documents.
+        :param numbers: Numbers of the documents in the table.
+        """
+        self.document_store = document_store
+        self.numbers = np.asarray(numbers if numbers is not None else [], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getitem__(self, number: int) -> Document:
+        return self.document_store[int(self.numbers[number])]
+
+    def __iter__(self):
+        for start in range(0, len(self), 1024):
+            yield from self.get(range(start, min(start + 1024, len(self))))
+
+    def get(self, numbers) -> list[Document]:
+        """
+        :param numbers: Positions of documents in the table.
+        :return: The documents, in the order of numbers.
+        """
+        return self.document_store.get(self.numbers[np.asarray(numbers, dtype=np.int64)])
+
+    def append(self, documents: [Document]):
+        """
+        Adds documents to the end of the table, storing those not in the DocumentStore.
+        """
+        self.numbers = np.concatenate([self.numbers, self.document_store.add(documents)])
+
+    def mask(self, filter: dict) -> np.ndarray:
+        """
+        :param filter: Filter on metadata, described in aiasearch.data.metadata_filter.
+        :return: A boolean array marking the documents that match the filter.
+        """
+        return self.document_store.mask(filter)[self.numbers]
+
+    def save(self, directory):
+        """
+        Writes the document numbers to the directory. The documents are saved by the DocumentStore.
+        :param directory: Directory to save the table files to. It is created if needed.
+        """
+        if not self.document_store.persistent:
+            raise ValueError("Documents of a saved store must be held in a DocumentStore with a store_dir")
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        temp_path = directory / (self._NUMBERS_FILE + ".tmp.npy")
+        np.save(temp_path, self.numbers)
+        temp_path.replace(directory / self._NUMBERS_FILE)
+
+    def flush(self, directory):
+        """
+        Writes the document numbers to the directory, like save.
+        """
+        self.save(directory)
+
+    @classmethod
+    def load(cls, document_store: DocumentStore, directory) -> "DocumentStoreTable":
+        """
+        Opens a saved table.
+        :param document_store: Store holding the documents.
+        :param directory: Directory the table was saved to.
+        :return: The table
+        """
+        return cls(document_store, np.load(Path(directory) / cls._NUMBERS_FILE, mmap_mode="r"))
+
+
+def load_documents(directory, document_store: DocumentStore = None):
+    """
+    Opens the documents a store saved to a directory with DocumentTable.save or DocumentStoreTable.save. Documents
+    saved with DocumentTable.save are moved to the document_store if one is given.
+    :param directory: Directory the documents were saved to.
+    :param document_store: The DocumentStore the store was given, if any.
+    :return: A DocumentTable or a DocumentStoreTable.
+    """
+    directory = Path(directory)
+    if (directory / DocumentStoreTable._NUMBERS_FILE).exists():
+        if document_store is None:
+            raise ValueError(f"The documents in {directory} are held in a DocumentStore, which must be given")
+        return DocumentStoreTable.load(document_store, directory)
+    documents = DocumentTable.load(directory)
+    if document_store is not None:
+        # the store was saved without a DocumentStore, its documents are moved into the one it is given now
+        _logger.info(f"Moving {len(documents)} documents in {directory} to the document store")
+        table = document_store.table(document_store.add(list(documents)))
+        table.save(directory)
+        for file_name in (DocumentTable._RECORDS_FILE, DocumentTable._OFFSETS_FILE):
+            (directory / file_name).unlink()
+        return table
+    return documents
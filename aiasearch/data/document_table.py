@@ -0,0 +1,161 @@
+import json
+import mmap
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from aiasearch.data.metadata_filter import MetadataIndex
+
+
+class DocumentTable:
+    """
+    A list of Documents addressed by document number that can be saved to a directory and opened again without
+    parsing it. Saved documents are stored one JSON record per line with an array of line offsets, and are only
+    parsed when they are read.
+    """
+
+    _RECORDS_FILE = "documents.jsonl"
+    _OFFSETS_FILE = "document_offsets.npy"
+
+    def __init__(self, documents: [Document] = None):
+        """
+        :param documents: Documents held in memory.
+        """
+        self._documents: list[Document] = list(documents) if documents is not None else []
+        self._records = None
+        self._offsets = np.zeros(1, dtype=np.int64)
+        # metadata columns, built on the first filtered search
+        self._metadata = None
+
+    def __len__(self):
+        return len(self._offsets) - 1 + len(self._documents)
+
+    def __getitem__(self, number: int) -> Document:
+        saved_count = len(self._offsets) - 1
+        if number < saved_count:
+            record = json.loads(self._records[self._offsets[number]:self._offsets[number + 1]])
+            return Document(id=record["id"], page_content=record["page_content"], metadata=record["metadata"])
+        return self._documents[number - saved_count]
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self[number]
+
+    def get(self, numbers) -> list[Document]:
+        """
+        :param numbers: Document numbers.
+        :return: The documents, in the order of numbers.
+        """
+        return [self[int(number)] for number in numbers]
+
+    def mask(self, filter: dict) -> np.ndarray:
+        """
+        :param filter: Filter on metadata, described in aiasearch.data.metadata_filter.
+        :return: A boolean array marking the documents that match the filter.
+        """
+        if self._metadata is None:
+            self._metadata = MetadataIndex()
+        if len(self._metadata) < len(self):
+            self._metadata.append(document.metadata for document in self.get(range(len(self._metadata), len(self))))
+        return self._metadata.mask(filter)
+
+    def record(self, number: int) -> bytes:
+        """
+        :return: The JSON record of a document as it is saved, without parsing saved documents.
+        """
+        saved_count = len(self._offsets) - 1
+        if number < saved_count:
+            return self._records[self._offsets[number]:self._offsets[number + 1]]
+        return self._encode(self._documents[number - saved_count])
+
+    @classmethod
+    def from_records(cls, records: [bytes]) -> "DocumentTable":
+        """
+        Creates a table from JSON records, such as records copied from other tables, without parsing them.
+        :param records: Records returned by record.
+        :return: The table
+        """
+        table = cls()
+        table._records = b"".join(records)
+        table._offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, records), dtype=np.int64, count=len(records)), out=table._offsets[1:])
+        return table
+
+    def append(self, documents: [Document]):
+        """
+        Adds documents to the end of the table.
+        """
+        self._documents.extend(documents)
+
+    def save(self, directory):
+        """
+        Writes every document to the directory.
+        :param directory: Directory to save the table files to. It is created if needed.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        saved_count = len(self._offsets) - 1
+        offsets[:saved_count + 1] = self._offsets
+        temp_path = directory / (self._RECORDS_FILE + ".tmp")
+        with open(temp_path, "wb") as f:
+            # saved records are copied without parsing them
+            if saved_count > 0:
+                f.write(self._records[:int(self._offsets[-1])])
+            for number, document in enumerate(self._documents, start=saved_count):
+                line = self._encode(document)
+                f.write(line)
+                offsets[number + 1] = offsets[number] + len(line)
+        temp_path.replace(directory / self._RECORDS_FILE)
+        np.save(directory / self._OFFSETS_FILE, offsets)
+
+    def flush(self, directory):
+        """
+        Appends the documents held in memory to the table saved in the directory and maps them, so only new
+        documents are written. The directory must hold the files this table was saved to or loaded from, or none.
+        :param directory: Directory of the table files.
+        """
+        directory = Path(directory)
+        records_path = directory / self._RECORDS_FILE
+        if not records_path.exists():
+            self.save(directory)
+        elif len(self._documents) > 0:
+            end = int(self._offsets[-1])
+            offsets = np.empty(len(self._documents), dtype=np.int64)
+            with open(records_path, "r+b") as f:
+                # anything past the last saved offset was left by an interrupted write
+                f.seek(end)
+                f.truncate()
+                for number, document in enumerate(self._documents):
+                    line = self._encode(document)
+                    f.write(line)
+                    end += len(line)
+                    offsets[number] = end
+            temp_path = directory / (self._OFFSETS_FILE + ".tmp.npy")
+            np.save(temp_path, np.concatenate([self._offsets, offsets]))
+            temp_path.replace(directory / self._OFFSETS_FILE)
+        else:
+            return
+        loaded = self.load(directory)
+        self._records, self._offsets, self._documents = loaded._records, loaded._offsets, []
+
+    @staticmethod
+    def _encode(document: Document) -> bytes:
+        return json.dumps({"id": document.id, "page_content": document.page_content,
+                           "metadata": document.metadata}).encode("utf-8") + b"\n"
+
+    @classmethod
+    def load(cls, directory) -> "DocumentTable":
+        """
+        Opens a saved table. Documents are read from the memory-mapped file on access.
+        :param directory: Directory the table was saved to.
+        :return: The table
+        """
+        directory = Path(directory)
+        table = cls()
+        table._offsets = np.load(directory / cls._OFFSETS_FILE, mmap_mode="r")
+        if table._offsets[-1] > 0:
+            with open(directory / cls._RECORDS_FILE, "rb") as f:
+                table._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return table
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import OllamaEmbeddings
+
+from aiasearch.analyzer import Analyzer, DEFAULT_ANALYZER
+from aiasearch.log import PROJECT_NAME
+
+
+class EmbeddingBackend(Embeddings, ABC):
+    """
+    Interface for the models vector stores embed documents and queries with. Backends are Langchain Embeddings, so
+    they can be cached with CachedEmbeddings and handed to Chroma directly.
+    """
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """Identifies the model and its settings. Vectors of backends with different names are not comparable."""
+        pass
+
+    @abstractmethod
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embeds a batch of texts"""
+        pass
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embeds a query. By default queries are embedded like documents."""
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Async embed_documents. By default the synchronous method runs in a worker thread."""
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        """Async embed_query. By default the synchronous method runs in a worker thread."""
+        return await asyncio.to_thread(self.embed_query, text)
+
+
+class OllamaEmbeddingBackend(EmbeddingBackend):
+    """
+    Embeds text with a model served by Ollama. The Ollama host is set using the "OLLAMA_HOST" environment variable.
+    """
+
+    def __init__(self, model: str = "nomic-embed-text", host: str = None):
+        """
+        :param model: Name of the Ollama embedding model.
+        :param host: Ollama address. Defaults to the OLLAMA_HOST environment variable, or 127.0.0.1:11434.
+        """
+        self._logger = logging.getLogger(PROJECT_NAME)
+        self._model = model
+        if host is None:
+            host = os.environ.get("OLLAMA_HOST")
+            if host is None:
+                self._logger.info("key OLLAMA_HOST not found in environment variables")
+                host = "127.0.0.1:11434"
+        self._embeddings = OllamaEmbeddings(model=model, base_url=host)
+
+    @property
+    def name(self) -> str:
+        return self._model
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self._embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self._embeddings.aembed_query(text)
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Embeds text in process on the CPU by feature hashing. Each analyzed word and each pair of adjacent words is
+    hashed to a dimension and a sign, counts are damped with log(1 + count) and vectors are normalized to unit length.
+    Vectors are deterministic across processes and machines. Texts sharing words are similar, but unlike a neural
+    model the backend knows nothing of synonyms.
+    """
+
+    def __init__(self, dimension=384, analyzer: Analyzer = DEFAULT_ANALYZER, bigrams=True, cache_size=1000000):
+        """
+        :param dimension: Number of dimensions of the vectors.
+        :param analyzer: Analyzer that splits text into words.
+        :param bigrams: Also hash pairs of adjacent words, so word order contributes to similarity.
+        :param cache_size: Maximum number of features whose hash is remembered.
+        """
+        self._dimension = dimension
+        self._analyzer = analyzer
+        self._bigrams = bigrams
+        self._cache_size = cache_size
+        # feature -> signed dimension + 1, negative for features with a negative sign
+        self._features = {}
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"hashing-{self._dimension}{'-bigrams' if self._bigrams else ''}-{self._analyzer.name}"
+
+    @property
+    def dimension(self) -> int:
+        return self._dimension
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds a batch of texts. The features of the whole batch are scattered into one matrix at once.
+        :param texts: Texts to embed.
+        :return: A list of unit length vectors.
+        """
+        rows = []
+        signed_columns = []
+        for row, text in enumerate(texts):
+            columns = self._hash_features(self._features_of(text))
+            rows.extend([row] * len(columns))
+            signed_columns.extend(columns)
+
+        vectors = np.zeros((len(texts), self._dimension), dtype=np.float32)
+        if len(signed_columns) > 0:
+            signed_columns = np.asarray(signed_columns, dtype=np.int64)
+            counts = np.zeros((len(texts), self._dimension), dtype=np.float32)
+            np.add.at(counts, (np.asarray(rows, dtype=np.int64), np.abs(signed_columns) - 1),
+                      np.sign(signed_columns).astype(np.float32))
+            vectors = np.sign(counts) * np.log1p(np.abs(counts))
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors.tolist()
+
+    def _features_of(self, text: str) -> [str]:
+        words = self._analyzer.analyze(text)
+        if not self._bigrams:
+            return words
+        return words + [first + " " + second for first, second in zip(words, words[1:])]
+
+    def _hash_features(self, features: [str]) -> [int]:
+        columns = []
+        for feature in features:
+            column = self._features.get(feature)
+            if column is None:
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                column = (digest % self._dimension) + 1
+                if digest >> 63:
+                    column = -column
+                with self._lock:
+                    if len(self._features) >= self._cache_size:
+                        self._features.clear()
+                    self._features[feature] = column
+            columns.append(column)
+        return columns
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+from aiasearch.log import PROJECT_NAME
+from aiasearch.metrics import EMBEDDING_BATCH_SIZE, span
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that merges the queries of concurrent callers into one embed_documents call of the wrapped
+    embeddings. A worker thread embeds one batch at a time; queries arriving while a batch is embedded, or within
+    max_wait seconds of the first query of a batch, join the next batch. A server answering many searches at once
+    then makes one embedding request per batch rather than one per query.
+
+    Queries are embedded with embed_documents, as EmbeddingBackend embeds queries by default, so the wrapped
+    embeddings must not treat queries differently from documents. A CachedEmbeddings wraps the batcher rather than
+    the other way round, so queries are cached as queries. Documents are passed through unchanged, the stores
+    already embed them in batches.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size=32, max_wait=0.002):
+        """
+        :param embeddings: Embeddings that compute the vectors.
+        :param max_batch_size: Maximum number of queries embedded in one call.
+        :param max_wait: Seconds the first query of a batch waits for other queries to join it.
+        """
+        self._logger = logging.getLogger(PROJECT_NAME)
+        self._embeddings = embeddings
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._queue: queue.Queue = queue.Queue()
+        # guards _closed, so no query is queued after the worker's stop marker
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    @property
+    def name(self) -> str:
+        return getattr(self._embeddings, "name", type(self._embeddings).__name__)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        """
+        Embeds a query in the next batch and waits for its vector.
+        """
+        return self._submit(text).result()
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self._embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await asyncio.wrap_future(self._submit(text))
+
+    def close(self):
+        """
+        Stops the worker thread once the queued queries are embedded.
+        """
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+        self._thread.join()
+
+    def _submit(self, text: str) -> Future:
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatchingEmbeddings is closed")
+            self._queue.put((text, future))
+        return future
+
+    def _run(self):
+        try:
+            self._run_batches()
+        except Exception as e:
+            self._logger.exception(f"Embedding batcher stopped: {e}")
+        finally:
+            self._fail_queued()
+
+    def _run_batches(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._embed(batch)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                raise
+
+    def _fail_queued(self):
+        """
+        Closes the batcher and fails the queries still queued when the worker stops, so no caller waits forever.
+        """
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError("MicroBatchingEmbeddings is closed"))
+
+    def _embed(self, batch: list[tuple[str, Future]]):
+        """
+        Embeds the distinct texts of a batch in one call and completes every query's future.
+        """
+        # queries whose callers gave up, such as cancelled async searches, are dropped
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if len(batch) == 0:
+            return
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        EMBEDDING_BATCH_SIZE.observe(len(batch))
+        try:
+            with span("embed_query_batch"):
+                vectors = dict(zip(texts, self._embeddings.embed_documents(texts)))
+        except Exception as e:
+            self._logger.warning(f"Embedding a batch of {len(texts)} queries failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for text, future in batch:
+            future.set_result(vectors[text])
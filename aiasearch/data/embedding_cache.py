@@ -0,0 +1,279 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from aiasearch.log import PROJECT_NAME
+from aiasearch.metrics import CACHE_REQUESTS
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that stores every vector it computes on disk so identical text is never embedded twice.
+    Vectors are kept as float32 in a memory-mapped file indexed by (model name, kind, SHA-256 of the text), where the
+    kind is document or query, so models that embed queries differently from documents are cached correctly.
+
+    A cache directory has a single writer. The first process to open it takes an exclusive lock on it; other processes
+    opening the same directory only read the vectors already cached and embed the rest without caching them. On
+    platforms without fcntl the cache is not locked and must not be shared between processes.
+    """
+
+    _INITIAL_CAPACITY = 1024
+    # caches written before queries and documents had separate keys are discarded
+    _FORMAT_VERSION = 2
+    # query vectors are written to disk after this many new queries, or by flush()
+    _FLUSH_EVERY = 64
+
+    def __init__(self, embeddings: Embeddings, cache_dir, model_name: str = None, max_entries: int = 1000000):
+        """
+        :param embeddings: Embeddings used to compute vectors missing from the cache.
+        :param cache_dir: Directory to save the cache files. Each model is cached in its own subdirectory.
+        :param model_name: Name of the embedding model. Defaults to the name of an EmbeddingBackend or the model
+        attribute of other embeddings.
+        :param max_entries: Maximum number of cached vectors. The least recently used vectors are evicted first.
+        """
+        self._logger = logging.getLogger(PROJECT_NAME)
+        self._embeddings = embeddings
+        if model_name is None:
+            model_name = getattr(embeddings, "name", None) or getattr(embeddings, "model", type(embeddings).__name__)
+        self._model_name = model_name
+        self._max_entries = max_entries
+        self._cache_dir = Path(cache_dir) / re.sub(r"[^\w.-]", "_", model_name)
+        self._lock = threading.Lock()
+
+        self._count = 0
+        self._clock = 0
+        self._vectors = None
+        self._keys = None
+        self._last_used = None
+        self._slots = {}
+        self._unflushed = 0
+        self._lock_file = None
+        self.read_only = False
+        self.hits = 0
+        self.misses = 0
+        self._open()
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Returns the embeddings of the texts, computing only the texts not already cached.
+        :param texts: Texts to embed.
+        :return: A list of embeddings.
+        """
+        keys = [self._key(text, self._DOCUMENT) for text in texts]
+        cached = self._get(keys)
+        missing = {}
+        for index, key in enumerate(keys):
+            if key not in cached:
+                missing.setdefault(key, texts[index])
+
+        if len(missing) > 0:
+            computed = np.asarray(self._embeddings.embed_documents(list(missing.values())), dtype=np.float32)
+            cached.update(zip(missing.keys(), computed.tolist()))
+            self._put(list(missing.keys()), computed)
+            self.flush()
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        """
+        Returns the embedding of a query, computing it only if it is not already cached.
+        :param text: Query text.
+        :return: The query embedding.
+        """
+        key = self._key(text, self._QUERY)
+        cached = self._get([key])
+        if key in cached:
+            return cached[key]
+        embedding = np.asarray([self._embeddings.embed_query(text)], dtype=np.float32)
+        self._put([key], embedding)
+        if self._unflushed >= self._FLUSH_EVERY:
+            self.flush()
+        return embedding[0].tolist()
+
+    def flush(self):
+        """
+        Writes the vectors cached since the last flush to disk.
+        """
+        with self._lock:
+            if self._unflushed == 0:
+                return
+            self._vectors.flush()
+            self._keys.flush()
+            self._last_used.flush()
+            meta = {"format_version": self._FORMAT_VERSION, "model_name": self._model_name, "count": self._count,
+                    "clock": self._clock}
+            temp_path = self._cache_dir / "meta.json.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(temp_path, self._cache_dir / "meta.json")
+            self._unflushed = 0
+
+    def __len__(self):
+        return self._count
+
+    _DOCUMENT = b"d"
+    _QUERY = b"q"
+
+    @staticmethod
+    def _key(text: str, kind: bytes) -> bytes:
+        return hashlib.sha256(kind + b"\0" + text.encode("utf-8")).digest()
+
+    def _get(self, keys: list[bytes]) -> dict:
+        """
+        :return: A dictionary of key to vector for the keys found in the cache.
+        """
+        with self._lock:
+            self._clock += 1
+            found = {}
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is not None:
+                    found[key] = slot
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            CACHE_REQUESTS.inc(len(found), cache="embedding", result="hit")
+            CACHE_REQUESTS.inc(len(keys) - len(found), cache="embedding", result="miss")
+            if len(found) == 0:
+                return {}
+            slots = np.fromiter(found.values(), dtype=np.int64, count=len(found))
+            if self.read_only:
+                # the writing process may evict entries at any time. It clears a slot's key before writing its vector
+                # and writes the new key last, so a vector is only used if its key matched before and after the copy
+                before = self._keys[slots].tolist()
+                vectors = np.array(self._vectors[slots]).tolist()
+                after = self._keys[slots].tolist()
+                return {key: vector for key, vector, key_before, key_after in zip(found.keys(), vectors, before, after)
+                        if key == key_before == key_after}
+            vectors = np.array(self._vectors[slots]).tolist()
+            self._last_used[slots] = self._clock
+            return dict(zip(found.keys(), vectors))
+
+    def _put(self, keys: list[bytes], vectors: np.ndarray) -> None:
+        """
+        Stores float32 vectors in the cache, evicting the least recently used entries when the cache is full.
+        """
+        with self._lock:
+            if self.read_only:
+                return
+            new = [index for index, key in enumerate(keys) if key not in self._slots]
+            keys = [keys[index] for index in new][:self._max_entries]
+            vectors = vectors[new][:self._max_entries]
+            if len(keys) == 0:
+                return
+            if self._vectors is None:
+                self._create(vectors.shape[1])
+                if self.read_only:
+                    return
+            if vectors.shape[1] != self._vectors.shape[1]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the cached dimension "
+                                 f"{self._vectors.shape[1]} for model {self._model_name}")
+
+            slots = self._allocate(len(keys))
+            # readers in other processes check the keys around reading the vectors, see _get
+            self._keys[slots] = b""
+            self._vectors[slots] = vectors
+            self._keys[slots] = keys
+            self._last_used[slots] = self._clock
+            for key, slot in zip(keys, slots.tolist()):
+                self._slots[key] = slot
+            self._unflushed += len(keys)
+
+    def _allocate(self, n: int) -> np.ndarray:
+        """
+        :return: n free slots. The cache files are grown, or least recently used entries evicted, to make room.
+        """
+        free = min(n, self._max_entries - self._count)
+        if self._count + free > len(self._keys):
+            self._grow(min(self._max_entries, max(self._count + free, len(self._keys) * 2)))
+        slots = np.arange(self._count, self._count + free, dtype=np.int64)
+        self._count += free
+
+        evict = n - free
+        if evict > 0:
+            # only entries that were not just allocated are candidates for eviction
+            candidates = self._last_used[:self._count - free]
+            evicted = np.argpartition(candidates, evict - 1)[:evict]
+            for key in self._keys[evicted].tolist():
+                self._slots.pop(key, None)
+            self._logger.debug(f"Evicted {evict} embeddings from the cache")
+            slots = np.concatenate([slots, evicted])
+        return slots
+
+    def _open(self):
+        """
+        Opens existing cache files for the model.
+        """
+        meta_path = self._cache_dir / "meta.json"
+        if not meta_path.exists():
+            return
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if not self._take_lock():
+            self._logger.info(f"Embedding cache {self._cache_dir} is used by another process, opening it read only")
+        elif meta.get("format_version") != self._FORMAT_VERSION:
+            self._logger.info(f"Discarding embedding cache {self._cache_dir} written by an older version")
+            return
+        self._count = meta["count"]
+        self._clock = meta["clock"]
+        mode = "r" if self.read_only else "r+"
+        self._vectors = np.load(self._cache_dir / "vectors.npy", mmap_mode=mode)
+        self._keys = np.load(self._cache_dir / "keys.npy", mmap_mode=mode)
+        self._last_used = np.load(self._cache_dir / "last_used.npy", mmap_mode=mode)
+        self._slots = {key: slot for slot, key in enumerate(self._keys[:self._count].tolist())}
+
+    def _create(self, dimension: int):
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        if not self._take_lock():
+            self._logger.info(f"Embedding cache {self._cache_dir} is used by another process, not caching")
+            return
+        capacity = min(self._INITIAL_CAPACITY, self._max_entries)
+        self._vectors = self._new_file("vectors.npy", (capacity, dimension), np.float32)
+        self._keys = self._new_file("keys.npy", (capacity,), "V32")
+        self._last_used = self._new_file("last_used.npy", (capacity,), np.int64)
+
+    def _grow(self, capacity: int):
+        """
+        Copies the cache files into larger files.
+        """
+        self._logger.debug(f"Growing embedding cache to {capacity} entries")
+        for name in ("vectors", "keys", "last_used"):
+            old = getattr(self, "_" + name)
+            new = self._new_file(name + ".npy.tmp", (capacity,) + old.shape[1:], old.dtype)
+            new[:len(old)] = old
+            new.flush()
+            del new, old
+            os.replace(self._cache_dir / (name + ".npy.tmp"), self._cache_dir / (name + ".npy"))
+            setattr(self, "_" + name, np.load(self._cache_dir / (name + ".npy"), mmap_mode="r+"))
+
+    def _take_lock(self) -> bool:
+        """
+        Takes the writer lock of the cache directory.
+        :return: False, making the cache read only, if another process holds the lock.
+        """
+        if self._lock_file is not None or fcntl is None:
+            return not self.read_only
+        self._lock_file = open(self._cache_dir / "lock", "a+b")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.read_only = True
+        return not self.read_only
+
+    def _new_file(self, name: str, shape: tuple, dtype):
+        return np.lib.format.open_memmap(self._cache_dir / name, mode="w+", shape=shape, dtype=dtype)
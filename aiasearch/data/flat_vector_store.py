@@ -0,0 +1,570 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from aiasearch.analyzer import Analyzer, DEFAULT_ANALYZER
+from aiasearch.data.document_id import split_documents
+from aiasearch.data.document_store import DocumentStore, DocumentStoreTable, load_documents
+from aiasearch.data.document_table import DocumentTable
+from aiasearch.data.embedding_backend import EmbeddingBackend, OllamaEmbeddingBackend
+from aiasearch.data.embedding_cache import CachedEmbeddings
+from aiasearch.data.vector_store import VectorStore
+from aiasearch.log import PROJECT_NAME
+from aiasearch.metrics import CHUNKS, DOCUMENTS, span
+
+
+class FlatVectorStore(VectorStore):
+    """
+    Vector store that keeps unit length embeddings in a single float32 or float16 matrix, memory-mapped from a .npy
+    file, next to a DocumentTable of the chunks. A search is one matrix-vector product over every stored vector and
+    an argpartition top-k, so results are exact. Opening a store only maps its files, and processes that open the
+    same store share the mapped pages. Deleted chunks are marked and removed when the store is compacted, which
+    writes the remaining chunks to a new generation directory and then switches the manifest to it, so an interrupted
+    compaction leaves the previous files in place.
+
+    With int8 quantization each vector is also stored as int8 codes with a float32 scale per vector, a quarter of the
+    size of float32 vectors. Searches score the codes and re-rank a shortlist of the best candidates against the full
+    precision vectors, so only the codes need to stay in memory and the vectors are read from disk on demand. A
+    quantized store therefore needs a store_dir.
+
+    Given a DocumentStore, the store keeps only the numbers of its chunks and reads them from the DocumentStore.
+    """
+
+    _INITIAL_CAPACITY = 1024
+    # rows converted to float32 at a time when searching float16 vectors or int8 codes
+    _SEARCH_BLOCK_ROWS = 4096
+    # 2 added the quantization of the manifest, 3 the generation directory holding the files
+    _FORMAT_VERSION = 3
+    _QUANTIZATIONS = (None, "int8")
+
+    def __init__(self, store_dir=None, overwrite=False, id_key=None, dtype="float32", read_only=False,
+                 embedding_backend: EmbeddingBackend = None, embeddings: Embeddings = None,
+                 embedding_cache_dir=None, embedding_cache_size=1000000, embedding_batch_size=64,
+                 embedding_workers=4, max_deleted_ratio=0.2, analyzer: Analyzer = DEFAULT_ANALYZER,
+                 quantization: str = None, rerank_factor=4, document_store: DocumentStore = None):
+        """
+        :param store_dir: A directory to save the store files. None keeps the store in memory.
+        :param overwrite: Will first delete the store directory.
+        :param id_key: Metadata key identifying a document's source row, such as "permitnumber". Each chunk is stored
+        under "<source>:<content hash>" so unchanged chunks are never embedded twice.
+        :param dtype: "float32", or "float16" to halve the size of the vectors. Ignored when opening a saved store.
+        :param read_only: Open the files read only, for worker processes that only search.
+        :param embedding_backend: Backend used for documents and queries. Defaults to OllamaEmbeddingBackend.
+        Ignored if embeddings is given.
+        :param embeddings: Langchain embeddings used for documents and queries.
+        :param embedding_cache_dir: A directory to cache embeddings in.
+        :param embedding_cache_size: Maximum number of embeddings kept in the cache.
+        :param embedding_batch_size: Number of chunks sent to the embedding model in one request.
+        :param embedding_workers: Maximum number of embedding requests in flight at the same time.
+        :param max_deleted_ratio: The store is compacted when more than this fraction of its chunks are deleted.
+        :param analyzer: Analyzer used to remove stop words from queries.
+        :param quantization: None to score the vectors directly, or "int8" to score int8 codes and re-rank a
+        shortlist with the vectors read from the store_dir. Ignored when opening a saved store.
+        :param rerank_factor: With quantization, k * rerank_factor candidates are re-ranked per search.
+        :param document_store: Store holding the chunks, shared with other stores. It must have a store_dir if this
+        store has one. None keeps the chunks in this store.
+        """
+        self._logger = logging.getLogger(PROJECT_NAME)
+        # incremented whenever documents are added or deleted
+        self.version = 0
+        self._store_dir = Path(store_dir) if store_dir is not None else None
+        self._id_key = id_key
+        self._dtype = np.dtype(dtype)
+        if self._dtype not in (np.float32, np.float16):
+            raise ValueError(f"Unsupported vector dtype {dtype}, use float32 or float16")
+        if quantization not in self._QUANTIZATIONS:
+            raise ValueError(f"Unsupported quantization {quantization}, use None or int8")
+        if quantization is not None and store_dir is None:
+            # in memory the codes would be kept on top of the vectors they are meant to replace
+            raise ValueError("A quantized vector store needs a store_dir to keep the full vectors on disk")
+        self._quantization = quantization
+        if store_dir is not None and document_store is not None and not document_store.persistent:
+            raise ValueError("A vector store with a store_dir needs a DocumentStore with a store_dir")
+        self._document_store = document_store
+        self._rerank_factor = rerank_factor
+        self._read_only = read_only
+        self._embedding_batch_size = embedding_batch_size
+        self._embedding_workers = embedding_workers
+        self._max_deleted_ratio = max_deleted_ratio
+        self._analyzer = analyzer
+        if embeddings is None:
+            embeddings = embedding_backend if embedding_backend is not None else OllamaEmbeddingBackend()
+        if embedding_cache_dir is not None:
+            embeddings = CachedEmbeddings(embeddings, embedding_cache_dir, max_entries=embedding_cache_size)
+        self._embeddings = embeddings
+        self._lock = threading.RLock()
+
+        self._count = 0
+        # compactions so far. The files of generation 0 are in the store_dir, later ones in their own directory
+        self._generation = 0
+        # rows written to the ID and document files
+        self._saved_count = 0
+        self._deleted_count = 0
+        self._vectors = None
+        self._deleted = None
+        self._codes = None
+        self._scales = None
+        self._documents = self._new_documents()
+        # chunk ID -> row, built on the first write so opening a store for searching stays instant
+        self._rows = None
+
+        if overwrite:
+            self.delete_vectorstore()
+        if self._store_dir is not None and (self._store_dir / "manifest.json").exists():
+            self._open()
+
+    def add_documents(self, documents: [Document]) -> None:
+        """
+        Adds a list of Documents to the store. Chunks already stored with the same ID are skipped.
+        :param documents: List of Langchain Document objects
+        """
+        with span("vector_add_documents", store="flat"):
+            self._add_chunks(self._split_documents(documents))
+        DOCUMENTS.inc(len(documents), stage="indexed", store="flat")
+
+    def add_split_documents(self, chunks: [Document]) -> None:
+        """
+        Adds chunks already split and given IDs by split_documents, for example by worker processes. Chunks already
+        stored with the same ID are skipped.
+        :param chunks: List of chunks
+        """
+        with span("vector_add_documents", store="flat"):
+            self._add_chunks(chunks)
+
+    def sync_documents(self, documents: [Document]) -> None:
+        """
+        Makes the store match the list of Documents. New and changed chunks are embedded, unchanged chunks are
+        skipped and chunks whose source documents are no longer in the list are deleted.
+        :param documents: The complete list of Langchain Document objects
+        """
+        chunks = self._split_documents(documents)
+        self._add_chunks(chunks)
+        current_ids = {chunk.id for chunk in chunks}
+        with self._lock:
+            stale_ids = [chunk_id for chunk_id, row in self._row_map().items()
+                         if chunk_id not in current_ids and not self._deleted[row]]
+        self.delete_documents(stale_ids)
+
+    def delete_documents(self, ids: [str]) -> None:
+        """
+        Marks chunks as deleted. They are no longer returned by searches and are removed from the files when the
+        store is compacted.
+        :param ids: IDs of the chunks to delete.
+        """
+        self._check_writable()
+        with self._lock:
+            rows = self._row_map()
+            deleted = [rows.pop(chunk_id) for chunk_id in ids if chunk_id in rows]
+            if len(deleted) == 0:
+                return
+            self._deleted[np.asarray(deleted, dtype=np.int64)] = True
+            self._deleted_count += len(deleted)
+            self.version += 1
+            self._logger.info(f"Deleted {len(deleted)} chunks from the vector store")
+            if self._deleted_count > self._max_deleted_ratio * self._count:
+                self.compact()
+            else:
+                self._flush()
+
+    def search_documents(self, text: str, k=10, filter: dict = None) -> list[Document]:
+        """
+        Performs an exact similarity search using the provided text.
+        :param text: Text to search for.
+        :param k: Maximum number of results to return. default: 10
+        :param filter: Only chunks whose metadata matches the filter are scored.
+        :return: A list of matched documents, most similar first.
+        """
+        with span("vector_search", store="flat"):
+            query = self._normalize(np.asarray([self._embeddings.embed_query(
+                self._analyzer.remove_stop_words(text))], dtype=np.float32))
+            documents = self._search(query, k, filter)[0]
+        DOCUMENTS.inc(len(documents), stage="retrieved", store="flat")
+        return documents
+
+    def search_documents_batch(self, texts: [str], k=10, filter: dict = None) -> list[list[Document]]:
+        """
+        Performs similarity searches for several queries. The queries are embedded in one batch and scored with one
+        matrix product.
+        :param texts: Texts to search for.
+        :param k: Maximum number of results per query. default: 10
+        :param filter: Only chunks whose metadata matches the filter are scored.
+        :return: A list of matched documents for each query.
+        """
+        if len(texts) == 0:
+            return []
+        with span("vector_search_batch", store="flat"):
+            queries = self._normalize(np.asarray(self._embeddings.embed_documents(
+                [self._analyzer.remove_stop_words(text) for text in texts]), dtype=np.float32))
+            results = self._search(queries, k, filter)
+        DOCUMENTS.inc(sum(len(documents) for documents in results), stage="retrieved", store="flat")
+        return results
+
+    async def asearch_documents(self, text: str, k=10, filter: dict = None) -> list[Document]:
+        """
+        Performs a similarity search without blocking the event loop. The query is embedded with the async
+        embedding client and scored in a worker thread.
+        """
+        embedding = await self._embeddings.aembed_query(self._analyzer.remove_stop_words(text))
+        query = self._normalize(np.asarray([embedding], dtype=np.float32))
+        return (await asyncio.to_thread(self._search, query, k, filter))[0]
+
+    def get_document_count(self) -> int:
+        """
+        :return: The number of chunks that are not deleted.
+        """
+        return self._count - self._deleted_count
+
+    def document_numbers(self) -> np.ndarray:
+        """
+        :return: The numbers of the live chunks in the DocumentStore, for DocumentStore.compact.
+        """
+        if self._document_store is None:
+            raise ValueError("The vector store does not have a DocumentStore")
+        with self._lock:
+            return np.asarray(self._documents.numbers[:self._count][~self._deleted[:self._count]])
+
+    def compact(self):
+        """
+        Rewrites the store without its deleted chunks.
+        """
+        self._check_writable()
+        with self._lock:
+            if self._deleted_count == 0:
+                return
+            live = np.flatnonzero(~self._deleted[:self._count])
+            vectors = np.array(self._vectors[live])
+            documents = self._documents.get(live)
+            self._logger.info(f"Compacting vector store, removing {self._deleted_count} deleted chunks")
+            state = {name: getattr(self, name) for name in ["_count", "_saved_count", "_deleted_count", "_documents",
+                                                            "_rows", "_generation"] + self._array_attributes()}
+            old_dir = self._data_dir
+            self._count = 0
+            self._saved_count = 0
+            self._deleted_count = 0
+            for name in self._array_attributes():
+                setattr(self, name, None)
+            self._documents = self._new_documents()
+            self._rows = {}
+            self._generation += 1
+            try:
+                if self._store_dir is not None:
+                    # files left by a compaction that was interrupted before its manifest was written
+                    shutil.rmtree(self._data_dir, ignore_errors=True)
+                if len(documents) > 0:
+                    self._append(documents, vectors)
+                else:
+                    self._flush()
+            except BaseException:
+                # the manifest still names the previous generation
+                new_dir = self._data_dir
+                for name, value in state.items():
+                    setattr(self, name, value)
+                if new_dir is not None:
+                    shutil.rmtree(new_dir, ignore_errors=True)
+                raise
+            if old_dir is not None:
+                self._remove_generation(old_dir)
+
+    def delete_vectorstore(self):
+        """
+        Deletes the store directory.
+        """
+        if self._store_dir is not None and self._store_dir.exists():
+            shutil.rmtree(self._store_dir)
+
+    def _split_documents(self, documents: [Document]) -> [Document]:
+        with span("split", store="flat"):
+            chunks = split_documents(documents, self._id_key)
+        CHUNKS.inc(len(chunks), stage="split", store="flat")
+        return chunks
+
+    def _add_chunks(self, chunks: [Document]):
+        """
+        Embeds and stores the chunks that are not already in the store.
+        """
+        self._check_writable()
+        with self._lock:
+            rows = self._row_map()
+            new_chunks = [chunk for chunk in chunks if chunk.id not in rows]
+        self._logger.info(f"Adding {len(new_chunks)} of {len(chunks)} chunks to the vector store")
+        if len(new_chunks) == 0:
+            return
+
+        batches = [new_chunks[start:start + self._embedding_batch_size]
+                   for start in range(0, len(new_chunks), self._embedding_batch_size)]
+        with ThreadPoolExecutor(max_workers=self._embedding_workers) as executor:
+            embedded = list(executor.map(self._embed_batch, batches))
+        vectors = self._normalize(np.concatenate(embedded))
+        CHUNKS.inc(len(new_chunks), stage="embedded", store="flat")
+        with self._lock:
+            # chunks added by another thread while this batch was embedded are skipped
+            rows = self._row_map()
+            keep = [number for number, chunk in enumerate(new_chunks) if chunk.id not in rows]
+            self._append([new_chunks[number] for number in keep], vectors[keep])
+
+    def _embed_batch(self, chunks: [Document]) -> np.ndarray:
+        with span("embed", store="flat"):
+            return np.asarray(self._embeddings.embed_documents([chunk.page_content for chunk in chunks]),
+                              dtype=np.float32)
+
+    def _append(self, chunks: [Document], vectors: np.ndarray):
+        """
+        Appends chunks and their normalized vectors, growing the files when they are full.
+        """
+        if len(chunks) == 0:
+            return
+        if self._vectors is None:
+            self._create(vectors.shape[1])
+        if vectors.shape[1] != self._vectors.shape[1]:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store dimension "
+                             f"{self._vectors.shape[1]}")
+        if self._count + len(chunks) > len(self._vectors):
+            self._grow(max(self._count + len(chunks), len(self._vectors) * 2))
+
+        start = self._count
+        self._vectors[start:start + len(chunks)] = vectors.astype(self._dtype)
+        if self._quantization == "int8":
+            codes, scales = self._quantize(vectors)
+            self._codes[start:start + len(chunks)] = codes
+            self._scales[start:start + len(chunks)] = scales
+        self._deleted[start:start + len(chunks)] = False
+        self._documents.append(chunks)
+        rows = self._row_map()
+        for number, chunk in enumerate(chunks):
+            rows[chunk.id] = start + number
+        self._count += len(chunks)
+        self.version += 1
+        self._flush()
+
+    def _search(self, queries: np.ndarray, k: int, filter: dict = None) -> list[list[Document]]:
+        """
+        :param queries: Normalized query vectors, one per row.
+        :param filter: Only the rows matching the filter are scored.
+        :return: The k most similar live chunks of each query.
+        """
+        with self._lock:
+            count = self._count
+            vectors = self._vectors
+            deleted = self._deleted
+            codes = self._codes
+            scales = self._scales
+            documents = self._documents
+            has_deleted = self._deleted_count > 0
+            rows = None
+            if filter and count > 0:
+                rows = np.flatnonzero(documents.mask(filter)[:count] & ~deleted[:count])
+        if count == 0 or k <= 0 or (rows is not None and len(rows) == 0):
+            return [[] for _ in range(len(queries))]
+
+        matrix = vectors if codes is None else codes
+        if rows is None:
+            scores = self._score(matrix, count, queries)
+            if has_deleted:
+                scores[:, deleted[:count]] = -np.inf
+        else:
+            # a filtered search only reads and scores the matching rows
+            scores = self._score(matrix[rows], len(rows), queries)
+        if codes is not None:
+            scores *= scales[:count] if rows is None else scales[rows]
+
+        results = []
+        for query, query_scores in zip(queries, scores):
+            if codes is None:
+                top = self._top_k(query_scores, k)
+            else:
+                top = self._top_k(query_scores, k * self._rerank_factor)
+            if rows is not None:
+                top = rows[top]
+            if codes is not None:
+                top = self._rerank(vectors, query, top, k)
+            results.append(documents.get(top))
+        return results
+
+    @staticmethod
+    def _rerank(vectors: np.ndarray, query: np.ndarray, candidates: np.ndarray, k: int) -> np.ndarray:
+        """
+        Scores the candidate rows with the full precision vectors. Rows are read in file order.
+        :return: The k best candidate rows, highest score first.
+        """
+        rows = np.sort(candidates)
+        scores = vectors[rows].astype(np.float32) @ query
+        return rows[FlatVectorStore._top_k(scores, k)]
+
+    def _score(self, vectors: np.ndarray, count: int, queries: np.ndarray) -> np.ndarray:
+        """
+        Multiplies the queries with the first count rows of vectors, which may be float32, float16 or int8 codes.
+        :return: The scores of every query with every row, queries by rows.
+        """
+        if vectors.dtype == np.float32:
+            return queries @ vectors[:count].T
+        scores = np.empty((len(queries), count), dtype=np.float32)
+        for start in range(0, count, self._SEARCH_BLOCK_ROWS):
+            end = min(start + self._SEARCH_BLOCK_ROWS, count)
+            scores[:, start:end] = queries @ vectors[start:end].astype(np.float32).T
+        return scores
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """
+        :return: Positions of the k highest finite scores, highest first.
+        """
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top[np.isfinite(scores[top])]
+
+    @staticmethod
+    def _quantize(vectors: np.ndarray) -> tuple:
+        """
+        Maps each vector to int8 codes with a scale, so that codes * scale approximates the vector.
+        :return: The codes and the scale of each vector.
+        """
+        scales = np.abs(vectors).max(axis=1) / 127
+        codes = np.round(np.divide(vectors, scales[:, None], out=np.zeros_like(vectors), where=scales[:, None] > 0))
+        return codes.astype(np.int8), scales.astype(np.float32)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    @property
+    def _data_dir(self):
+        """
+        :return: The directory of the current generation's files, or None for a store kept in memory.
+        """
+        if self._store_dir is None or self._generation == 0:
+            return self._store_dir
+        return self._store_dir / f"generation_{self._generation:06d}"
+
+    def _remove_generation(self, directory: Path):
+        """
+        Deletes the files of a previous generation. Processes that mapped them keep reading them until they close.
+        """
+        if directory != self._store_dir:
+            shutil.rmtree(directory, ignore_errors=True)
+            return
+        for name in [name + ".npy" for name in self._array_names()] + [
+                "ids.txt", DocumentTable._RECORDS_FILE, DocumentTable._OFFSETS_FILE, DocumentStoreTable._NUMBERS_FILE]:
+            (directory / name).unlink(missing_ok=True)
+
+    def _row_map(self) -> dict:
+        if self._rows is None:
+            self._rows = {}
+            if self._count > 0:
+                with open(self._data_dir / "ids.txt", "rb") as f:
+                    ids = f.read().decode("utf-8").split("\n")[:self._saved_count]
+                self._rows = {chunk_id: row for row, chunk_id in enumerate(ids) if not self._deleted[row]}
+        return self._rows
+
+    def _new_documents(self):
+        return DocumentTable() if self._document_store is None else self._document_store.table()
+
+    def _check_writable(self):
+        if self._read_only:
+            raise PermissionError(f"Vector store {self._store_dir} was opened read only")
+
+    def _open(self):
+        with open(self._store_dir / "manifest.json", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version", 1) > self._FORMAT_VERSION:
+            raise ValueError(f"Vector store {self._store_dir} has format version {manifest['format_version']}, "
+                             f"this version of aiasearch opens up to {self._FORMAT_VERSION}")
+        self._count = manifest["count"]
+        self._saved_count = self._count
+        self._deleted_count = manifest["deleted_count"]
+        self._dtype = np.dtype(manifest["dtype"])
+        self._quantization = manifest.get("quantization")
+        self._generation = manifest.get("generation", 0)
+        if self._count > 0:
+            mode = "r" if self._read_only else "r+"
+            for name in self._array_names():
+                setattr(self, "_" + name, np.load(self._data_dir / (name + ".npy"), mmap_mode=mode))
+            self._documents = load_documents(self._data_dir, self._document_store)
+        self._logger.info(f"Opened vector store {self._store_dir} with {self.get_document_count()} chunks")
+
+    def _array_names(self) -> [str]:
+        """
+        :return: Names of the arrays with one entry per row. Each is saved to "<name>.npy".
+        """
+        return ["vectors", "deleted"] + (["codes", "scales"] if self._quantization == "int8" else [])
+
+    def _array_attributes(self) -> [str]:
+        return ["_" + name for name in self._array_names()]
+
+    def _create(self, dimension: int):
+        capacity = self._INITIAL_CAPACITY
+        shapes = {"vectors": ((capacity, dimension), self._dtype), "deleted": ((capacity,), bool),
+                  "codes": ((capacity, dimension), np.int8), "scales": ((capacity,), np.float32)}
+        if self._store_dir is not None:
+            self._data_dir.mkdir(parents=True, exist_ok=True)
+        for name in self._array_names():
+            shape, dtype = shapes[name]
+            if self._store_dir is None:
+                setattr(self, "_" + name, np.zeros(shape, dtype=dtype))
+            else:
+                setattr(self, "_" + name, self._new_file(name + ".npy", shape, dtype))
+
+    def _grow(self, capacity: int):
+        """
+        Copies the per row arrays into larger arrays or files.
+        """
+        self._logger.debug(f"Growing vector store to {capacity} chunks")
+        for name in self._array_names():
+            old = getattr(self, "_" + name)
+            if self._store_dir is None:
+                new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:len(old)] = old
+                setattr(self, "_" + name, new)
+                continue
+            new = self._new_file(name + ".npy.tmp", (capacity,) + old.shape[1:], old.dtype)
+            new[:len(old)] = old
+            new.flush()
+            del new, old
+            os.replace(self._data_dir / (name + ".npy.tmp"), self._data_dir / (name + ".npy"))
+            setattr(self, "_" + name, np.load(self._data_dir / (name + ".npy"), mmap_mode="r+"))
+
+    def _new_file(self, name: str, shape: tuple, dtype):
+        return np.lib.format.open_memmap(self._data_dir / name, mode="w+", shape=shape, dtype=dtype)
+
+    def _flush(self):
+        """
+        Writes new chunks and the manifest. Vectors are flushed before the manifest that counts them.
+        """
+        if self._store_dir is None:
+            return
+        self._store_dir.mkdir(parents=True, exist_ok=True)
+        if self._vectors is not None:
+            for name in self._array_names():
+                getattr(self, "_" + name).flush()
+            new_ids = [chunk.id for chunk in self._documents.get(range(self._saved_count, self._count))]
+            with open(self._data_dir / "ids.txt", "r+b" if self._saved_count > 0 else "wb") as f:
+                self._truncate_ids(f, self._saved_count)
+                f.write("".join(chunk_id + "\n" for chunk_id in new_ids).encode("utf-8"))
+            self._documents.flush(self._data_dir)
+            self._saved_count = self._count
+        manifest = {"format_version": self._FORMAT_VERSION, "dtype": self._dtype.name,
+                    "quantization": self._quantization, "generation": self._generation, "count": self._count,
+                    "deleted_count": self._deleted_count}
+        temp_path = self._store_dir / "manifest.json.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        temp_path.replace(self._store_dir / "manifest.json")
+
+    @staticmethod
+    def _truncate_ids(f, count: int):
+        """
+        Positions the ID file after its first count lines, dropping lines left by an interrupted write.
+        """
+        for _ in range(count):
+            f.readline()
+        f.truncate(f.tell())
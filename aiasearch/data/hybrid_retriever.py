@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+
+from aiasearch.data.document_id import get_document_id
+from aiasearch.data.keyword_store import KeywordStore
+from aiasearch.data.vector_store import VectorStore
+from aiasearch.log import PROJECT_NAME
+
+
+class HybridRetriever:
+    """
+    Searches a vector store and a keyword store at the same time and merges their results with weighted reciprocal
+    rank fusion. A document found by both stores is returned once, ranked by its combined score.
+
+    Documents are recognized by the source of their ID, see document_id, so chunks of the same source row are returned
+    once, as its best ranked chunk. Documents stored without an id_key have IDs made of a content hash alone, and a
+    row the two stores split into different chunks is then returned once per chunk; pass dedupe_key for those.
+
+    The stores are searched on threads of the retriever, call close() or use it as a context manager to stop them.
+    """
+
+    def __init__(self, vector_store: VectorStore, keyword_store: KeywordStore, vector_weight=1.0, keyword_weight=1.0,
+                 rrf_k=60, candidate_k=None, dedupe_key=None, max_workers=2):
+        """
+        :param vector_store: Store used for semantic search.
+        :param keyword_store: Store used for keyword search.
+        :param vector_weight: Weight of the vector store's ranks in the fused score.
+        :param keyword_weight: Weight of the keyword store's ranks in the fused score.
+        :param rrf_k: Reciprocal rank fusion constant. Larger values flatten the difference between ranks.
+        :param candidate_k: Number of results requested from each store. Defaults to the k of the search.
+        :param dedupe_key: Metadata key, such as "permitnumber", used to recognize the same document in both stores.
+        Defaults to the source of the document ID.
+        :param max_workers: Number of threads searching the stores. Each search uses two, so a server answering
+        several searches at once needs two per concurrent search.
+        """
+        self._logger = logging.getLogger(PROJECT_NAME)
+        self._vector_store = vector_store
+        self._keyword_store = keyword_store
+        self._vector_weight = vector_weight
+        self._keyword_weight = keyword_weight
+        self._rrf_k = rrf_k
+        self._candidate_k = candidate_k
+        self._dedupe_key = dedupe_key
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hybrid-retriever")
+
+    def search_documents(self, text: str, k=10, filter: dict = None) -> list[Document]:
+        """
+        Searches both stores concurrently and returns the fused results.
+        :param text: Text to search for.
+        :param k: Maximum number of results to return. default: 10
+        :param filter: Filter on metadata applied by both stores before scoring.
+        :return: A list of documents, best first.
+        """
+        candidate_k = self._candidate_k or k
+        vector_future = self._executor.submit(self._vector_store.search_documents, text, candidate_k, filter=filter)
+        keyword_future = self._executor.submit(self._keyword_store.search_documents, text, candidate_k, filter=filter)
+        vector_documents = vector_future.result()
+        keyword_documents = keyword_future.result()
+        self._logger.debug(f"Hybrid search: {len(vector_documents)} vector and {len(keyword_documents)} "
+                           f"keyword documents")
+        return self.fuse([(vector_documents, self._vector_weight), (keyword_documents, self._keyword_weight)], k)
+
+    def search_documents_batch(self, texts: [str], k=10, filter: dict = None) -> list[list[Document]]:
+        """
+        Searches both stores for several queries, letting each store batch its work, and fuses the results of each
+        query.
+        :param texts: Texts to search for.
+        :param k: Maximum number of results per query. default: 10
+        :param filter: Filter on metadata applied by both stores before scoring.
+        :return: A list of documents, best first, for each query.
+        """
+        candidate_k = self._candidate_k or k
+        vector_future = self._executor.submit(self._vector_store.search_documents_batch, texts, candidate_k,
+                                              filter=filter)
+        keyword_future = self._executor.submit(self._keyword_store.search_documents_batch, texts, candidate_k,
+                                               filter=filter)
+        return [self.fuse([(vector_documents, self._vector_weight), (keyword_documents, self._keyword_weight)], k)
+                for vector_documents, keyword_documents in zip(vector_future.result(), keyword_future.result())]
+
+    async def asearch_documents(self, text: str, k=10, filter: dict = None) -> list[Document]:
+        """
+        Searches both stores concurrently on the event loop and returns the fused results.
+        :param text: Text to search for.
+        :param k: Maximum number of results to return. default: 10
+        :param filter: Filter on metadata applied by both stores before scoring.
+        :return: A list of documents, best first.
+        """
+        candidate_k = self._candidate_k or k
+        vector_documents, keyword_documents = await asyncio.gather(
+            self._vector_store.asearch_documents(text, candidate_k, filter=filter),
+            self._keyword_store.asearch_documents(text, candidate_k, filter=filter))
+        return self.fuse([(vector_documents, self._vector_weight), (keyword_documents, self._keyword_weight)], k)
+
+    def close(self):
+        """
+        Stops the threads searching the stores once the searches in progress finish.
+        """
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def fuse(self, ranked_lists: list[tuple[list[Document], float]], k=10) -> list[Document]:
+        """
+        Merges ranked lists of documents with weighted reciprocal rank fusion,
+        score = sum(weight / (rrf_k + rank)) over the lists a document appears in.
+        :param ranked_lists: Pairs of (documents best first, weight).
+        :param k: Maximum number of results to return.
+        :return: The k documents with the highest fused scores.
+        """
+        scores = {}
+        documents = {}
+        for ranked_documents, weight in ranked_lists:
+            seen = set()
+            for rank, document in enumerate(ranked_documents, start=1):
+                key = self._dedupe(document)
+                if key in seen:
+                    continue
+                seen.add(key)
+                scores[key] = scores.get(key, 0.0) + weight / (self._rrf_k + rank)
+                documents.setdefault(key, document)
+
+        ranked_keys = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [documents[key] for key in ranked_keys]
+
+    def _dedupe(self, document: Document) -> str:
+        if self._dedupe_key is not None and self._dedupe_key in document.metadata:
+            return str(document.metadata[self._dedupe_key])
+        # "<source>:<content hash>" IDs are recognized by their source
+        document_id = get_document_id(document)
+        return document_id.rpartition(":")[0] or document_id
@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 from langchain_core.documents import Document
@@ -12,6 +13,21 @@ class KeywordStore(ABC):
         pass
 
     @abstractmethod
-    def search_documents(self, text: str):
-        """Search documents in a keyword store"""
-        pass
\ No newline at end of file
+    def delete_documents(self, ids: [str]):
+        """Delete documents from a keyword store by ID"""
+        pass
+
+    @abstractmethod
+    def search_documents(self, text: str, k=10, filter: dict = None):
+        """Search documents in a keyword store. A filter on metadata, described in aiasearch.data.metadata_filter,
+        limits the search to the matching documents."""
+        pass
+
+    def search_documents_batch(self, texts: [str], k=10, filter: dict = None) -> list[list]:
+        """Search documents for several queries at once, returning one result list per query. Stores that can
+        batch their work override this; by default each query is searched in turn."""
+        return [self.search_documents(text, k, filter=filter) for text in texts]
+
+    async def asearch_documents(self, text: str, k=10, filter: dict = None):
+        """Async search_documents. By default the synchronous search runs in a worker thread."""
+        return await asyncio.to_thread(self.search_documents, text, k, filter=filter)
\ No newline at end of file
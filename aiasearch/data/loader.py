@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import Iterator
 
 from langchain_core.documents import Document
 
@@ -9,4 +10,8 @@ class Loader(ABC):
     @abstractmethod
     def load(self) -> [Document]:
         """Load data from files and databases"""
-        pass
\ No newline at end of file
+        pass
+
+    def load_iter(self, *args, **kwargs) -> Iterator[list[Document]]:
+        """Load data in batches of documents. Loaders that can stream should override this."""
+        yield self.load(*args, **kwargs)
\ No newline at end of file
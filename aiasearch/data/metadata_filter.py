@@ -0,0 +1,324 @@
+"""
+Filters on document metadata, shared by every store.
+
+A filter is a dictionary in the style of Chroma's where clause. Each entry is a condition on a metadata key and all
+entries must match:
+
+    {"worktype": "INTEXT",
+     "declared_valuation": {"$gte": 100000},
+     "address": {"$prefix": "181"},
+     "issued_date": {"$gte": datetime(2021, 1, 1), "$lt": datetime(2022, 1, 1)}}
+
+A bare value tests equality. The operators are $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin and $prefix. Conditions
+are combined with {"$and": [filter, ...]} and {"$or": [filter, ...]}. Documents without the key never match, not
+even $ne or $nin. Dates and datetimes are compared as seconds since the epoch, the way CsvLoader stores datetime
+columns.
+"""
+import operator
+from datetime import date, datetime, timezone
+
+import numpy as np
+
+_COMPARISONS = {"$eq": operator.eq, "$ne": operator.ne, "$gt": operator.gt, "$gte": operator.ge,
+                "$lt": operator.lt, "$lte": operator.le}
+_OPERATORS = set(_COMPARISONS) | {"$in", "$nin", "$prefix"}
+
+
+def filter_value(value):
+    """
+    :return: The value as it is stored in metadata. Dates and datetimes become seconds since the epoch, naive
+    datetimes are taken to be UTC.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    if isinstance(value, date):
+        return int(datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp())
+    return value
+
+
+def filter_key(filter: dict):
+    """
+    :return: A hashable key identifying the filter, for caching results. None when there is no filter.
+    """
+    if not filter:
+        return None
+    return repr(_canonical(filter))
+
+
+def to_chroma_where(filter: dict):
+    """
+    Translates a filter to a Chroma where clause.
+    :return: The where clause, or None if Chroma cannot evaluate the filter, which is the case for $prefix and for
+    ranges on text.
+    """
+    clauses = []
+    for key, condition in filter.items():
+        if key in ("$and", "$or"):
+            parts = [to_chroma_where(part) for part in condition]
+            if len(parts) == 0 or any(part is None for part in parts):
+                return None
+            clauses.append(parts[0] if len(parts) == 1 else {key: parts})
+            continue
+        for op, value in _operators(key, condition).items():
+            if op == "$prefix":
+                return None
+            if op in ("$in", "$nin"):
+                value = [filter_value(item) for item in value]
+            else:
+                value = filter_value(value)
+                if op not in ("$eq", "$ne") and not _is_number(value):
+                    return None
+            clauses.append({key: {op: value}})
+    if len(clauses) == 0:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class TextColumn:
+    """
+    Strings in one UTF-8 buffer. String i is data[offsets[i]:offsets[i + 1]]. UTF-8 bytes sort in the order of the
+    code points, like Python strings, so filters compare the bytes without decoding the strings.
+    """
+
+    # rows compared at a time, bounding the memory of the byte matrices
+    _BLOCK_ROWS = 1 << 16
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def build(cls, values: [str]) -> "TextColumn":
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+        return cls(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    @classmethod
+    def empty(cls, count: int) -> "TextColumn":
+        return cls(np.zeros(count + 1, dtype=np.int64), np.zeros(0, dtype=np.uint8))
+
+    @classmethod
+    def concatenate(cls, parts: list["TextColumn"]) -> "TextColumn":
+        sizes = np.cumsum([0] + [int(part.offsets[-1]) for part in parts])
+        offsets = np.concatenate([np.zeros(1, dtype=np.int64)] +
+                                 [part.offsets[1:] + size for part, size in zip(parts, sizes)])
+        return cls(offsets, np.concatenate([np.zeros(0, dtype=np.uint8)] +
+                                           [np.asarray(part.data[:part.offsets[-1]]) for part in parts]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def compare(self, op: str, value: str) -> np.ndarray:
+        """
+        :param op: One of $eq, $ne, $gt, $gte, $lt and $lte.
+        :return: The result of comparing each string with the value.
+        """
+        encoded = value.encode("utf-8")
+        lengths = np.diff(self.offsets)
+        if op in ("$eq", "$ne"):
+            # only strings of the same length can be equal
+            equal = np.zeros(len(self), dtype=bool)
+            candidates = np.flatnonzero(lengths == len(encoded))
+            equal[candidates] = self._order(candidates, encoded) == 0
+            return equal if op == "$eq" else ~equal
+        order = self._order(np.arange(len(self)), encoded)
+        # strings starting with the value are longer than it, or equal to it
+        order[(order == 0) & (lengths > len(encoded))] = 1
+        return _COMPARISONS[op](order, 0)
+
+    def startswith(self, prefix: str) -> np.ndarray:
+        """
+        :return: A boolean array marking the strings starting with the prefix.
+        """
+        encoded = prefix.encode("utf-8")
+        matched = np.zeros(len(self), dtype=bool)
+        candidates = np.flatnonzero(np.diff(self.offsets) >= len(encoded))
+        matched[candidates] = self._order(candidates, encoded) == 0
+        return matched
+
+    def _order(self, rows: np.ndarray, encoded: bytes) -> np.ndarray:
+        """
+        :return: -1, 0 or 1 for each row as its first len(encoded) bytes sort before, equal or after the encoded
+        value. A string shorter than the value sorts before it when it is a prefix of the value.
+        """
+        order = np.zeros(len(rows), dtype=np.int8)
+        if len(encoded) == 0 or len(rows) == 0:
+            return order
+        value = np.frombuffer(encoded, dtype=np.uint8).astype(np.int16)
+        data = np.asarray(self.data)
+        positions = np.arange(len(value))
+        for start in range(0, len(rows), self._BLOCK_ROWS):
+            block = rows[start:start + self._BLOCK_ROWS]
+            first = self.offsets[block]
+            # the bytes of each string, -1 past its end so a shorter string sorts first
+            inside = positions < (self.offsets[block + 1] - first)[:, None]
+            if len(data) > 0:
+                indices = np.minimum(first[:, None] + positions, len(data) - 1)
+                matrix = np.where(inside, data[indices].astype(np.int16), -1)
+            else:
+                matrix = np.full(inside.shape, -1, dtype=np.int16)
+            different = matrix != value
+            column = different.argmax(axis=1)
+            order[start:start + len(block)] = np.where(different.any(axis=1),
+                                                       np.sign(matrix[np.arange(len(block)), column] - value[column]),
+                                                       0)
+        return order
+
+
+class MetadataColumn:
+    """
+    The values of one metadata key as arrays: numbers, with NaN where a document has no number, and text, with an
+    empty string where a document has no text.
+    """
+
+    def __init__(self, is_number: np.ndarray, numbers: np.ndarray, is_text: np.ndarray, text: TextColumn):
+        self.is_number = is_number
+        self.numbers = numbers
+        self.is_text = is_text
+        self.text = text
+
+    @classmethod
+    def from_values(cls, values: list) -> "MetadataColumn":
+        """
+        :param values: The value of each document, None where a document does not have the key.
+        """
+        is_number = np.fromiter((_is_number(value) for value in values), dtype=bool, count=len(values))
+        numbers = np.fromiter((value if number else np.nan for value, number in zip(values, is_number)),
+                              dtype=np.float64, count=len(values))
+        is_text = np.fromiter((isinstance(value, str) for value in values), dtype=bool, count=len(values))
+        text = TextColumn.build([value if text else "" for value, text in zip(values, is_text)])
+        return cls(is_number, numbers, is_text, text)
+
+    @classmethod
+    def missing(cls, count: int) -> "MetadataColumn":
+        """
+        :return: The column of a key none of count documents has.
+        """
+        return cls(np.zeros(count, dtype=bool), np.full(count, np.nan), np.zeros(count, dtype=bool),
+                   TextColumn.empty(count))
+
+    @classmethod
+    def concatenate(cls, columns: list["MetadataColumn"]) -> "MetadataColumn":
+        return cls(*[np.concatenate([getattr(column, name) for column in columns])
+                     for name in ("is_number", "numbers", "is_text")],
+                   TextColumn.concatenate([column.text for column in columns]))
+
+    @property
+    def present(self) -> np.ndarray:
+        return self.is_number | self.is_text
+
+
+class MetadataIndex:
+    """
+    A columnar copy of the metadata of a list of documents. Filters are evaluated with array operations over the
+    columns they use, giving a mask of the matching documents that a store applies before scoring.
+    """
+
+    def __init__(self, metadatas: [dict] = None):
+        """
+        :param metadatas: Metadata of each document, in document order.
+        """
+        self._count = 0
+        self._columns: dict[str, MetadataColumn] = {}
+        # columns of the documents appended since a key's column was last used, joined to it on its next use
+        self._appended: dict[str, list[MetadataColumn]] = {}
+        if metadatas is not None:
+            self.append(metadatas)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, metadatas: [dict]):
+        """
+        Adds the metadata of documents added to the end of the list.
+        """
+        metadatas = list(metadatas)
+        if len(metadatas) == 0:
+            return
+        for metadata in metadatas:
+            for key in metadata:
+                if key not in self._columns and key not in self._appended:
+                    self._appended[key] = [MetadataColumn.missing(self._count)]
+        for key in self._columns.keys() | self._appended.keys():
+            self._appended.setdefault(key, []).append(
+                MetadataColumn.from_values([metadata.get(key) for metadata in metadatas]))
+        self._count += len(metadatas)
+
+    def mask(self, filter: dict) -> np.ndarray:
+        """
+        :param filter: Filter to evaluate.
+        :return: A boolean array marking the documents that match the filter.
+        """
+        result = np.ones(self._count, dtype=bool)
+        for key, condition in filter.items():
+            if key == "$and":
+                for part in condition:
+                    result &= self.mask(part)
+            elif key == "$or":
+                matched = np.zeros(self._count, dtype=bool)
+                for part in condition:
+                    matched |= self.mask(part)
+                result &= matched
+            else:
+                for op, value in _operators(key, condition).items():
+                    result &= self._compare(self._column(key), op, value)
+        return result
+
+    def _column(self, key: str) -> MetadataColumn:
+        column = self._columns.get(key)
+        appended = self._appended.pop(key, None)
+        if appended is not None:
+            column = MetadataColumn.concatenate(([column] if column is not None else []) + appended)
+            self._columns[key] = column
+        if column is None:
+            return MetadataColumn.missing(self._count)
+        return column
+
+    @staticmethod
+    def _compare(column: MetadataColumn, op: str, value) -> np.ndarray:
+        if op in ("$in", "$nin"):
+            matched = np.zeros(len(column.present), dtype=bool)
+            for item in value:
+                matched |= MetadataIndex._compare(column, "$eq", item)
+            return matched if op == "$in" else column.present & ~matched
+        if op == "$ne":
+            return column.present & ~MetadataIndex._compare(column, "$eq", value)
+        value = filter_value(value)
+        if op == "$prefix":
+            return column.is_text & column.text.startswith(str(value))
+        if isinstance(value, str):
+            return column.is_text & column.text.compare(op, value)
+        if _is_number(value):
+            with np.errstate(invalid="ignore"):
+                return column.is_number & _COMPARISONS[op](column.numbers, value)
+        raise ValueError(f"Unsupported filter value {value!r}")
+
+
+def _operators(key: str, condition) -> dict:
+    """
+    :return: The condition on a key as a dictionary of operators and values.
+    """
+    if key.startswith("$"):
+        raise ValueError(f"Unsupported filter operator {key}")
+    if not isinstance(condition, dict):
+        return {"$eq": condition}
+    unknown = set(condition) - _OPERATORS
+    if len(unknown) > 0:
+        raise ValueError(f"Unsupported filter operators {sorted(unknown)} on {key}")
+    return condition
+
+
+def _is_number(value) -> bool:
+    # booleans are numbers, as in Python
+    return isinstance(value, (int, float, np.integer, np.floating, np.bool_))
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _canonical(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonical(item) for item in value)
+    return filter_value(value)
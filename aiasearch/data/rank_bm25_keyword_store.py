@@ -1,22 +1,64 @@
 import logging
 
+import numpy as np
 from langchain_core.documents import Document
 from langchain_community.retrievers import BM25Retriever
 
+from aiasearch.analyzer import Analyzer, DEFAULT_ANALYZER
+from aiasearch.data.document_id import get_document_id, with_normalized_text
 from aiasearch.data.keyword_store import KeywordStore
+from aiasearch.data.metadata_filter import MetadataIndex
 from aiasearch.log import PROJECT_NAME
+from aiasearch.metrics import DOCUMENTS, span
 
 
 class RankBm25KeywordStore(KeywordStore):
-    def __init__(self):
+    def __init__(self, id_key=None, analyzer: Analyzer = DEFAULT_ANALYZER):
         self._retriever = None
+        self._metadata = None
+        self._analyzer = analyzer
+        self._documents: dict[str, Document] = {}
+        self._id_key = id_key
+        # incremented whenever documents are added or deleted
+        self.version = 0
         self._logger = logging.getLogger(PROJECT_NAME)
 
     def add_documents(self, documents: [Document]):
-        self._retriever = BM25Retriever.from_documents(documents)
+        for document in documents:
+            document_id = get_document_id(document, self._id_key)
+            self._documents[document_id] = Document(id=document_id, page_content=document.page_content,
+                                                    metadata=with_normalized_text(document.page_content,
+                                                                                  document.metadata))
+        self._rebuild()
 
-    def search_documents(self, text: str, k=10):
-        self._retriever.k = k
-        documents = self._retriever.invoke(text)
+    def delete_documents(self, ids: [str]):
+        for document_id in ids:
+            self._documents.pop(document_id, None)
+        self._rebuild()
+
+    def search_documents(self, text: str, k=10, filter: dict = None):
+        if self._retriever is None:
+            return []
+        with span("keyword_search", store="rank_bm25"):
+            if filter:
+                # rank_bm25 scores every document, the scores of documents not matching the filter are dropped
+                matched = np.flatnonzero(self._metadata.mask(filter))
+                scores = self._retriever.vectorizer.get_scores(self._analyzer.analyze(text))[matched]
+                top = matched[np.argsort(-scores, kind="stable")[:k]]
+                documents = [self._retriever.docs[number] for number in top.tolist()]
+            else:
+                self._retriever.k = k
+                documents = self._retriever.invoke(text)
+        DOCUMENTS.inc(len(documents), stage="retrieved", store="rank_bm25")
         return documents
 
+    def _rebuild(self):
+        self.version += 1
+        # rank_bm25 cannot update its corpus statistics, the retriever is rebuilt from every stored document
+        if len(self._documents) == 0:
+            self._retriever = None
+            self._metadata = None
+        else:
+            self._retriever = BM25Retriever.from_documents(list(self._documents.values()),
+                                                           preprocess_func=self._analyzer.analyze)
+            self._metadata = MetadataIndex(document.metadata for document in self._retriever.docs)
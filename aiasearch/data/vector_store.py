@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 from langchain_core.documents import Document
@@ -11,11 +12,26 @@ class VectorStore(ABC):
         """Add documents to a vector store"""
         pass
 
+    def add_split_documents(self, documents: [Document]):
+        """Add chunks already split and given IDs by aiasearch.data.document_id.split_documents, for example by
+        worker processes. By default the chunks are added like documents, splitting them again has no effect."""
+        self.add_documents(documents)
+
     @abstractmethod
-    def search_documents(self, text: str):
-        """Search documents in a vector store"""
+    def search_documents(self, text: str, k=10, filter: dict = None):
+        """Search documents in a vector store. A filter on metadata, described in aiasearch.data.metadata_filter,
+        limits the search to the matching documents."""
         pass
 
+    def search_documents_batch(self, texts: [str], k=10, filter: dict = None) -> list[list]:
+        """Search documents for several queries at once, returning one result list per query. Stores that can
+        batch their work override this; by default each query is searched in turn."""
+        return [self.search_documents(text, k, filter=filter) for text in texts]
+
+    async def asearch_documents(self, text: str, k=10, filter: dict = None):
+        """Async search_documents. By default the synchronous search runs in a worker thread."""
+        return await asyncio.to_thread(self.search_documents, text, k, filter=filter)
+
     @abstractmethod
     def get_document_count(self) -> int:
         """Return the number of documents in the vector store"""
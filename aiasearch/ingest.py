@@ -0,0 +1,186 @@
+"""
+Ingests a large csv file into a keyword store and a vector store using every core.
+
+The file is split into byte ranges of whole records. A pool of worker processes loads each range into Documents,
+splits them into chunks for the vector store and tokenizes them into a keyword index segment. The main process adds
+each partition's chunks to the vector store as soon as they arrive and, once every partition is done, adds the
+keyword segments to the keyword store and merges them into one.
+
+python -m aiasearch.ingest data.csv --keyword-index-dir ./tmp_keywords --vector-store-dir ./tmp
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from aiasearch.analyzer import Analyzer, DEFAULT_ANALYZER
+from aiasearch.data.bm25_keyword_store import Bm25KeywordStore
+from aiasearch.data.chroma_vector_store import ChromaVectorStore
+from aiasearch.data.csv_loader import CsvLoader
+from aiasearch.data.document_id import split_documents
+from aiasearch.data.document_store import DocumentStore
+from aiasearch.data.embedding_backend import HashingEmbeddingBackend, OllamaEmbeddingBackend
+from aiasearch.data.flat_vector_store import FlatVectorStore
+from aiasearch.data.vector_store import VectorStore
+from aiasearch.log import PROJECT_NAME, log_initialize
+from aiasearch.metrics import DOCUMENTS, span
+
+_logger = logging.getLogger(PROJECT_NAME)
+
+
+def ingest_csv(file_path, keyword_store: Bm25KeywordStore = None, vector_store: VectorStore = None,
+               label_columns=None, combine_columns=None, metadata_columns=None, metadata_types=None, id_key=None,
+               analyzer: Analyzer = DEFAULT_ANALYZER, workers=None, partition_bytes=64 << 20, work_dir=None) -> dict:
+    """
+    Loads a csv file in parallel and adds its documents to the stores.
+    :param file_path: full path to file including file name
+    :param keyword_store: Store the documents are indexed in. None skips keyword indexing.
+    :param vector_store: Store the document chunks are added to. None skips splitting.
+    :param label_columns: Dictionary of columns to map to labels at the beginning of the text, see CsvLoader.
+    :param combine_columns: List of columns appended to the text. None will use all columns.
+    :param metadata_columns: List of columns to add to the document's metadata.
+    :param metadata_types: Dictionary of metadata columns to convert from text.
+    :param id_key: Metadata key identifying a document's source row, as given to the stores.
+    :param analyzer: Analyzer of the keyword store.
+    :param workers: Number of worker processes. Defaults to the number of CPUs.
+    :param partition_bytes: Approximate size of the byte range each worker loads at a time.
+    :param work_dir: Directory for keyword segments built by the workers. Defaults to a temporary directory.
+    :return: Counts of partitions, documents and chunks, and the seconds taken.
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    partitions = max(workers, math.ceil(os.path.getsize(file_path) / partition_bytes))
+    ranges = CsvLoader.partition(file_path, partitions)
+    staging_dir = Path(tempfile.mkdtemp(prefix="ingest-", dir=work_dir))
+    load_options = {"label_columns": label_columns, "combine_columns": combine_columns,
+                    "metadata_columns": metadata_columns, "metadata_types": metadata_types}
+    _logger.info(f"Ingesting {file_path} in {len(ranges)} partitions with {workers} workers")
+
+    document_count = 0
+    chunk_count = 0
+    try:
+        with span("ingest"), ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            next_range = 0
+            # at most two partitions per worker are pending so finished chunks do not pile up in memory
+            while next_range < len(ranges) or len(pending) > 0:
+                while next_range < len(ranges) and len(pending) < workers * 2:
+                    segment_dir = None
+                    if keyword_store is not None:
+                        segment_dir = staging_dir / f"partition_{next_range:06d}"
+                    pending[executor.submit(_ingest_partition, file_path, ranges[next_range], load_options, id_key,
+                                            analyzer, segment_dir, vector_store is not None)] = next_range
+                    next_range += 1
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    partition = pending.pop(future)
+                    documents, chunks = future.result()
+                    document_count += documents
+                    DOCUMENTS.inc(documents, stage="loaded")
+                    if vector_store is not None:
+                        vector_store.add_split_documents(chunks)
+                        chunk_count += len(chunks)
+                    _logger.debug(f"Ingested partition {partition}: {documents} documents, {len(chunks)} chunks")
+
+        if keyword_store is not None:
+            keyword_store.add_segments([staging_dir / f"partition_{number:06d}" for number in range(len(ranges))])
+            keyword_store.compact()
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    seconds = time.perf_counter() - started
+    _logger.info(f"Ingested {document_count} documents and {chunk_count} chunks in {seconds:.1f} seconds")
+    return {"partitions": len(ranges), "documents": document_count, "chunks": chunk_count,
+            "seconds": round(seconds, 3)}
+
+
+def _ingest_partition(file_path, byte_range: tuple, load_options: dict, id_key, analyzer: Analyzer, segment_dir,
+                      split: bool) -> tuple:
+    """
+    Runs in a worker process. Loads the records of a byte range, indexes them in a keyword segment saved to
+    segment_dir and splits them into chunks.
+    :return: The number of documents loaded and the chunks.
+    """
+    documents = []
+    for batch in CsvLoader().load_iter(file_path=file_path, byte_range=byte_range, chunksize=None, **load_options):
+        documents.extend(batch)
+    if segment_dir is not None:
+        Bm25KeywordStore(id_key=id_key, analyzer=analyzer).build_segment(documents, segment_dir)
+    chunks = split_documents(documents, id_key) if split else []
+    return len(documents), chunks
+
+
+def _pairs(values: [str]) -> dict:
+    """
+    :return: A dictionary of "key=value" arguments.
+    """
+    pairs = {}
+    for value in values or []:
+        key, separator, item = value.partition("=")
+        if separator == "":
+            raise argparse.ArgumentTypeError(f"Expected COLUMN=VALUE, got {value}")
+        pairs[key] = item
+    return pairs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest a csv file into aiasearch stores using every core.")
+    parser.add_argument("file_path", help="Path of the csv file.")
+    parser.add_argument("--keyword-index-dir", help="Directory of the keyword index. Omit to skip keyword indexing.")
+    parser.add_argument("--vector-store-dir", help="Directory of the vector store. Omit to skip the vector store.")
+    parser.add_argument("--document-store-dir",
+                        help="Directory of a document store holding the documents of both stores once.")
+    parser.add_argument("--vector-store", choices=["chroma", "flat"], default="chroma", help="Vector store type.")
+    parser.add_argument("--embedding-backend", choices=["ollama", "hashing"], default="ollama",
+                        help="Embedding backend of the vector store.")
+    parser.add_argument("--id-key", help="Metadata column identifying a document's source row, such as permitnumber.")
+    parser.add_argument("--label-columns", nargs="*", metavar="COLUMN=LABEL",
+                        help="Columns added as labeled lines at the start of the text.")
+    parser.add_argument("--combine-columns", nargs="*", help="Columns appended to the text. Defaults to all columns.")
+    parser.add_argument("--metadata-columns", nargs="*", help="Columns added to the metadata.")
+    parser.add_argument("--metadata-types", nargs="*", metavar="COLUMN=TYPE",
+                        help="Types of metadata columns: str, int, float or datetime.")
+    parser.add_argument("--workers", type=int, help="Number of worker processes. Defaults to the number of CPUs.")
+    parser.add_argument("--partition-mb", type=int, default=64, help="Megabytes of csv loaded by a worker at a time.")
+    parser.add_argument("--overwrite", action="store_true", help="Delete the stores first.")
+    args = parser.parse_args(argv)
+
+    log_initialize()
+    document_store = None
+    if args.document_store_dir:
+        document_store = DocumentStore(store_dir=args.document_store_dir, overwrite=args.overwrite)
+    keyword_store = None
+    if args.keyword_index_dir:
+        if args.overwrite:
+            shutil.rmtree(args.keyword_index_dir, ignore_errors=True)
+        keyword_store = Bm25KeywordStore(index_dir=args.keyword_index_dir, id_key=args.id_key,
+                                         background_compaction=False, document_store=document_store)
+    vector_store = None
+    if args.vector_store_dir:
+        backend = HashingEmbeddingBackend() if args.embedding_backend == "hashing" else OllamaEmbeddingBackend()
+        if args.vector_store == "flat":
+            vector_store = FlatVectorStore(store_dir=args.vector_store_dir, overwrite=args.overwrite,
+                                           id_key=args.id_key, embedding_backend=backend,
+                                           document_store=document_store)
+        else:
+            vector_store = ChromaVectorStore(vectorstore_dir=args.vector_store_dir, overwrite=args.overwrite,
+                                             id_key=args.id_key, embedding_backend=backend,
+                                             document_store=document_store)
+
+    summary = ingest_csv(args.file_path, keyword_store=keyword_store, vector_store=vector_store,
+                         label_columns=_pairs(args.label_columns), combine_columns=args.combine_columns,
+                         metadata_columns=args.metadata_columns, metadata_types=_pairs(args.metadata_types),
+                         id_key=args.id_key, workers=args.workers, partition_bytes=args.partition_mb << 20,
+                         work_dir=Path(args.keyword_index_dir).parent if args.keyword_index_dir else None)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
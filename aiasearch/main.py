@@ -1,10 +1,14 @@
 import logging
+from datetime import datetime
 
 from aiasearch.data.chroma_vector_store import ChromaVectorStore
 from aiasearch.data.csv_loader import CsvLoader
-from aiasearch.data.rank_bm25_keyword_store import RankBm25KeywordStore
+from aiasearch.data.document_store import DocumentStore
+from aiasearch.data.hybrid_retriever import HybridRetriever
+from aiasearch.data.bm25_keyword_store import Bm25KeywordStore
 from aiasearch.models.ollama_provider import OllamaProvider
 from aiasearch.models.anthropic_provider import AnthropicProvider
+from aiasearch.metrics import REGISTRY
 from log import PROJECT_NAME, log_initialize
 
 if __name__ == "__main__":
@@ -33,38 +37,52 @@ if __name__ == "__main__":
                                                  "description",
                                                  "comments",
                                                  "address", "city", "state", "zip"],
-                                metadata_columns=["permitnumber"],
+                                metadata_columns=["permitnumber", "worktype", "address", "declared_valuation",
+                                                  "issued_date"],
+                                metadata_types={"declared_valuation": "float", "issued_date": "datetime"},
                                 max_rows=10000)
 
+    # both stores keep their documents in one shared document store, which holds the text and metadata of each
+    # document once in columns on disk. the stores only keep document numbers and search results are read from it.
+    # the documents of stores saved without a document store are moved into it when the stores are opened
+    document_store = DocumentStore(store_dir="./tmp_documents")
+
     # create a vector store interface. set overwrite=True to recreate the vectorstore
+    # only new or changed permits are embedded, permits no longer in the file are removed. a permit whose metadata
+    # changed, for example after adding a metadata column, counts as changed
+    # embeddings are cached on disk so rebuilding the vectorstore and repeated questions skip Ollama
     overwrite_vectorstore = False
     vectorstore_dir = "./tmp"
-    vector_store = ChromaVectorStore(vectorstore_dir=str(vectorstore_dir), overwrite=overwrite_vectorstore)
-    if vector_store.get_document_count() == 0:
-        vector_store.add_documents(documents)
+    embedding_cache_dir = "./tmp_embeddings"
+    vector_store = ChromaVectorStore(vectorstore_dir=str(vectorstore_dir), overwrite=overwrite_vectorstore,
+                                     id_key="permitnumber", embedding_cache_dir=embedding_cache_dir,
+                                     document_store=document_store)
+    vector_store.sync_documents(documents)
 
-    # create a keyword store
-    rank_bm25 = RankBm25KeywordStore()
-    rank_bm25.add_documents(documents)
+    # create a keyword store. the index is saved to keyword_index_dir and opened from there on the next run
+    # like the vector store only new or changed permits are indexed
+    keyword_index_dir = "./tmp_keywords"
+    keyword_store = Bm25KeywordStore(index_dir=keyword_index_dir, id_key="permitnumber", document_store=document_store)
+    keyword_store.sync_documents(documents)
+    # the loaded documents are no longer needed once the stores are synced
+    del documents
+    # documents neither store uses any more, such as old versions of changed permits, are removed from the
+    # document store
+    document_store.compact([vector_store.document_numbers(), keyword_store.document_numbers()])
 
-    # search the vector store
+    # search the vector store and the keyword store at the same time and merge the results
     question = "List work performed on Newbury ST"
 
-    search_documents = vector_store.search_documents(question, 10)
-    logger.info("Vector Search Documents: " + str(len(search_documents)))
-    logger.info("\n\n**************************************\n")
-    if len(search_documents) > 0:
-        logger.info("First Vector Document:\n" + search_documents[0].page_content)
-    logger.info("\n\n**************************************\n")
+    # a filter on the metadata columns limits both searches to matching permits, for example
+    # {"worktype": "INTEXT", "issued_date": {"$gte": datetime(2021, 1, 1)}}
+    search_filter = None
 
-    # keyword search
-    filtered_question = [word for word in question.split() if word.lower() not in vector_store.stop_words]
-    keyword_documents = rank_bm25.search_documents(question, k=10)
-    search_documents.extend(keyword_documents)
-    logger.info("Keyword Search Documents: " + str(len(keyword_documents)))
+    with HybridRetriever(vector_store, keyword_store, dedupe_key="permitnumber") as retriever:
+        search_documents = retriever.search_documents(question, 10, filter=search_filter)
+    logger.info("Hybrid Search Documents: " + str(len(search_documents)))
     logger.info("\n\n**************************************\n")
-    if len(keyword_documents) > 0:
-        logger.info("First Keyword Document:\n" + keyword_documents[0].page_content)
+    if len(search_documents) > 0:
+        logger.info("First Document:\n" + search_documents[0].page_content)
 
     logger.info("\n**************************************\n")
 
@@ -74,3 +92,7 @@ if __name__ == "__main__":
     result_text = llm.query_grounded(question, search_documents)
     logger.info("Question: " + question)
     logger.info("Answer: " + result_text)
+
+    # log where the time went: a line per operation with its count and latency percentiles, and the counters of
+    # documents, chunks, tokens and cache hits. REGISTRY.to_prometheus() returns the same in the Prometheus format
+    REGISTRY.log_metrics()
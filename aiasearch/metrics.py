@@ -0,0 +1,271 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from aiasearch.log import PROJECT_NAME
+
+# upper bounds in seconds of the latency buckets, from cache lookups to LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics_logger = logging.getLogger(PROJECT_NAME + ".metrics")
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(label_key: tuple, extra: tuple = ()) -> str:
+    items = list(label_key) + list(extra)
+    if len(items) == 0:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f"{name}=\"{value}\"" for (name, _), value in zip(items, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_fields(**fields) -> str:
+    """
+    :return: The fields as a structured log line, key=value separated by spaces. Values containing spaces are quoted.
+    """
+    parts = []
+    for name, value in fields.items():
+        value = str(value)
+        if value == "" or " " in value or "\"" in value or "=" in value:
+            value = "\"" + value.replace("\"", "\\\"") + "\""
+        parts.append(f"{name}={value}")
+    return " ".join(parts)
+
+
+class Counter:
+    """
+    A value that only increases, such as the number of documents indexed. Each set of labels is a separate series.
+    """
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """
+        :return: The value of the series with the labels, 0 if nothing was counted.
+        """
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def prometheus_lines(self) -> [str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+    def log_lines(self) -> [str]:
+        with self._lock:
+            return [format_fields(metric=self.name, **dict(key), value=value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """
+    Counts observations, such as latencies, in cumulative buckets. Each set of labels is a separate series.
+    """
+
+    def __init__(self, name: str, description: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [count of each bucket, count above the last bucket], sum, count
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[key] = series
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            return series[2] if series is not None else 0
+
+    def sum(self, **labels) -> float:
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            return series[1] if series is not None else 0.0
+
+    def quantile(self, quantile: float, **labels) -> float:
+        """
+        Estimates a quantile by linear interpolation within the bucket it falls in, as Prometheus'
+        histogram_quantile does.
+        :return: The estimated value, NaN if nothing was observed.
+        """
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            if series is None:
+                return math.nan
+            return self._quantile(series, quantile)
+
+    def _quantile(self, series: list, quantile: float) -> float:
+        counts, _, total = series
+        rank = quantile * total
+        cumulative = 0
+        for position, count in enumerate(counts):
+            if count > 0 and cumulative + count >= rank:
+                if position == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[position - 1] if position > 0 else 0.0
+                return lower + (self.buckets[position] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def prometheus_lines(self) -> [str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += bucket_count
+                    le = (("le", _format_value(float(bound))),)
+                    lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def log_lines(self) -> [str]:
+        with self._lock:
+            return [format_fields(metric=self.name, **dict(key), count=series[2], sum=round(series[1], 6),
+                                  p50=round(self._quantile(series, 0.5), 6),
+                                  p95=round(self._quantile(series, 0.95), 6),
+                                  p99=round(self._quantile(series, 0.99), 6))
+                    for key, series in sorted(self._series.items())]
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics of the process and exports them in the Prometheus text format or as structured log lines.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, description: str) -> Counter:
+        """
+        :return: The counter with the name, created the first time it is requested.
+        """
+        return self._get_or_create(name, lambda: Counter(name, description), Counter)
+
+    def histogram(self, name: str, description: str, buckets=LATENCY_BUCKETS) -> Histogram:
+        """
+        :return: The histogram with the name, created the first time it is requested.
+        """
+        return self._get_or_create(name, lambda: Histogram(name, description, buckets), Histogram)
+
+    def _get_or_create(self, name: str, create, metric_type):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = create()
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_type):
+                raise ValueError(f"Metric {name} is already registered as a {type(metric).__name__}")
+            return metric
+
+    def reset(self):
+        """
+        Clears the values of every metric. The metrics stay registered.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    def to_prometheus(self) -> str:
+        """
+        :return: Every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = [line for metric in metrics for line in metric.prometheus_lines()]
+        return "\n".join(lines) + "\n"
+
+    def log_metrics(self, level=logging.INFO):
+        """
+        Logs one structured line per metric series, with counts, sums and latency percentiles of histograms.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            for line in metric.log_lines():
+                _metrics_logger.log(level, line)
+
+
+REGISTRY = MetricsRegistry()
+
+SPAN_SECONDS = REGISTRY.histogram("aiasearch_span_seconds", "Duration of instrumented operations in seconds.")
+SPAN_ERRORS = REGISTRY.counter("aiasearch_span_errors_total", "Instrumented operations that raised an exception.")
+DOCUMENTS = REGISTRY.counter("aiasearch_documents_total", "Documents loaded, indexed or returned by a search.")
+CHUNKS = REGISTRY.counter("aiasearch_chunks_total", "Chunks split from documents and embedded.")
+TOKENS = REGISTRY.counter("aiasearch_tokens_total", "Estimated tokens sent to and received from models.")
+CACHE_REQUESTS = REGISTRY.counter("aiasearch_cache_requests_total", "Cache lookups by cache and result.")
+EMBEDDING_BATCH_SIZE = REGISTRY.histogram("aiasearch_embedding_batch_size", "Queries embedded together in one call.",
+                                          buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+SERVER_REQUESTS = REGISTRY.counter("aiasearch_server_requests_total", "Query server requests by endpoint and status.")
+
+
+@contextmanager
+def span(name: str, **labels):
+    """
+    Times the enclosed block. The duration is recorded in the aiasearch_span_seconds histogram and logged at debug
+    level as a structured line. Exceptions are counted in aiasearch_span_errors_total and re-raised.
+    :param name: Name of the operation, such as "vector_search".
+    :param labels: Labels of the series, such as store="chroma".
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        SPAN_ERRORS.inc(span=name, **labels)
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        SPAN_SECONDS.observe(seconds, span=name, **labels)
+        if _metrics_logger.isEnabledFor(logging.DEBUG):
+            _metrics_logger.debug(format_fields(span=name, **labels, seconds=round(seconds, 6)))
+
+
+def record_cache(cache: str, hit: bool):
+    """
+    Counts a cache lookup as a hit or a miss.
+    """
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from aiasearch.data.document_id import get_document_id
+from aiasearch.log import PROJECT_NAME
+from aiasearch.metrics import record_cache
+
+
+class AnswerCache:
+    """
+    Caches answers to grounded questions in a local SQLite database. A cached answer is reused when a new question
+    is semantically similar to the cached question, was asked of the same model and prompt version, and was given
+    exactly the same set of documents.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache_path, similarity_threshold=0.95, max_entries=10000, ttl=None):
+        """
+        :param embeddings: Embeddings used to compare questions.
+        :param cache_path: Path of the SQLite database file. ":memory:" keeps the cache in memory.
+        :param similarity_threshold: Minimum cosine similarity between questions for a cached answer to be used.
+        :param max_entries: Maximum number of cached answers. The least recently used answers are evicted first.
+        :param ttl: Seconds an answer is valid for. None keeps answers until they are evicted.
+        """
+        self._logger = logging.getLogger(PROJECT_NAME)
+        self._embeddings = embeddings
+        self._similarity_threshold = similarity_threshold
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        if cache_path != ":memory:":
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(cache_path), check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY,
+                model_name TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                context_key TEXT NOT NULL,
+                question TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS answers_key ON answers (model_name, prompt_version, context_key)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self._connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, model_name: str, prompt_version: str, text: str, documents: [Document],
+                       compute: Callable[[], str]) -> str:
+        """
+        Returns a cached answer for the question, or computes, caches and returns a new one.
+        :param model_name: Name of the model answering the question.
+        :param prompt_version: Version of the prompt the model is given.
+        :param text: The question.
+        :param documents: Documents the question is grounded on.
+        :param compute: Called to answer the question on a cache miss.
+        :return: The answer
+        """
+        embedding = self._embed(text)
+        context_key = self.context_key(documents)
+        answer = self.lookup(model_name, prompt_version, context_key, embedding)
+        if answer is not None:
+            return answer
+        answer = compute()
+        self.store(model_name, prompt_version, context_key, text, embedding, answer)
+        return answer
+
+    async def aget_or_compute(self, model_name: str, prompt_version: str, text: str, documents: [Document],
+                              compute: Callable[[], Awaitable[str]]) -> str:
+        """
+        Async get_or_compute. The question is embedded with the async embedding client and the database is accessed
+        in a worker thread.
+        :param compute: Awaited to answer the question on a cache miss.
+        """
+        embedding = self._normalize(await self._embeddings.aembed_query(text))
+        context_key = self.context_key(documents)
+        answer = await asyncio.to_thread(self.lookup, model_name, prompt_version, context_key, embedding)
+        if answer is not None:
+            return answer
+        answer = await compute()
+        await asyncio.to_thread(self.store, model_name, prompt_version, context_key, text, embedding, answer)
+        return answer
+
+    def lookup(self, model_name: str, prompt_version: str, context_key: str, embedding: np.ndarray) -> Optional[str]:
+        """
+        :param model_name: Name of the model answering the question.
+        :param prompt_version: Version of the prompt the model is given.
+        :param context_key: Key of the document set, from context_key().
+        :param embedding: Normalized embedding of the question.
+        :return: The answer of the most similar cached question above the threshold, or None.
+        """
+        with self._lock:
+            query = "SELECT id, embedding, answer FROM answers " \
+                    "WHERE model_name = ? AND prompt_version = ? AND context_key = ?"
+            parameters = [model_name, prompt_version, context_key]
+            if self._ttl is not None:
+                query += " AND created > ?"
+                parameters.append(time.time() - self._ttl)
+            rows = self._connection.execute(query, parameters).fetchall()
+            if len(rows) > 0:
+                candidates = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+                similarities = candidates @ embedding
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self._similarity_threshold:
+                    self._connection.execute("UPDATE answers SET last_used = ? WHERE id = ?",
+                                             (time.time(), rows[best][0]))
+                    self._connection.commit()
+                    self.hits += 1
+                    record_cache("answer", True)
+                    return rows[best][2]
+            self.misses += 1
+            record_cache("answer", False)
+            return None
+
+    def store(self, model_name: str, prompt_version: str, context_key: str, text: str, embedding: np.ndarray,
+              answer: str):
+        """
+        Adds an answer to the cache, evicting the least recently used answers when the cache is full.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO answers (model_name, prompt_version, context_key, question, embedding, answer, created, "
+                "last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (model_name, prompt_version, context_key, text, embedding.astype(np.float32).tobytes(), answer, now,
+                 now))
+            count = self._connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self._max_entries:
+                self._connection.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)",
+                    (count - self._max_entries,))
+            self._connection.commit()
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM answers")
+            self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    @staticmethod
+    def context_key(documents: [Document]) -> str:
+        """
+        :return: A key identifying the set of documents, independent of their order.
+        """
+        ids = sorted({get_document_id(document) for document in documents})
+        return hashlib.sha256("\n".join(ids).encode("utf-8")).hexdigest()
+
+    def _embed(self, text: str) -> np.ndarray:
+        return self._normalize(self._embeddings.embed_query(text))
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
@@ -1,75 +1,58 @@
-import logging
-
-from langchain_core.messages import BaseMessage
-
-from aiasearch.models.provider import Provider
 from langchain_anthropic import ChatAnthropic
 from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
-from ..log import PROJECT_NAME
 
-from ..prompts.prompts import PromptManager
+from .chat_model_provider import ChatModelProvider
+from .model_registry import get_shared_model
+
 
-class AnthropicProvider(Provider):
+class AnthropicProvider(ChatModelProvider):
     """
         Connection provider to Anthropic API.
         The API Key is set using the "ANTHROPIC_API_KEY" environment variable.
         """
 
-    def __init__(self, model_name: str="claude-3-5-haiku-20241022", prompt_path=None):
-        self._logger = logging.getLogger(PROJECT_NAME)
-        self._model = ChatAnthropic(
-            model=model_name,
-            temperature=0,
-            max_tokens=1024,
-            timeout=None,
-            max_retries=2
-        )
-        self._model_name = model_name
-        self._prompt_path = prompt_path
+    provider_label = "anthropic"
 
-    def query_text(self, text) -> str:
+    def __init__(self, model_name: str="claude-3-5-haiku-20241022", prompt_path=None, context_tokens=3000,
+                 max_concurrency=8, requests_per_second=0.8, chat_model: BaseChatModel = None):
         """
-        Sends a prompt and returns the text result.
-        :param text: Prompt message to send to Ollama.
-        :return: Text response from the LLM.
+        :param model_name: Name of the Anthropic model.
+        :param prompt_path: Optional path of the prompts file.
+        :param context_tokens: Token budget of the documents given to grounded questions.
+        :param max_concurrency: Maximum number of concurrent batch requests, across all batches of the provider.
+        :param requests_per_second: Rate limit of batch requests. The default stays within the 50 requests per minute
+        of Anthropic's lowest usage tier. None does not limit the rate.
+        :param chat_model: Chat model to answer with instead of the shared ChatAnthropic model, such as a fake model
+        for benchmarks.
         """
-        summarize_prompt = ChatPromptTemplate.from_messages(
-            [
-                (
-                    "system",
-                    "",
-                ),
-                ("human", "{input}"),
-            ]
-        )
-        summary_chain = summarize_prompt | self._model | StrOutputParser()
-
-        response_text = summary_chain.invoke(
-            {
-                "input": text,
-            }
-        )
-
-        self._logger.info("response text: " + response_text)
-        return response_text
-
-    def query_grounded(self, text: str, documents: [Document]) -> str:
-
-        def format_docs(docs):
-            t = "\n\n".join(' '.join(document.page_content.split()) for document in docs)
-            return t
-
-        llama_prompts = PromptManager(model_name=self._model_name, prompt_path=self._prompt_path)
-        prompts = llama_prompts.get_full_prompt(
-            task="query_grounded"
-        )
-
-        prompt_final_document_summary = ChatPromptTemplate.from_template(
-            prompts["system"] + "\n" + prompts["user"]
-        )
-
-        chain = prompt_final_document_summary | self._model | StrOutputParser()
-        result_text = chain.invoke({"docs": format_docs(documents), "text": text})
-        return result_text
\ No newline at end of file
+        model = chat_model if chat_model is not None else get_shared_model(
+            ("anthropic", model_name), lambda: ChatAnthropic(
+                model=model_name,
+                temperature=0,
+                max_tokens=1024,
+                timeout=None,
+                max_retries=2
+            ))
+        # failed batch requests are retried by run_batch, which also passes retries through the rate limiter, so the
+        # model answering batches does not retry
+        self._batch_model = chat_model if chat_model is not None else get_shared_model(
+            ("anthropic", model_name, "batch"), lambda: ChatAnthropic(
+                model=model_name,
+                temperature=0,
+                max_tokens=1024,
+                timeout=None,
+                max_retries=0
+            ))
+        super().__init__(model, model_name, prompt_path, context_tokens, max_concurrency, requests_per_second)
+
+    def query_grounded_no_retry(self, text: str, documents: [Document]) -> str:
+        return self._query_grounded(self._batch_grounded_chain(), text, documents)
+
+    async def aquery_grounded_no_retry(self, text: str, documents: [Document]) -> str:
+        return await self._aquery_grounded(self._batch_grounded_chain(), text, documents)
+
+    def _batch_grounded_chain(self):
+        return self._chain("query_grounded_batch",
+                           lambda: self._grounded_prompt() | self._batch_model | StrOutputParser())
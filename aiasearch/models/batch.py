@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from langchain_core.documents import Document
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from aiasearch.log import PROJECT_NAME
+
+_logger = logging.getLogger(PROJECT_NAME)
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors (5xx)
+_RETRYABLE_STATUS = {408, 409, 429}
+_RETRYABLE_ERRORS = (ConnectionError, TimeoutError, httpx.TransportError)
+# longest wait before a retry, even if the server asks for a longer one
+_MAX_RETRY_DELAY = 60.0
+
+
+class BatchResult:
+    """
+    The outcome of one question of a batch. Exactly one of answer and error is set.
+    """
+
+    def __init__(self, text: str, documents: [Document], answer: Optional[str] = None,
+                 error: Optional[Exception] = None):
+        self.text = text
+        self.documents = documents
+        self.answer = answer
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return f"BatchResult(text={self.text!r}, answer={self.answer!r}, error={self.error!r})"
+
+
+class ConcurrencyLimiter:
+    """
+    Limits the number of requests a provider has in flight, across every batch sent to it at the same time.
+    """
+
+    def __init__(self, max_concurrency: int, check_every_n_seconds=0.01):
+        """
+        :param max_concurrency: Maximum number of requests in flight.
+        :param check_every_n_seconds: How often aacquire checks for a free slot.
+        """
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._check_every_n_seconds = check_every_n_seconds
+
+    def acquire(self):
+        self._slots.acquire()
+
+    async def aacquire(self):
+        # a waiting coroutine must not hold a thread, so the slot is polled like InMemoryRateLimiter polls its bucket
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(self._check_every_n_seconds)
+
+    def release(self):
+        self._slots.release()
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    :return: True for errors a retry may fix: connection errors, timeouts, rate limits and server errors. Errors
+    such as failed authentication or an invalid request fail the same way every time.
+    """
+    status = _status_code(error)
+    if status is not None:
+        return status in _RETRYABLE_STATUS or status >= 500
+    while error is not None:
+        # client libraries wrap transport errors in their own exception types
+        if isinstance(error, _RETRYABLE_ERRORS):
+            return True
+        error = error.__cause__
+    return False
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    :return: Seconds to wait before retrying, from the Retry-After header of an HTTP error, or None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is None:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_delay(error: Exception, attempt: int, max_retries: int, retry_delay: float) -> Optional[float]:
+    """
+    :return: Seconds to wait before retrying a failed attempt, or None if the question should fail.
+    """
+    if attempt == max_retries or not is_retryable(error):
+        _logger.warning(f"batch question failed after {attempt + 1} attempts: {error}")
+        return None
+    delay = retry_after(error)
+    return min(delay if delay is not None else retry_delay * 2 ** attempt, _MAX_RETRY_DELAY)
+
+
+def run_batch(query: Callable[[str, list[Document]], str], items: list[tuple[str, list[Document]]],
+              max_concurrency: int, rate_limiter: BaseRateLimiter = None, max_retries=2,
+              retry_delay=1.0, concurrency_limiter: ConcurrencyLimiter = None) -> list[BatchResult]:
+    """
+    Answers grounded questions concurrently on a thread pool. Questions failing with an error a retry may fix, see
+    is_retryable, are retried after the delay the server asks for in Retry-After, or else with exponential backoff.
+    Other errors fail the question at once. This is the only retry layer, the providers' clients do not retry.
+    :param query: Answers a single question, such as Provider.query_grounded.
+    :param items: Pairs of (question, documents).
+    :param max_concurrency: Maximum number of questions of this batch answered at the same time.
+    :param rate_limiter: Token bucket every request, including retries, must acquire a token from.
+    :param max_retries: Number of times a failed question is retried.
+    :param retry_delay: Seconds before the first retry, doubled on each further retry.
+    :param concurrency_limiter: Limit on the requests in flight shared with other batches, such as the provider's.
+    :return: A result for each item, in the order of the items.
+    """
+    def answer(item) -> BatchResult:
+        text, documents = item
+        for attempt in range(max_retries + 1):
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            if concurrency_limiter is not None:
+                concurrency_limiter.acquire()
+            try:
+                return BatchResult(text, documents, answer=query(text, documents))
+            except Exception as e:
+                error = e
+            finally:
+                if concurrency_limiter is not None:
+                    concurrency_limiter.release()
+            delay = _retry_delay(error, attempt, max_retries, retry_delay)
+            if delay is None:
+                return BatchResult(text, documents, error=error)
+            time.sleep(delay)
+
+    if len(items) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(items))),
+                            thread_name_prefix="grounded-batch") as executor:
+        return list(executor.map(answer, items))
+
+
+async def arun_batch(aquery: Callable[[str, list[Document]], Awaitable[str]],
+                     items: list[tuple[str, list[Document]]], max_concurrency: int,
+                     rate_limiter: BaseRateLimiter = None, max_retries=2, retry_delay=1.0,
+                     concurrency_limiter: ConcurrencyLimiter = None) -> list[BatchResult]:
+    """
+    Async run_batch. Questions are answered concurrently on the event loop, limited by a semaphore.
+    :param aquery: Answers a single question, such as Provider.aquery_grounded.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def answer(text: str, documents: [Document]) -> BatchResult:
+        async with semaphore:
+            for attempt in range(max_retries + 1):
+                if rate_limiter is not None:
+                    await rate_limiter.aacquire()
+                if concurrency_limiter is not None:
+                    await concurrency_limiter.aacquire()
+                try:
+                    return BatchResult(text, documents, answer=await aquery(text, documents))
+                except Exception as e:
+                    error = e
+                finally:
+                    if concurrency_limiter is not None:
+                        concurrency_limiter.release()
+                delay = _retry_delay(error, attempt, max_retries, retry_delay)
+                if delay is None:
+                    return BatchResult(text, documents, error=error)
+                await asyncio.sleep(delay)
+
+    return list(await asyncio.gather(*(answer(text, documents) for text, documents in items)))
@@ -0,0 +1,183 @@
+import logging
+from typing import AsyncIterator, Iterator
+
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+from ..log import PROJECT_NAME
+from ..metrics import TOKENS, span
+from ..prompts.prompts import PromptManager
+from .context_packer import ContextPacker
+from .provider import Provider
+from .stream_stats import StreamStats
+
+
+class ChatModelProvider(Provider):
+    """
+    Provider answering with a LangChain chat model. Subclasses create the model and set provider_label, the provider
+    label of the token metrics and spans.
+    """
+
+    provider_label: str = ""
+    # joins the system and user prompts of grounded questions
+    _prompt_separator = "\n"
+
+    def __init__(self, model: BaseChatModel, model_name: str, prompt_path=None, context_tokens=3000,
+                 max_concurrency=4, requests_per_second=None):
+        """
+        :param model: Chat model answering the questions.
+        :param model_name: Name of the model.
+        :param prompt_path: Optional path of the prompts file.
+        :param context_tokens: Token budget of the documents given to grounded questions.
+        :param max_concurrency: Maximum number of concurrent batch requests, across all batches of the provider.
+        :param requests_per_second: Rate limit of batch requests. None does not limit the rate.
+        """
+        self._logger = logging.getLogger(PROJECT_NAME)
+        self._model = model
+        self._model_name = model_name
+        self._prompt_path = prompt_path
+        self._prompts = PromptManager.get(model_name=model_name, prompt_path=prompt_path)
+        self._chains = {}
+        self._context_packer = ContextPacker(model_name=model_name, max_tokens=context_tokens)
+        self.max_concurrency = max_concurrency
+        if requests_per_second is not None:
+            self.rate_limiter = InMemoryRateLimiter(requests_per_second=requests_per_second,
+                                                    max_bucket_size=max_concurrency)
+
+    def query_text(self, text) -> str:
+        """
+        Sends a prompt and returns the text result.
+        :param text: Prompt message to send to the model.
+        :return: Text response from the LLM.
+        """
+        response_text = self._text_chain().invoke({"input": text})
+        self._logger.info("response text: " + response_text)
+        return response_text
+
+    async def aquery_text(self, text) -> str:
+        """
+        Sends a prompt and returns the text result without blocking the event loop.
+        :param text: Prompt message to send to the model.
+        :return: Text response from the LLM.
+        """
+        response_text = await self._text_chain().ainvoke({"input": text})
+        self._logger.info("response text: " + response_text)
+        return response_text
+
+    def prompt_version(self, task: str = "query_grounded") -> str:
+        """
+        :param task: The prompt task.
+        :return: A version identifier of the prompt used for the task.
+        """
+        return self._prompts.get_prompt_version(task)
+
+    def query_grounded(self, text: str, documents: [Document]) -> str:
+        return self._query_grounded(self._grounded_chain(), text, documents)
+
+    async def aquery_grounded(self, text: str, documents: [Document]) -> str:
+        """
+        Answers a question using only the provided documents without blocking the event loop.
+        :param text: The question.
+        :param documents: Documents to ground the answer on.
+        :return: Text response from the LLM.
+        """
+        return await self._aquery_grounded(self._grounded_chain(), text, documents)
+
+    def stream_grounded(self, text: str, documents: [Document], stats: StreamStats = None) -> Iterator[str]:
+        """
+        Answers a question using only the provided documents, yielding the answer as tokens arrive.
+        :param text: The question.
+        :param documents: Documents to ground the answer on.
+        :param stats: Receives the time to first token and the number of tokens.
+        :return: A generator of answer text chunks.
+        """
+        stats = stats if stats is not None else StreamStats()
+        stats.start()
+        for chunk in self._grounded_stream_chain().stream(self._grounded_input(text, documents)):
+            token = stats.record(chunk)
+            if token:
+                yield token
+        stats.finish()
+        TOKENS.inc(stats.total_tokens, direction="output", provider=self.provider_label, model=self._model_name)
+        self._logger.debug(f"streamed answer: {stats}")
+
+    async def astream_grounded(self, text: str, documents: [Document],
+                               stats: StreamStats = None) -> AsyncIterator[str]:
+        """
+        Async stream_grounded.
+        :param text: The question.
+        :param documents: Documents to ground the answer on.
+        :param stats: Receives the time to first token and the number of tokens.
+        :return: An async generator of answer text chunks.
+        """
+        stats = stats if stats is not None else StreamStats()
+        stats.start()
+        async for chunk in self._grounded_stream_chain().astream(self._grounded_input(text, documents)):
+            token = stats.record(chunk)
+            if token:
+                yield token
+        stats.finish()
+        TOKENS.inc(stats.total_tokens, direction="output", provider=self.provider_label, model=self._model_name)
+        self._logger.debug(f"streamed answer: {stats}")
+
+    def _query_grounded(self, chain, text: str, documents: [Document]) -> str:
+        with span("llm_query_grounded", provider=self.provider_label, model=self._model_name):
+            response_text = chain.invoke(self._grounded_input(text, documents))
+        self._record_output_tokens(response_text)
+        return response_text
+
+    async def _aquery_grounded(self, chain, text: str, documents: [Document]) -> str:
+        with span("llm_query_grounded", provider=self.provider_label, model=self._model_name):
+            response_text = await chain.ainvoke(self._grounded_input(text, documents))
+        self._record_output_tokens(response_text)
+        return response_text
+
+    def _chain(self, name: str, build):
+        # chains are built on first use, once per task, and reused by every request
+        chain = self._chains.get(name)
+        if chain is None:
+            chain = build()
+            self._chains[name] = chain
+        return chain
+
+    def _text_chain(self):
+        return self._chain("query_text", lambda: ChatPromptTemplate.from_messages(
+            [
+                (
+                    "system",
+                    "",
+                ),
+                ("human", "{input}"),
+            ]
+        ) | self._model | StrOutputParser())
+
+    def _grounded_chain(self):
+        return self._chain("query_grounded", lambda: self._grounded_prompt() | self._model | StrOutputParser())
+
+    def _grounded_stream_chain(self):
+        return self._chain("stream_grounded", lambda: self._grounded_prompt() | self._model)
+
+    def _grounded_prompt(self):
+        def build():
+            prompts = self._prompts.get_full_prompt(
+                task="query_grounded"
+            )
+            return ChatPromptTemplate.from_template(
+                prompts["system"] + self._prompt_separator + prompts["user"]
+            )
+
+        return self._chain("query_grounded_prompt", build)
+
+    def _grounded_input(self, text: str, documents: [Document]) -> dict:
+        context = self._context_packer.pack(documents)
+        self._logger.info(f"grounded context: {len(context.documents)} documents, {context.token_count} tokens")
+        TOKENS.inc(context.token_count + self._context_packer.estimate_tokens(text), direction="input",
+                   provider=self.provider_label, model=self._model_name)
+        return {"docs": context.text, "text": text}
+
+    def _record_output_tokens(self, response_text: str):
+        TOKENS.inc(self._context_packer.estimate_tokens(response_text), direction="output",
+                   provider=self.provider_label, model=self._model_name)
@@ -1,14 +1,18 @@
-from typing import Literal
+import asyncio
+from typing import AsyncIterator, Iterator, Literal, Union
 
 from langchain_core.documents import Document
 
+from aiasearch.models.answer_cache import AnswerCache
 from aiasearch.models.anthropic_provider import AnthropicProvider
+from aiasearch.models.batch import BatchResult, arun_batch, run_batch
 from aiasearch.models.ollama_provider import OllamaProvider
 from aiasearch.models.provider import Provider
+from aiasearch.models.stream_stats import StreamStats
 
 
 class ChatProvider:
-    def __init__(self, provider_name: str, model_name: str = "", provider = None):
+    def __init__(self, provider_name: str, model_name: str = "", provider = None, answer_cache: AnswerCache = None):
         """
         Use directly when passing in your own object that implements Provider.
         Otherwise, use ChatProvider.create_instance_by_name()
@@ -17,14 +21,18 @@ class ChatProvider:
             provider_name (str): The model's provider name.
             model_name (str): Name of the model.
             provider (Provider): A class that implements Provider
+            answer_cache (AnswerCache): Optional cache of grounded answers. Similar questions asked of the same
+                documents are answered from the cache.
         """
 
         self._provider_name = provider_name
         self._model_name = model_name
         self._provider = provider
+        self._answer_cache = answer_cache
 
     @classmethod
-    def create_instance_by_name(cls, provider_name: Literal["ollama", "anthropic"], model_name: str = ""):
+    def create_instance_by_name(cls, provider_name: Literal["ollama", "anthropic"], model_name: str = "",
+                                answer_cache: AnswerCache = None):
         """
                 Initializes the Llm object using the provided model name.
 
@@ -34,11 +42,12 @@ class ChatProvider:
                             - ollama
                             - anthropic
                     model_name (str): Name of the model.
+                    answer_cache (AnswerCache): Optional cache of grounded answers.
 
                 Raises:
                     ValueError: If the provided provider_name is not recognized.
                 """
-        return cls(provider_name, model_name, ChatProvider.get_provider(provider_name, model_name))
+        return cls(provider_name, model_name, ChatProvider.get_provider(provider_name, model_name), answer_cache)
 
     @property
     def provider_name(self) -> str:
@@ -78,5 +87,111 @@ class ChatProvider:
         """
         return self._provider.query_text(text)
 
+    async def aquery_text(self, text: str) -> str:
+        """
+        Async query_text.
+        :param text: Text to use in the user message of the AI prompt.
+        :return: Message from AI
+        """
+        return await self._provider.aquery_text(text)
+
     def query_grounded(self, text: str, documents: [Document]) -> str:
-        return self._provider.query_grounded(text, documents)
\ No newline at end of file
+        """
+        Answers a question using only the provided documents. When an answer cache is set, a cached answer to a
+        similar question about the same documents is returned instead of querying the AI provider.
+        :param text: The question.
+        :param documents: Documents to ground the answer on.
+        :return: Message from AI
+        """
+        return self._answer(self._provider.query_grounded, text, documents)
+
+    async def aquery_grounded(self, text: str, documents: [Document]) -> str:
+        """
+        Async query_grounded. Many questions can be answered concurrently from a single event loop.
+        :param text: The question.
+        :param documents: Documents to ground the answer on.
+        :return: Message from AI
+        """
+        return await self._aanswer(self._provider.aquery_grounded, text, documents)
+
+    def query_grounded_batch(self, items: list[Union[str, tuple[str, list[Document]]]], retriever=None, k=10,
+                             max_concurrency: int = None, max_retries=2) -> list[BatchResult]:
+        """
+        Answers many grounded questions concurrently. Questions given without documents are first retrieved for
+        together with retriever.search_documents_batch, so their queries are embedded in one batch. Answers go
+        through the answer cache like query_grounded.
+        :param items: Questions, either as text to retrieve documents for, or as (text, documents) pairs.
+        :param retriever: Store or HybridRetriever used for questions given without documents.
+        :param k: Number of documents retrieved per question.
+        :param max_concurrency: Maximum number of concurrent requests, never more than the provider's limit.
+        :param max_retries: Number of times a question failing with a retryable error, such as a rate limit, is
+        retried.
+        :return: A BatchResult for each item, in the order of the items.
+        """
+        items = self._batch_items(items, retriever, k)
+        return run_batch(lambda text, documents: self._answer(self._provider.query_grounded_no_retry, text, documents),
+                         items, self._provider.batch_concurrency(max_concurrency),
+                         self._provider.rate_limiter, max_retries, self._provider.retry_delay,
+                         self._provider.concurrency_limiter)
+
+    async def aquery_grounded_batch(self, items: list[Union[str, tuple[str, list[Document]]]], retriever=None,
+                                    k=10, max_concurrency: int = None, max_retries=2) -> list[BatchResult]:
+        """
+        Async query_grounded_batch. Retrieval runs in a worker thread, questions are answered concurrently on the
+        event loop.
+        """
+        items = await asyncio.to_thread(self._batch_items, items, retriever, k)
+        return await arun_batch(lambda text, documents: self._aanswer(self._provider.aquery_grounded_no_retry, text,
+                                                                      documents),
+                                items, self._provider.batch_concurrency(max_concurrency),
+                                self._provider.rate_limiter, max_retries, self._provider.retry_delay,
+                                self._provider.concurrency_limiter)
+
+    def _answer(self, query, text: str, documents: [Document]) -> str:
+        """
+        :param query: Provider method answering the question, used when the answer is not cached.
+        """
+        if self._answer_cache is None:
+            return query(text, documents)
+        return self._answer_cache.get_or_compute(self._cache_model_name(), self._provider.prompt_version(), text,
+                                                 documents, lambda: query(text, documents))
+
+    async def _aanswer(self, aquery, text: str, documents: [Document]) -> str:
+        if self._answer_cache is None:
+            return await aquery(text, documents)
+        return await self._answer_cache.aget_or_compute(self._cache_model_name(), self._provider.prompt_version(),
+                                                        text, documents, lambda: aquery(text, documents))
+
+    @staticmethod
+    def _batch_items(items, retriever, k) -> list[tuple[str, list[Document]]]:
+        texts = [item for item in items if isinstance(item, str)]
+        if len(texts) == 0:
+            return [tuple(item) for item in items]
+        if retriever is None:
+            raise ValueError("A retriever is required for questions given without documents")
+        retrieved = iter(retriever.search_documents_batch(texts, k))
+        return [(item, next(retrieved)) if isinstance(item, str) else tuple(item) for item in items]
+
+    def stream_grounded(self, text: str, documents: [Document], stats: StreamStats = None) -> Iterator[str]:
+        """
+        Answers a question using only the provided documents, yielding the answer as it is generated.
+        Streamed answers do not use the answer cache.
+        :param text: The question.
+        :param documents: Documents to ground the answer on.
+        :param stats: Receives the time to first token and the number of tokens.
+        :return: A generator of answer text chunks.
+        """
+        return self._provider.stream_grounded(text, documents, stats)
+
+    def astream_grounded(self, text: str, documents: [Document], stats: StreamStats = None) -> AsyncIterator[str]:
+        """
+        Async stream_grounded.
+        :param text: The question.
+        :param documents: Documents to ground the answer on.
+        :param stats: Receives the time to first token and the number of tokens.
+        :return: An async generator of answer text chunks.
+        """
+        return self._provider.astream_grounded(text, documents, stats)
+
+    def _cache_model_name(self) -> str:
+        return f"{self._provider_name}/{self._model_name}"
\ No newline at end of file
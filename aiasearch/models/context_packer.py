@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import math
+
+from langchain_core.documents import Document
+
+from aiasearch.data.document_id import get_document_id, normalized_text
+from aiasearch.log import PROJECT_NAME
+
+
+class PackedContext:
+    """
+    The documents selected for a prompt and the context text built from them.
+    """
+
+    def __init__(self, text: str, documents: [Document], token_count: int, truncated: bool):
+        self.text = text
+        self.documents = documents
+        self.token_count = token_count
+        self.truncated = truncated
+
+
+class ContextPacker:
+    """
+    Builds the {docs} context of a grounded prompt within a token budget. Documents are deduplicated and added in
+    order of relevance until the budget is used; the last document that does not fit is truncated. The
+    whitespace-normalized text the stores give documents when they are added is packed, see
+    document_id.with_normalized_text.
+    """
+
+    # approximate characters per token of each model family, matched by model name prefix
+    CHARS_PER_TOKEN = {
+        "claude": 3.5,
+        "llama": 3.8,
+    }
+    DEFAULT_CHARS_PER_TOKEN = 4.0
+
+    def __init__(self, model_name: str = "", max_tokens=3000, separator="\n\n", min_truncated_tokens=32):
+        """
+        :param model_name: Name of the model the context is for, used to estimate tokens.
+        :param max_tokens: Maximum estimated number of tokens of the context.
+        :param separator: Text placed between documents.
+        :param min_truncated_tokens: A document that does not fit is only truncated into the remaining budget if at
+        least this many tokens remain.
+        """
+        self._logger = logging.getLogger(PROJECT_NAME)
+        self._max_tokens = max_tokens
+        self._separator = separator
+        self._min_truncated_tokens = min_truncated_tokens
+        self._chars_per_token = self.DEFAULT_CHARS_PER_TOKEN
+        for prefix, chars_per_token in self.CHARS_PER_TOKEN.items():
+            if model_name.lower().startswith(prefix):
+                self._chars_per_token = chars_per_token
+                break
+
+    def estimate_tokens(self, text: str) -> int:
+        """
+        :return: The estimated number of tokens of the text.
+        """
+        return math.ceil(len(text) / self._chars_per_token)
+
+    def pack(self, documents: [Document]) -> PackedContext:
+        """
+        Selects and joins documents within the token budget. Documents with the ID or the text of a packed document
+        are skipped, as are chunks contained in a packed document of the same source row, such as a vector store
+        chunk of a document the keyword store returned whole.
+        :param documents: Documents ordered best first.
+        :return: The packed context
+        """
+        separator_tokens = self.estimate_tokens(self._separator)
+        packed = []
+        texts = []
+        seen = set()
+        # packed texts by the source key of their documents' IDs
+        source_texts = {}
+        token_count = 0
+        truncated = False
+        for document in documents:
+            text = normalized_text(document)
+            document_id = get_document_id(document)
+            content_key = hashlib.sha256(text.encode("utf-8")).digest()
+            source = document_id.rpartition(":")[0]
+            if document_id in seen or content_key in seen or \
+                    any(text in packed_text for packed_text in source_texts.get(source, [])):
+                continue
+            seen.add(document_id)
+            seen.add(content_key)
+            if source != "":
+                source_texts.setdefault(source, []).append(text)
+
+            tokens = self.estimate_tokens(text) + (separator_tokens if len(texts) > 0 else 0)
+            if token_count + tokens > self._max_tokens:
+                remaining = self._max_tokens - token_count - (separator_tokens if len(texts) > 0 else 0)
+                if remaining >= self._min_truncated_tokens:
+                    text = text[:int(remaining * self._chars_per_token)]
+                    texts.append(text)
+                    packed.append(document)
+                    token_count += self.estimate_tokens(text) + (separator_tokens if len(texts) > 1 else 0)
+                truncated = True
+                break
+            texts.append(text)
+            packed.append(document)
+            token_count += tokens
+
+        self._logger.debug(f"Packed {len(packed)} of {len(documents)} documents, {token_count} tokens")
+        return PackedContext(self._separator.join(texts), packed, token_count, truncated)
@@ -0,0 +1,32 @@
+import threading
+from typing import Callable, Dict
+
+from langchain_core.language_models import BaseChatModel
+
+# process wide registry of chat models. Each model holds its own HTTP client, so sharing the model between
+# providers also shares its pooled keep-alive connections.
+_models: Dict[tuple, BaseChatModel] = {}
+_lock = threading.Lock()
+
+
+def get_shared_model(key: tuple, factory: Callable[[], BaseChatModel]) -> BaseChatModel:
+    """
+    Returns the chat model registered under a key, creating it the first time it is requested.
+    :param key: Identifies the model configuration, such as (provider name, model name, host).
+    :param factory: Creates the model.
+    :return: The shared chat model.
+    """
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            model = factory()
+            _models[key] = model
+        return model
+
+
+def clear_shared_models():
+    """
+    Forgets all shared chat models. New providers create new models and HTTP clients.
+    """
+    with _lock:
+        _models.clear()
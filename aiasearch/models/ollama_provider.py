@@ -1,87 +1,47 @@
 import logging
 import os
 
-import langchain
-
-from aiasearch.models.provider import Provider
-from langchain_core.documents import Document
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.language_models import BaseChatModel
 
 from langchain_ollama import ChatOllama
 
 from ..log import PROJECT_NAME
-from ..prompts.prompts import PromptManager
+from .chat_model_provider import ChatModelProvider
+from .model_registry import get_shared_model
 
 
-class OllamaProvider(Provider):
+class OllamaProvider(ChatModelProvider):
     """
     Connection provider to models hosted locally with Ollama.
     The Ollama host is set using the "OLLAMA_HOST" environment variable.
     """
 
-    def __init__(self, model_name: str="llama3.1", prompt_path=None):
-        self._logger = logging.getLogger(PROJECT_NAME)
-        self._host = "127.0.0.1:11434"
-        self._model_name = model_name
-        self._prompt_path = prompt_path
-
-        try:
-            host: str = os.environ["OLLAMA_HOST"]
-            if host is not None:
-                self._host = host
-        except KeyError:
-            self._logger.info("key OLLAMA_HOST not found in environment variables")
+    provider_label = "ollama"
+    _prompt_separator = " \n "
 
-        self._model = ChatOllama(
-            model=model_name,
-            temperature=0,
-            base_url=self._host
-        )
-
-    def query_text(self, text) -> str:
+    def __init__(self, model_name: str="llama3.1", prompt_path=None, context_tokens=3000,
+                 max_concurrency=4, requests_per_second=None, chat_model: BaseChatModel = None):
         """
-        Sends a prompt and returns the text result.
-        :param text: Prompt message to send to Ollama.
-        :return: Text response from the LLM.
+        :param model_name: Name of the Ollama model.
+        :param prompt_path: Optional path of the prompts file.
+        :param context_tokens: Token budget of the documents given to grounded questions.
+        :param max_concurrency: Maximum number of concurrent batch requests, across all batches of the provider.
+        :param requests_per_second: Rate limit of batch requests. None does not limit the rate, a local Ollama server
+        is limited by max_concurrency alone.
+        :param chat_model: Chat model to answer with instead of the shared ChatOllama model, such as a fake model for
+        benchmarks.
         """
-        summarize_prompt = ChatPromptTemplate.from_messages(
-            [
-                (
-                    "system",
-                    "",
-                ),
-                ("human", "{input}"),
-            ]
-        )
-        summary_chain = summarize_prompt | self._model | StrOutputParser()
-
-        response_text = summary_chain.invoke(
-            {
-                "input": text,
-            }
-        )
-
-        self._logger.info("response text: " + response_text)
-        return response_text
-
-    def query_grounded(self, text: str, documents: [Document]) -> str:
-        langchain.verbose = True
-        langchain.debug = True
-        def format_docs(docs):
-            t = "\n\n".join(' '.join(document.page_content.split()) for document in docs)
-            return t
-
-        llama_prompts = PromptManager(model_name=self._model_name, prompt_path=self._prompt_path)
-        prompts = llama_prompts.get_full_prompt(
-            task="query_grounded"
-        )
-
-        prompt_final_document_summary = ChatPromptTemplate.from_template(
-            prompts["system"] + " \n " + prompts["user"]
-        )
-
-        chain = prompt_final_document_summary | self._model | StrOutputParser()
-        result_text = chain.invoke({"docs": format_docs(documents), "text": text} )
-        return result_text
-
+        host = "127.0.0.1:11434"
+        try:
+            host = os.environ["OLLAMA_HOST"]
+        except KeyError:
+            logging.getLogger(PROJECT_NAME).info("key OLLAMA_HOST not found in environment variables")
+        self._host = host
+
+        model = chat_model if chat_model is not None else get_shared_model(
+            ("ollama", model_name, host), lambda: ChatOllama(
+                model=model_name,
+                temperature=0,
+                base_url=host
+            ))
+        super().__init__(model, model_name, prompt_path, context_tokens, max_concurrency, requests_per_second)
@@ -1,11 +1,26 @@
+import asyncio
+import threading
 from abc import ABC, abstractmethod
+from typing import AsyncIterator, Iterator, Optional
 
 from langchain_core.documents import Document
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from aiasearch.models.batch import BatchResult, ConcurrencyLimiter, arun_batch, run_batch
+from aiasearch.models.stream_stats import StreamStats
+
+_limiter_lock = threading.Lock()
 
 
 class Provider(ABC):
     """Interface for model providers such as Ollama and Anthropic."""
 
+    # maximum number of concurrent batch requests to the provider, the optional token bucket every request must pass,
+    # and the seconds before the first retry of a failed request
+    max_concurrency: int = 4
+    rate_limiter: Optional[BaseRateLimiter] = None
+    retry_delay: float = 1.0
+
     @abstractmethod
     def query_text(self, text: str) -> str:
         """Generic LLM prompt. Sends a prompt to the provider and returns the response text."""
@@ -14,4 +29,76 @@ class Provider(ABC):
     @abstractmethod
     def query_grounded(self, text: str, documents: [Document]) -> str:
         """Sends a prompt to the provider with grounding data and returns the response text."""
-        pass
\ No newline at end of file
+        pass
+
+    async def aquery_text(self, text: str) -> str:
+        """Async query_text. Providers with a native async client should override this; by default the
+        synchronous method runs in a worker thread."""
+        return await asyncio.to_thread(self.query_text, text)
+
+    async def aquery_grounded(self, text: str, documents: [Document]) -> str:
+        """Async query_grounded. By default the synchronous method runs in a worker thread."""
+        return await asyncio.to_thread(self.query_grounded, text, documents)
+
+    def query_grounded_batch(self, items: list[tuple[str, list[Document]]], max_concurrency: int = None,
+                             max_retries=2) -> list[BatchResult]:
+        """Answers many grounded questions concurrently, limited by max_concurrency and the provider's own limit
+        and rate limiter. Questions failing with a retryable error, see batch.is_retryable, are retried. Results are
+        returned in the order of the items; a question that still fails has its error set instead of an answer."""
+        return run_batch(self.query_grounded_no_retry, items, self.batch_concurrency(max_concurrency),
+                         self.rate_limiter, max_retries, self.retry_delay, self.concurrency_limiter)
+
+    async def aquery_grounded_batch(self, items: list[tuple[str, list[Document]]], max_concurrency: int = None,
+                                    max_retries=2) -> list[BatchResult]:
+        """Async query_grounded_batch."""
+        return await arun_batch(self.aquery_grounded_no_retry, items, self.batch_concurrency(max_concurrency),
+                                self.rate_limiter, max_retries, self.retry_delay, self.concurrency_limiter)
+
+    def query_grounded_no_retry(self, text: str, documents: [Document]) -> str:
+        """query_grounded without the client's own retries, used by batches, which retry failed questions
+        themselves. Providers whose client retries override this."""
+        return self.query_grounded(text, documents)
+
+    async def aquery_grounded_no_retry(self, text: str, documents: [Document]) -> str:
+        """Async query_grounded_no_retry."""
+        return await self.aquery_grounded(text, documents)
+
+    def batch_concurrency(self, max_concurrency: int = None) -> int:
+        """The number of concurrent requests of a batch, never more than the provider's limit."""
+        return self.max_concurrency if max_concurrency is None else min(max_concurrency, self.max_concurrency)
+
+    @property
+    def concurrency_limiter(self) -> ConcurrencyLimiter:
+        """Limits the batch requests in flight to max_concurrency across all batches sent to this provider at the
+        same time."""
+        with _limiter_lock:
+            limiter = self.__dict__.get("_concurrency_limiter")
+            if limiter is None:
+                limiter = self._concurrency_limiter = ConcurrencyLimiter(self.max_concurrency)
+            return limiter
+
+    def stream_grounded(self, text: str, documents: [Document], stats: StreamStats = None) -> Iterator[str]:
+        """Yields the grounded response text as it is generated. By default the full response of query_grounded is
+        yielded at once."""
+        stats = stats if stats is not None else StreamStats()
+        stats.start()
+        response_text = self.query_grounded(text, documents)
+        stats.finish()
+        stats.first_token = stats.finished
+        stats.chunks = 1
+        yield response_text
+
+    async def astream_grounded(self, text: str, documents: [Document],
+                               stats: StreamStats = None) -> AsyncIterator[str]:
+        """Async stream_grounded. By default the full response of aquery_grounded is yielded at once."""
+        stats = stats if stats is not None else StreamStats()
+        stats.start()
+        response_text = await self.aquery_grounded(text, documents)
+        stats.finish()
+        stats.first_token = stats.finished
+        stats.chunks = 1
+        yield response_text
+
+    def prompt_version(self, task: str = "query_grounded") -> str:
+        """Identifies the prompt used for a task so cached answers are not reused after the prompt changes."""
+        return ""
\ No newline at end of file
@@ -0,0 +1,80 @@
+import time
+from typing import Optional
+
+from langchain_core.messages import BaseMessageChunk
+
+
+class StreamStats:
+    """
+    Timing and token counts of a streamed response. Pass an instance to stream_grounded to read them once the
+    stream has been consumed.
+    """
+
+    def __init__(self):
+        self.started: Optional[float] = None
+        self.first_token: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.chunks = 0
+        self.output_tokens: Optional[int] = None
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        """
+        :return: Seconds from the request to the first token, None if no token was received.
+        """
+        if self.started is None or self.first_token is None:
+            return None
+        return self.first_token - self.started
+
+    @property
+    def total_time(self) -> Optional[float]:
+        """
+        :return: Seconds from the request to the end of the stream.
+        """
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    @property
+    def total_tokens(self) -> int:
+        """
+        :return: Output tokens reported by the provider, or the number of streamed chunks if it reports none.
+        """
+        return self.output_tokens if self.output_tokens is not None else self.chunks
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def record(self, chunk: BaseMessageChunk) -> str:
+        """
+        Records a streamed message chunk.
+        :return: The text of the chunk.
+        """
+        text = message_chunk_text(chunk)
+        if text:
+            if self.first_token is None:
+                self.first_token = time.perf_counter()
+            self.chunks += 1
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage and usage.get("output_tokens"):
+            # providers report the output tokens generated so far, the last report counts the whole response
+            self.output_tokens = usage["output_tokens"]
+        return text
+
+    def __repr__(self):
+        return f"StreamStats(time_to_first_token={self.time_to_first_token}, total_time={self.total_time}, " \
+               f"total_tokens={self.total_tokens})"
+
+
+def message_chunk_text(chunk: BaseMessageChunk) -> str:
+    """
+    :return: The text of a message chunk whose content is either a string or a list of content blocks.
+    """
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(block if isinstance(block, str) else block.get("text", "")
+                   for block in content if isinstance(block, str) or block.get("type") == "text")
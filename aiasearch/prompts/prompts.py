@@ -1,12 +1,17 @@
 from pathlib import Path
 from typing import Dict, Optional, Any
+import hashlib
 import logging
-from functools import lru_cache
+import threading
 
 import yaml
 
 from aiasearch.log import PROJECT_NAME
 
+# process wide registry of loaded prompts, keyed by (model name, prompt directory)
+_registry: Dict[tuple, "PromptManager"] = {}
+_registry_lock = threading.Lock()
+
 
 class PromptManager:
     def __init__(self, model_name: str, prompt_path: str = None):
@@ -17,8 +22,34 @@ class PromptManager:
         else:
             self.prompt_dir = Path(prompt_path)
         self.prompts = self._load_prompts()
+        self._versions: Dict[str, str] = {}
+
+    @classmethod
+    def get(cls, model_name: str, prompt_path: str = None) -> "PromptManager":
+        """
+        Get the shared PromptManager of a model. The prompt file is read once per process.
+
+        Args:
+            model_name: Name of the model
+            prompt_path: Optional directory of the prompt files
+
+        Returns:
+            The PromptManager registered for the model and directory
+        """
+        key = (model_name.lower(), str(Path(prompt_path).resolve()) if prompt_path is not None else None)
+        with _registry_lock:
+            manager = _registry.get(key)
+            if manager is None:
+                manager = cls(model_name, prompt_path)
+                _registry[key] = manager
+            return manager
+
+    @staticmethod
+    def clear_registry():
+        """Forget all shared PromptManagers so prompt files are read again."""
+        with _registry_lock:
+            _registry.clear()
 
-    @lru_cache(maxsize=None)
     def _load_prompts(self) -> Dict[str, Any]:
         """Load prompts for specified model with caching."""
         try:
@@ -76,3 +107,21 @@ class PromptManager:
             "system": self.get_prompt(task, "system"),
             "user": self.get_prompt(task, "user")
         }
+
+    def get_prompt_version(self, task: str) -> str:
+        """
+        Get a version identifier for a task's prompts. It changes whenever the prompt text changes.
+
+        Args:
+            task: The prompt task (e.g., 'query_grounded')
+
+        Returns:
+            A short hash of the system and user prompts
+        """
+        version = self._versions.get(task)
+        if version is None:
+            prompts = self.get_full_prompt(task)
+            text = f"{prompts['system']}\n{prompts['user']}"
+            version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+            self._versions[task] = version
+        return version
@@ -0,0 +1,377 @@
+"""
+Serves searches and grounded questions over local HTTP. The stores and the model provider are opened once when the
+server starts, so requests only pay for the search and the answer.
+
+    POST /search  {"query": "work on Newbury ST", "k": 10, "filter": {"worktype": "INTEXT"}}
+                  -> {"documents": [{"id": ..., "page_content": ..., "metadata": {...}}, ...]}
+    POST /query   {"query": "List work performed on Newbury ST", "k": 10}
+                  -> {"answer": ..., "documents": [...]}
+    GET  /health  -> {"status": "ok", "in_flight": ...}
+    GET  /metrics -> the metrics in the Prometheus text format
+
+Queries of concurrent requests are embedded together by MicroBatchingEmbeddings. A request that cannot be admitted
+within queue_timeout seconds is answered 503 and a request that runs longer than its timeout is answered 504.
+
+python -m aiasearch.server --keyword-index-dir ./tmp_keywords --vector-store-dir ./tmp \
+    --document-store-dir ./tmp_documents --provider anthropic
+"""
+import argparse
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.documents import Document
+
+from aiasearch.data.bm25_keyword_store import Bm25KeywordStore
+from aiasearch.data.cached_store import CachedKeywordStore, CachedVectorStore
+from aiasearch.data.chroma_vector_store import ChromaVectorStore
+from aiasearch.data.document_id import NORMALIZED_TEXT_KEY
+from aiasearch.data.document_store import DocumentStore
+from aiasearch.data.embedding_backend import HashingEmbeddingBackend, OllamaEmbeddingBackend
+from aiasearch.data.embedding_batcher import MicroBatchingEmbeddings
+from aiasearch.data.embedding_cache import CachedEmbeddings
+from aiasearch.data.flat_vector_store import FlatVectorStore
+from aiasearch.data.hybrid_retriever import HybridRetriever
+from aiasearch.log import PROJECT_NAME, log_initialize
+from aiasearch.metrics import REGISTRY, SERVER_REQUESTS, span
+from aiasearch.models.provider import Provider
+
+_logger = logging.getLogger(PROJECT_NAME)
+
+
+class OverloadedError(RuntimeError):
+    """
+    Raised when a request is not admitted because the server is answering as many requests as it allows.
+    """
+    pass
+
+
+class QueryService:
+    """
+    Answers searches and grounded questions with stores that stay open. At most max_concurrent requests run at a
+    time and a request waits at most queue_timeout seconds for its turn, so under load the server keeps a steady
+    throughput and rejects the excess rather than queueing it without bound. A request that runs past its timeout
+    raises TimeoutError but keeps its place until the search or answer finishes, as it cannot be interrupted.
+    """
+
+    def __init__(self, retriever, provider: Provider = None, max_concurrent=8, queue_timeout=0.5,
+                 search_timeout=10.0, query_timeout=120.0, max_k=100):
+        """
+        :param retriever: HybridRetriever, vector store or keyword store searched by requests.
+        :param provider: Provider answering grounded questions. None disables /query.
+        :param max_concurrent: Maximum number of requests searching or answering at the same time.
+        :param queue_timeout: Seconds a request waits to be admitted before it is rejected.
+        :param search_timeout: Seconds a search may take.
+        :param query_timeout: Seconds a grounded question may take, including its search.
+        :param max_k: Maximum number of results a request may ask for.
+        """
+        self._retriever = retriever
+        self._provider = provider
+        self._queue_timeout = queue_timeout
+        self._search_timeout = search_timeout
+        self._query_timeout = query_timeout
+        self.max_k = max_k
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="query-service")
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def can_answer(self) -> bool:
+        return self._provider is not None
+
+    def search(self, text: str, k=10, filter: dict = None) -> list[Document]:
+        """
+        :return: The documents found for the text, best first.
+        """
+        return self._run(self._search, self._search_timeout, text, k, filter)
+
+    def query(self, text: str, k=10, filter: dict = None) -> tuple[str, list[Document]]:
+        """
+        Answers a question grounded in the documents found for it.
+        :return: The answer and the documents it is grounded in.
+        """
+        if self._provider is None:
+            raise ValueError("No model provider is configured")
+        return self._run(self._query, self._query_timeout, text, k, filter)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _search(self, text: str, k: int, filter: dict) -> list[Document]:
+        with span("server_search"):
+            return self._retriever.search_documents(text, k, filter=filter)
+
+    def _query(self, text: str, k: int, filter: dict) -> tuple[str, list[Document]]:
+        documents = self._search(text, k, filter)
+        with span("server_answer"):
+            return self._provider.query_grounded(text, documents), documents
+
+    def _run(self, function, timeout: float, *args):
+        """
+        Runs a request on the worker pool once it is admitted.
+        :raises OverloadedError: If the request was not admitted within queue_timeout.
+        :raises TimeoutError: If the request did not finish within timeout.
+        """
+        if not self._slots.acquire(timeout=self._queue_timeout):
+            raise OverloadedError("Too many requests in flight")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future.result(timeout=timeout)
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    HTTP server answering each connection in its own thread with a QueryService.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, service: QueryService):
+        """
+        :param address: (host, port) to listen on. Port 0 picks a free port.
+        :param service: Service answering the requests.
+        """
+        super().__init__(address, _Handler)
+        self.service = service
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "aiasearch"
+    protocol_version = "HTTP/1.1"
+    _MAX_BODY_BYTES = 1 << 20
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._respond("health", HTTPStatus.OK, {"status": "ok", "in_flight": self.server.service.in_flight})
+        elif self.path == "/metrics":
+            self._respond("metrics", HTTPStatus.OK, REGISTRY.to_prometheus(), content_type="text/plain; version=0.0.4")
+        else:
+            self._respond("unknown", HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        endpoint = self.path.strip("/")
+        if endpoint not in ("search", "query"):
+            self._discard_body()
+            self._respond("unknown", HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+            return
+        service = self.server.service
+        try:
+            text, k, filter = self._read_request()
+            if endpoint == "search":
+                body = {"documents": [_document_json(document) for document in service.search(text, k, filter)]}
+            elif not service.can_answer:
+                self._respond(endpoint, HTTPStatus.NOT_IMPLEMENTED, {"error": "No model provider is configured"})
+                return
+            else:
+                answer, documents = service.query(text, k, filter)
+                body = {"answer": answer, "documents": [_document_json(document) for document in documents]}
+        except OverloadedError as e:
+            self._respond(endpoint, HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)}, headers={"Retry-After": "1"})
+        except TimeoutError:
+            self._respond(endpoint, HTTPStatus.GATEWAY_TIMEOUT, {"error": "The request timed out"})
+        except _BadRequest as e:
+            self._respond(endpoint, e.status, {"error": str(e)})
+        except ValueError as e:
+            # invalid filters are reported by the stores as ValueError
+            self._respond(endpoint, HTTPStatus.BAD_REQUEST, {"error": str(e)})
+        except Exception as e:
+            _logger.exception(f"Request to /{endpoint} failed")
+            self._respond(endpoint, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"})
+        else:
+            self._respond(endpoint, HTTPStatus.OK, body)
+
+    def _read_request(self) -> tuple:
+        """
+        :return: The query text, k and filter of a JSON request body.
+        """
+        length = self._content_length()
+        if length > self._MAX_BODY_BYTES:
+            # the body is not read, so the connection cannot be used for another request
+            self.close_connection = True
+            raise _BadRequest(f"Request body over {self._MAX_BODY_BYTES} bytes", HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            raise _BadRequest(f"Invalid JSON: {e}")
+        if not isinstance(request, dict):
+            raise _BadRequest("The request must be a JSON object")
+        text = request.get("query")
+        if not isinstance(text, str) or text.strip() == "":
+            raise _BadRequest("query must be a non-empty string")
+        k = request.get("k", 10)
+        max_k = self.server.service.max_k
+        if type(k) is not int or not 1 <= k <= max_k:
+            raise _BadRequest(f"k must be an integer from 1 to {max_k}")
+        filter = request.get("filter")
+        if filter is not None and not isinstance(filter, dict):
+            raise _BadRequest("filter must be a JSON object")
+        return text, k, filter
+
+    def _content_length(self) -> int:
+        """
+        :return: The length of the request body. An invalid Content-Length closes the connection, as the end of the
+        body is unknown.
+        """
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            raise _BadRequest("Invalid Content-Length")
+        return length
+
+    def _discard_body(self):
+        """
+        Reads and drops the body of a request that is answered without it, so the next request on a keep-alive
+        connection starts at the right place. Bodies over the size limit close the connection instead.
+        """
+        try:
+            length = self._content_length()
+        except _BadRequest:
+            return
+        if length > self._MAX_BODY_BYTES:
+            self.close_connection = True
+        else:
+            self.rfile.read(length)
+
+    def _respond(self, endpoint: str, status: HTTPStatus, body, content_type="application/json", headers=None):
+        data = (json.dumps(body) if content_type == "application/json" else body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        SERVER_REQUESTS.inc(endpoint=endpoint, status=int(status))
+
+    def log_message(self, format, *args):
+        _logger.debug(f"{self.address_string()} {format % args}")
+
+
+class _BadRequest(Exception):
+    def __init__(self, message: str, status=HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+def _document_json(document: Document) -> dict:
+    # the normalized text repeats page_content and is only used to build prompts
+    metadata = {key: value for key, value in document.metadata.items() if key != NORMALIZED_TEXT_KEY}
+    return {"id": document.id, "page_content": document.page_content, "metadata": metadata}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve aiasearch searches and grounded questions over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on.")
+    parser.add_argument("--keyword-index-dir", help="Directory of the keyword index.")
+    parser.add_argument("--vector-store-dir", help="Directory of the vector store.")
+    parser.add_argument("--vector-store", choices=["chroma", "flat"], default="chroma", help="Vector store type.")
+    parser.add_argument("--document-store-dir", help="Directory of the document store the stores were built with.")
+    parser.add_argument("--embedding-backend", choices=["ollama", "hashing"], default="ollama",
+                        help="Embedding backend the vector store was built with.")
+    parser.add_argument("--embedding-cache-dir", help="Directory of the embedding cache.")
+    parser.add_argument("--dedupe-key",
+                        help="Metadata key identifying a document in both stores, such as permitnumber.")
+    parser.add_argument("--provider", choices=["ollama", "anthropic", "none"], default="ollama",
+                        help="Model provider answering /query. none disables /query.")
+    parser.add_argument("--model", help="Model name of the provider.")
+    parser.add_argument("--max-concurrent", type=int, default=8, help="Requests answered at the same time.")
+    parser.add_argument("--queue-timeout", type=float, default=0.5,
+                        help="Seconds a request waits to be admitted before it is answered 503.")
+    parser.add_argument("--search-timeout", type=float, default=10.0, help="Seconds a search may take.")
+    parser.add_argument("--query-timeout", type=float, default=120.0, help="Seconds a grounded question may take.")
+    parser.add_argument("--batch-wait-ms", type=float, default=2.0,
+                        help="Milliseconds a query waits for other queries to be embedded with it.")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="Queries embedded in one call.")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Search results cached per store. 0 disables.")
+    args = parser.parse_args(argv)
+    if not args.keyword_index_dir and not args.vector_store_dir:
+        parser.error("at least one of --keyword-index-dir and --vector-store-dir is required")
+
+    log_initialize()
+    document_store = None
+    if args.document_store_dir:
+        document_store = DocumentStore(store_dir=args.document_store_dir, read_only=True)
+    batcher = None
+    embeddings = None
+    vector_store = None
+    if args.vector_store_dir:
+        backend = HashingEmbeddingBackend() if args.embedding_backend == "hashing" else OllamaEmbeddingBackend()
+        batcher = MicroBatchingEmbeddings(backend, max_batch_size=args.max_batch_size,
+                                          max_wait=args.batch_wait_ms / 1000)
+        embeddings = batcher
+        if args.embedding_cache_dir:
+            # the cache wraps the batcher so queries are cached as queries and only cache misses are batched
+            embeddings = CachedEmbeddings(batcher, args.embedding_cache_dir)
+        if args.vector_store == "flat":
+            vector_store = FlatVectorStore(store_dir=args.vector_store_dir, read_only=True, embeddings=embeddings,
+                                           document_store=document_store)
+        else:
+            vector_store = ChromaVectorStore(vectorstore_dir=args.vector_store_dir, embeddings=embeddings,
+                                             document_store=document_store)
+        if args.cache_size > 0:
+            vector_store = CachedVectorStore(vector_store, max_size=args.cache_size)
+    keyword_store = None
+    if args.keyword_index_dir:
+        keyword_store = Bm25KeywordStore(index_dir=args.keyword_index_dir, document_store=document_store)
+        if args.cache_size > 0:
+            keyword_store = CachedKeywordStore(keyword_store, max_size=args.cache_size)
+    if vector_store is not None and keyword_store is not None:
+        retriever = HybridRetriever(vector_store, keyword_store, dedupe_key=args.dedupe_key,
+                                    max_workers=2 * args.max_concurrent)
+    else:
+        retriever = vector_store if vector_store is not None else keyword_store
+
+    provider = None
+    if args.provider == "ollama":
+        from aiasearch.models.ollama_provider import OllamaProvider
+        provider = OllamaProvider(**({"model_name": args.model} if args.model else {}))
+    elif args.provider == "anthropic":
+        from aiasearch.models.anthropic_provider import AnthropicProvider
+        provider = AnthropicProvider(**({"model_name": args.model} if args.model else {}))
+
+    service = QueryService(retriever, provider, max_concurrent=args.max_concurrent, queue_timeout=args.queue_timeout,
+                           search_timeout=args.search_timeout, query_timeout=args.query_timeout)
+    server = QueryServer((args.host, args.port), service)
+    _logger.info(f"Serving on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if isinstance(retriever, HybridRetriever):
+            retriever.close()
+        if isinstance(embeddings, CachedEmbeddings):
+            embeddings.flush()
+        if batcher is not None:
+            batcher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -21,3 +21,7 @@ def load_stop_words():
     except FileNotFoundError:
         print(f"File {filename} not found.")
         return []
+
+
+STOP_WORDS = frozenset(load_stop_words())
+"""Stop words loaded once for fast membership tests."""
@@ -0,0 +1,20 @@
+from aiasearch.analyzer import Analyzer, s_stem
+from aiasearch.stopwords import STOP_WORDS
+
+
+def test_analyze():
+    analyzer = Analyzer()
+    assert analyzer.analyze("List work performed on Newbury ST, Boston") == ["list", "work", "performed", "newbury",
+                                                                             "st", "boston"]
+    assert analyzer.analyze("The AND of") == []
+
+
+def test_stem():
+    analyzer = Analyzer(stem=True)
+    assert analyzer.analyze("Permits for new Kitchens and Stories") == ["permit", "new", "kitchen", "story"]
+    assert s_stem("glass") == "glass"
+
+
+def test_remove_stop_words():
+    assert Analyzer().remove_stop_words("List work performed on Newbury ST") == "List work performed Newbury ST"
+    assert "and" in STOP_WORDS
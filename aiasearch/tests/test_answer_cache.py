@@ -0,0 +1,54 @@
+import asyncio
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from aiasearch.models.answer_cache import AnswerCache
+from aiasearch.models.chat_provider import ChatProvider
+from aiasearch.models.provider import Provider
+
+
+class CountingProvider(Provider):
+    def __init__(self):
+        self.calls = 0
+
+    def query_text(self, text):
+        return text
+
+    def query_grounded(self, text, documents):
+        self.calls += 1
+        return f"answer {self.calls}"
+
+
+def test_answer_cache(tmp_path):
+    documents = [Document(id="A1", page_content="Renovate kitchen"), Document(id="A2", page_content="Roof deck")]
+    provider = CountingProvider()
+    cache = AnswerCache(DeterministicFakeEmbedding(size=32), tmp_path / "answers.db")
+    chat_provider = ChatProvider("fake", "fake-model", provider, answer_cache=cache)
+
+    assert chat_provider.query_grounded("What work was done?", documents) == "answer 1"
+    assert chat_provider.query_grounded("What work was done?", list(reversed(documents))) == "answer 1"
+    assert provider.calls == 1
+    assert chat_provider.query_grounded("What work was done?", documents[:1]) == "answer 2"
+    assert chat_provider.query_grounded("Who applied?", documents) == "answer 3"
+
+    reopened = AnswerCache(DeterministicFakeEmbedding(size=32), tmp_path / "answers.db", max_entries=2)
+    assert len(reopened) == 3
+    other_model = ChatProvider("fake", "other-model", provider, answer_cache=reopened)
+    assert other_model.query_grounded("What work was done?", documents) == "answer 4"
+    assert len(reopened) == 2
+
+
+def test_async_answer_cache():
+    documents = [Document(id="A1", page_content="Renovate kitchen")]
+    provider = CountingProvider()
+    cache = AnswerCache(DeterministicFakeEmbedding(size=32), ":memory:")
+    chat_provider = ChatProvider("fake", "fake-model", provider, answer_cache=cache)
+
+    async def ask():
+        first = await chat_provider.aquery_grounded("What work was done?", documents)
+        second = await chat_provider.aquery_grounded("What work was done?", documents)
+        return first, second
+
+    assert asyncio.run(ask()) == ("answer 1", "answer 1")
+    assert provider.calls == 1
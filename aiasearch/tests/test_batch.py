@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+
+import httpx
+from langchain_core.documents import Document
+
+from aiasearch.data.vector_store import VectorStore
+from aiasearch.models.anthropic_provider import AnthropicProvider
+from aiasearch.models.batch import is_retryable, retry_after
+from aiasearch.models.chat_provider import ChatProvider
+from aiasearch.models.provider import Provider
+
+
+class EchoProvider(Provider):
+    max_concurrency = 3
+    retry_delay = 0.0
+
+    def __init__(self):
+        self.attempts = {}
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def query_text(self, text):
+        return text
+
+    def query_grounded(self, text, documents):
+        with self._lock:
+            self.attempts[text] = self.attempts.get(text, 0) + 1
+            attempt = self.attempts[text]
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.02)
+        with self._lock:
+            self.running -= 1
+        if text == "always fails" or (text == "fails once" and attempt == 1):
+            raise ConnectionError(f"{text} {attempt}")
+        if text == "invalid":
+            raise ValueError(f"{text} {attempt}")
+        return f"{text}: {len(documents)}"
+
+
+class BatchVectorStore(VectorStore):
+    def __init__(self):
+        self.batches = []
+
+    def add_documents(self, documents):
+        pass
+
+    def search_documents(self, text, k=10):
+        return self.search_documents_batch([text], k)[0]
+
+    def search_documents_batch(self, texts, k=10):
+        self.batches.append(list(texts))
+        return [[Document(id=f"{text} {number}", page_content=text) for number in range(k)] for text in texts]
+
+    def get_document_count(self):
+        return 0
+
+
+def test_query_grounded_batch():
+    provider = EchoProvider()
+    store = BatchVectorStore()
+    chat_provider = ChatProvider("echo", "echo", provider)
+    items = ["question 1", ("question 2", [Document(page_content="document")]), "fails once", "always fails",
+             "invalid", "question 6"]
+    results = chat_provider.query_grounded_batch(items, retriever=store, k=2, max_concurrency=10, max_retries=1)
+
+    assert store.batches == [["question 1", "fails once", "always fails", "invalid", "question 6"]]
+    assert [result.text for result in results] == [item if isinstance(item, str) else item[0] for item in items]
+    assert [result.answer for result in results] == ["question 1: 2", "question 2: 1", "fails once: 2", None,
+                                                     None, "question 6: 2"]
+    assert not results[3].ok
+    assert str(results[3].error) == "always fails 2"
+    assert provider.attempts["always fails"] == 2
+    # errors a retry cannot fix are not retried
+    assert provider.attempts["invalid"] == 1
+    assert provider.peak <= 3
+
+
+def test_aquery_grounded_batch():
+    provider = EchoProvider()
+    items = [(f"question {number}", []) for number in range(10)] + [("always fails", [])]
+    results = asyncio.run(provider.aquery_grounded_batch(items, max_concurrency=2, max_retries=0))
+
+    assert [result.answer for result in results] == [f"question {number}: 0" for number in range(10)] + [None]
+    assert provider.attempts["always fails"] == 1
+    assert provider.peak <= 2
+
+
+def test_provider_concurrency_limit():
+    provider = EchoProvider()
+    items = [(f"question {number}", []) for number in range(6)]
+    threads = [threading.Thread(target=provider.query_grounded_batch, args=(items,)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # batches sent at the same time share the provider's limit
+    assert provider.peak <= 3
+
+
+def test_retryable_errors():
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+
+    def status_error(status: int, headers=None) -> httpx.HTTPStatusError:
+        response = httpx.Response(status, headers=headers, request=request)
+        return httpx.HTTPStatusError("error", request=request, response=response)
+
+    assert is_retryable(status_error(429, {"retry-after": "7"}))
+    assert retry_after(status_error(429, {"retry-after": "7"})) == 7.0
+    assert retry_after(status_error(429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after(status_error(503)) is None
+    assert is_retryable(status_error(529))
+    assert not is_retryable(status_error(401))
+    assert not is_retryable(status_error(400))
+    try:
+        raise RuntimeError("connection failed") from httpx.ConnectError("refused")
+    except RuntimeError as e:
+        assert is_retryable(e)
+    assert not is_retryable(ValueError("invalid"))
+
+
+def test_anthropic_retries(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    provider = AnthropicProvider()
+    # single calls keep the client's retries, batches are retried by run_batch alone
+    assert provider._model.max_retries == 2
+    assert provider._batch_model.max_retries == 0
@@ -0,0 +1,38 @@
+from aiasearch.benchmarks.run import COMBINE_COLUMNS, LABEL_COLUMNS, METADATA_COLUMNS, run_benchmarks, summarize
+from aiasearch.benchmarks.synthetic_data import COLUMNS, generate_permits, write_permits_csv
+from aiasearch.data.csv_loader import CsvLoader
+
+
+def test_write_permits_csv(tmp_path):
+    csv_path = tmp_path / "permits.csv"
+    write_permits_csv(csv_path, 250, seed=1, chunk_rows=100)
+    documents = CsvLoader().load(file_path=str(csv_path), label_columns=LABEL_COLUMNS,
+                                 combine_columns=COMBINE_COLUMNS, metadata_columns=METADATA_COLUMNS)
+
+    assert len(documents) == 250
+    assert len({document.metadata["permitnumber"] for document in documents}) == 250
+    assert documents[0].page_content.startswith("Permit Number: A100000\nValuation: $")
+    assert list(generate_permits(5, seed=1).columns) == COLUMNS
+    assert generate_permits(5, seed=1).equals(generate_permits(5, seed=1))
+
+
+def test_summarize():
+    summary = summarize([0.001 * number for number in range(1, 101)], 200)
+
+    assert summary["operations"] == 100
+    assert summary["throughput_per_second"] == round(200 / 5.05, 3)
+    assert summary["p50_ms"] == 50.5
+    assert summary["p99_ms"] == 99.01
+
+
+def test_run_benchmarks(tmp_path):
+    report = run_benchmarks(200, tmp_path / "run", queries=5, vector_rows=100, add_batch_size=50, load_repeats=1,
+                            embedding_size=16)
+
+    assert report["vector_rows"] == 100
+    assert set(report["results"]) == {"csv_load", "vector_add_documents", "flat_vector_add_documents",
+                                      "keyword_add_documents", "vector_search", "flat_vector_search",
+                                      "keyword_search", "hybrid_search", "grounded_qa"}
+    assert report["results"]["flat_vector_add_documents"]["items"] == 200
+    assert report["results"]["vector_add_documents"]["operations"] == 2
+    assert report["results"]["grounded_qa"]["items"] == 5
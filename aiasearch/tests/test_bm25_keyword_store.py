@@ -0,0 +1,143 @@
+import pathlib
+import threading
+import time
+
+from langchain_core.documents import Document
+
+from aiasearch.data.bm25_keyword_store import Bm25Index, Bm25KeywordStore
+from aiasearch.data.csv_loader import CsvLoader
+
+
+def test_search_documents():
+    documents = [Document(page_content="Renovate kitchen on Newbury ST"),
+                 Document(page_content="Install new wheelchair lift on State ST"),
+                 Document(page_content="Kitchen kitchen remodel, Boylston ST"),
+                 Document(page_content="Change connector link layout")]
+    store = Bm25KeywordStore()
+    store.add_documents(documents)
+    assert store.get_document_count() == 4
+
+    results = store.search_documents("kitchen", k=10)
+    assert [document.page_content for document in results] == [documents[2].page_content,
+                                                               documents[0].page_content]
+    assert [document.page_content for document in store.search_documents("Newbury kitchen", k=1)] == \
+           [documents[0].page_content]
+    assert store.search_documents("alfresco", k=10) == []
+
+
+def test_search_csv_documents():
+    current_dir = pathlib.Path(__file__).resolve().parent.parent
+    documents = CsvLoader().load(file_path=current_dir / "data.csv",
+                                 combine_columns=["permitnumber", "description", "comments", "address", "city"],
+                                 metadata_columns=["permitnumber"],
+                                 max_rows=1000)
+    store = Bm25KeywordStore()
+    store.add_documents(documents)
+    results = store.search_documents("A100071", k=10)
+    assert results[0].metadata["permitnumber"] == "A100071"
+
+
+def test_save_and_open(tmp_path):
+    documents = [Document(page_content="Renovate kitchen on Newbury ST", metadata={"permitnumber": "A1"}),
+                 Document(page_content="Install new wheelchair lift on State ST", metadata={"permitnumber": "A2"})]
+    store = Bm25KeywordStore(index_dir=tmp_path)
+    store.add_documents(documents)
+
+    opened = Bm25KeywordStore(index_dir=tmp_path)
+    assert opened.get_document_count() == 2
+    results = opened.search_documents("wheelchair", k=10)
+    assert len(results) == 1
+    assert results[0].page_content == documents[1].page_content
+    assert results[0].metadata == {"permitnumber": "A2"}
+
+
+def test_add_and_delete_documents(tmp_path):
+    store = Bm25KeywordStore(index_dir=tmp_path, id_key="permitnumber", max_segments=2,
+                             background_compaction=False)
+    store.add_documents([Document(page_content="Renovate kitchen on Newbury ST", metadata={"permitnumber": "A1"})])
+    store.add_documents([Document(page_content="Kitchen remodel on State ST", metadata={"permitnumber": "A2"}),
+                         Document(page_content="Roof deck on Newbury ST", metadata={"permitnumber": "A3"})])
+    assert store.get_document_count() == 3
+    assert len(store.search_documents("kitchen", k=10)) == 2
+
+    results = store.search_documents("Newbury", k=10)
+    store.delete_documents([results[0].id])
+    assert store.get_document_count() == 2
+    assert [document.id for document in store.search_documents("Newbury", k=10)] == [results[1].id]
+
+    store.add_documents([Document(page_content="Porch repair on Newbury ST", metadata={"permitnumber": "A4"})])
+    store.add_documents([Document(page_content="Fence on Beacon ST", metadata={"permitnumber": "A5"})])
+    assert len(store._segments) == 1
+    assert store.get_document_count() == 4
+
+    opened = Bm25KeywordStore(index_dir=tmp_path, id_key="permitnumber")
+    assert opened.get_document_count() == 4
+    assert len(opened.search_documents("Newbury", k=10)) == 2
+    opened.sync_documents([Document(page_content="Fence on Beacon ST", metadata={"permitnumber": "A5"})])
+    assert opened.get_document_count() == 1
+    assert opened.search_documents("kitchen", k=10) == []
+
+
+def test_write_during_compaction(tmp_path, monkeypatch):
+    store = Bm25KeywordStore(index_dir=tmp_path, id_key="permitnumber", max_segments=8, max_deleted_ratio=1.0,
+                             background_compaction=False)
+    for number in range(1, 4):
+        store.add_documents([Document(id=f"A{number}", page_content=f"Kitchen remodel on Newbury ST unit {number}",
+                                      metadata={"permitnumber": f"A{number}"})])
+    merging = threading.Event()
+    resume = threading.Event()
+    merge = Bm25Index.merge
+
+    def paused_merge(indexes, keep):
+        merging.set()
+        resume.wait(10)
+        return merge(indexes, keep)
+
+    monkeypatch.setattr(Bm25Index, "merge", paused_merge)
+    compaction = threading.Thread(target=store.compact)
+    compaction.start()
+    assert merging.wait(10)
+    # A1 is deleted and added again with the same ID, and A2 is deleted, while the segments are merged
+    store.delete_documents(["A1"])
+    store.add_documents([Document(id="A1", page_content="Roof deck on Beacon ST", metadata={"permitnumber": "A1"}),
+                         Document(id="A4", page_content="Porch repair on Beacon ST", metadata={"permitnumber": "A4"})])
+    store.delete_documents(["A2"])
+    resume.set()
+    compaction.join()
+
+    assert store.get_document_count() == 3
+    assert [document.metadata["permitnumber"] for document in store.search_documents("kitchen", 10)] == ["A3"]
+    assert store.search_documents("roof", 10)[0].metadata["permitnumber"] == "A1"
+    store.delete_documents(["A1"])
+    assert store.get_document_count() == 2
+    assert store.search_documents("roof", 10) == []
+
+    opened = Bm25KeywordStore(index_dir=tmp_path, id_key="permitnumber")
+    assert opened.get_document_count() == 2
+    assert [document.metadata["permitnumber"] for document in opened.search_documents("kitchen roof", 10)] == ["A3"]
+
+
+def test_concurrent_compactions(tmp_path, monkeypatch):
+    store = Bm25KeywordStore(index_dir=tmp_path, id_key="permitnumber", background_compaction=False)
+    for segment in range(3):
+        store.add_documents([Document(page_content=f"Kitchen remodel on Newbury ST unit {segment}-{number}",
+                                      metadata={"permitnumber": f"A{segment}-{number}"}) for number in range(5)])
+    merging = threading.Event()
+    merge = Bm25Index.merge
+
+    def slow_merge(indexes, keep):
+        merging.set()
+        time.sleep(0.2)
+        return merge(indexes, keep)
+
+    monkeypatch.setattr(Bm25Index, "merge", slow_merge)
+    compaction = threading.Thread(target=store.compact)
+    compaction.start()
+    assert merging.wait(10)
+    store.add_documents([Document(page_content="Kitchen remodel on Beacon ST", metadata={"permitnumber": "B1"})])
+    store.compact()
+    compaction.join()
+
+    assert store.get_document_count() == 16
+    assert len(store.search_documents("kitchen", 20)) == 16
+    assert len(Bm25KeywordStore(index_dir=tmp_path).search_documents("kitchen", 20)) == 16
@@ -0,0 +1,79 @@
+import time
+
+from langchain_core.documents import Document
+
+from aiasearch.data.bm25_keyword_store import Bm25KeywordStore
+from aiasearch.data.cached_store import CachedKeywordStore, CachedVectorStore, QueryCache
+from aiasearch.data.vector_store import VectorStore
+
+
+def test_cached_keyword_store():
+    store = Bm25KeywordStore()
+    store.add_documents([Document(page_content="Renovate kitchen on Newbury ST")])
+    cached = CachedKeywordStore(store)
+    assert len(cached.search_documents("Newbury  ST", k=5)) == 1
+    assert len(cached.search_documents("newbury st", k=5)) == 1
+    assert (cached.hits, cached.misses) == (1, 1)
+
+    cached.add_documents([Document(page_content="Roof deck on Newbury ST")])
+    assert len(cached.search_documents("newbury st", k=5)) == 2
+    # changes made directly to the store invalidate the cache through its version
+    store.add_documents([Document(page_content="Porch on Newbury ST")])
+    assert len(cached.search_documents("newbury st", k=5)) == 3
+    assert cached.misses == 3
+    assert cached.get_document_count() == 3
+
+
+def test_cached_store_skips_stale_results():
+    store = Bm25KeywordStore()
+    store.add_documents([Document(page_content="Renovate kitchen on Newbury ST")])
+    cached = CachedKeywordStore(store)
+    search = store.search_documents
+
+    def search_during_write(text, k=10, filter=None):
+        documents = search(text, k, filter=filter)
+        # a write finishes after the search read the store but before its results are cached
+        store.add_documents([Document(page_content="Roof deck on Newbury ST")])
+        return documents
+
+    store.search_documents = search_during_write
+    assert len(cached.search_documents("newbury", k=5)) == 1
+    store.search_documents = search
+    assert len(cached.search_documents("newbury", k=5)) == 2
+
+
+class CountingVectorStore(VectorStore):
+    def __init__(self):
+        self.searches = []
+
+    def add_documents(self, documents):
+        pass
+
+    def search_documents(self, text, k=10, filter=None):
+        self.searches.append(text)
+        return [Document(page_content=text)]
+
+    def get_document_count(self):
+        return 0
+
+
+def test_cached_vector_store_keeps_case():
+    store = CountingVectorStore()
+    cached = CachedVectorStore(store)
+    assert cached.search_documents("Newbury  ST")[0].page_content == "Newbury  ST"
+    assert cached.search_documents("Newbury ST")[0].page_content == "Newbury  ST"
+    # embeddings of queries differing in case differ, so they are searched apart
+    assert cached.search_documents("newbury st")[0].page_content == "newbury st"
+    assert store.searches == ["Newbury  ST", "newbury st"]
+
+
+def test_query_cache_lru_and_ttl():
+    cache = QueryCache(max_size=2, ttl=0.05)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
@@ -1,7 +1,12 @@
 from langchain_core.documents import Document
+from langchain_core.language_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
 
+from aiasearch.metrics import TOKENS
+from aiasearch.models.anthropic_provider import AnthropicProvider
 from aiasearch.models.chat_provider import ChatProvider
 from aiasearch.models.ollama_provider import OllamaProvider
+from aiasearch.models.stream_stats import StreamStats
 
 
 class TestChatProvider:
@@ -31,6 +36,41 @@ class TestChatProvider:
         response_text = chat_provider.query_grounded("What work was performed for permit A100071", documents=documents)
         assert "connector" in response_text
 
+    def test_stream_grounded(self):
+        ollama_provider = OllamaProvider("llama3.1")
+        ollama_provider._model = GenericFakeChatModel(messages=iter([AIMessage("The connector link was changed")]))
+        chat_provider = ChatProvider("ollama", "llama3.1", ollama_provider)
+        stats = StreamStats()
+        tokens = list(chat_provider.stream_grounded("What work was performed for permit A100071",
+                                                    [Document(page_content="A100071 Change connector link")], stats))
+        assert "".join(tokens) == "The connector link was changed"
+        assert stats.total_tokens == len(tokens)
+        assert 0 <= stats.time_to_first_token <= stats.total_time
+
+    def test_stream_output_tokens(self):
+        stats = StreamStats()
+        # providers report the output tokens generated so far, not the tokens of each chunk
+        for text, output_tokens in (("The", 1), (" connector", 2), ("", 3)):
+            usage = {"input_tokens": 10, "output_tokens": output_tokens, "total_tokens": 10 + output_tokens}
+            stats.record(AIMessageChunk(content=text, usage_metadata=usage))
+        assert stats.total_tokens == 3
+
+    def test_stream_grounded_anthropic(self):
+        provider = AnthropicProvider(chat_model=GenericFakeChatModel(messages=iter([AIMessage("Connector link")])))
+        before = TOKENS.value(direction="output", provider="anthropic", model="claude-3-5-haiku-20241022")
+        tokens = list(provider.stream_grounded("What work was performed for permit A100071",
+                                               [Document(page_content="A100071 Change connector link")]))
+        assert "".join(tokens) == "Connector link"
+        assert TOKENS.value(direction="output", provider="anthropic",
+                            model="claude-3-5-haiku-20241022") == before + len(tokens)
+
+    def test_provider_reuse(self):
+        first_provider = OllamaProvider("llama3.1")
+        second_provider = OllamaProvider("llama3.1")
+        assert first_provider._model is second_provider._model
+        assert first_provider._grounded_chain() is first_provider._grounded_chain()
+        assert first_provider._prompts is second_provider._prompts
+
     def test_anthropic(self):
         chat_provider = ChatProvider.create_instance_by_name("anthropic", "claude-3-5-haiku-20241022")
         assert chat_provider.provider_name == "anthropic"
@@ -1,5 +1,8 @@
+from langchain_core.documents import Document
+
 from aiasearch.data.chroma_vector_store import ChromaVectorStore
 from aiasearch.data.csv_loader import CsvLoader
+from aiasearch.data.embedding_backend import HashingEmbeddingBackend
 
 
 def test_add_documents():
@@ -21,3 +24,32 @@ def test_add_documents():
 
 def test_search_documents():
     assert True
+
+
+class _CountingEmbeddings(HashingEmbeddingBackend):
+    def __init__(self):
+        super().__init__()
+        self.embedded = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def test_sync_documents(tmp_path):
+    documents = [Document(page_content=f"Roof repair on Newbury ST unit {number}",
+                          metadata={"permitnumber": f"P{number}"}) for number in range(6)]
+    embeddings = _CountingEmbeddings()
+    chroma = ChromaVectorStore(vectorstore_dir=str(tmp_path / "vectorstore"), id_key="permitnumber",
+                               embeddings=embeddings)
+    chroma.sync_documents(documents)
+    assert len(embeddings.embedded) == 6
+
+    # P1 changed and P5 was removed
+    embeddings.embedded.clear()
+    changed = Document(page_content="Kitchen remodel on Tremont ST unit 1", metadata={"permitnumber": "P1"})
+    chroma.sync_documents([documents[0], changed, *documents[2:5]])
+    assert embeddings.embedded == [changed.page_content]
+    stored = chroma._vectorstore.get(include=["metadatas"])
+    assert sorted(metadata["permitnumber"] for metadata in stored["metadatas"]) == ["P0", "P1", "P2", "P3", "P4"]
+    assert chroma.search_documents(changed.page_content, 1)[0].page_content == changed.page_content
@@ -0,0 +1,37 @@
+from langchain_core.documents import Document
+
+from aiasearch.data.document_id import with_normalized_text
+from aiasearch.models.context_packer import ContextPacker
+
+
+def test_pack_deduplicates():
+    text = "Permit Number: A2\n  kitchen   remodel "
+    documents = [
+        Document(id="A1:1", page_content="Permit Number: A1 new roof on garage"),
+        Document(id="A1:1", page_content="Permit Number: A1 new roof on garage"),
+        Document(id="2", page_content="Permit Number: A1 new roof on garage"),
+        Document(id="A1:3", page_content="new roof"),
+        Document(id="A3:5", page_content="new roof"),
+        Document(id="A2:4", page_content=text, metadata=with_normalized_text(text, {})),
+    ]
+    context = ContextPacker(max_tokens=1000).pack(documents)
+
+    # A1:3 is a chunk of A1:1, A3:5 is from another source row
+    assert [document.id for document in context.documents] == ["A1:1", "A3:5", "A2:4"]
+    assert context.text == "Permit Number: A1 new roof on garage\n\nnew roof\n\nPermit Number: A2 kitchen remodel"
+    assert not context.truncated
+
+
+def test_pack_truncates_to_budget():
+    packer = ContextPacker(model_name="llama3.1", max_tokens=100, min_truncated_tokens=10)
+    documents = [Document(id=str(number), page_content=str(number) * 200) for number in range(5)]
+    context = packer.pack(documents)
+
+    assert context.truncated
+    assert context.token_count <= 100
+    assert len(context.documents) == 2
+    assert context.text.startswith("0" * 200 + "\n\n1")
+    assert packer.estimate_tokens(context.text) <= 100
+
+    assert ContextPacker(model_name="claude-3-5-haiku").estimate_tokens("x" * 35) == 10
+    assert ContextPacker(model_name="other").estimate_tokens("x" * 40) == 10
@@ -15,3 +15,25 @@ def test_load_csv():
                             max_rows=100)
     assert len(documents) > 0
     assert "A1000569" in documents[0].page_content
+
+
+def test_load_iter_csv():
+    current_dir = pathlib.Path(__file__).resolve().parent.parent
+    file_path = current_dir / "data.csv"
+    loader = CsvLoader()
+    label_columns = {"permitnumber": "Permit Number"}
+    combine_columns = ["worktype", "description", "address", "zip"]
+    batches = list(loader.load_iter(file_path=file_path,
+                                    label_columns=label_columns,
+                                    combine_columns=combine_columns,
+                                    metadata_columns=["permitnumber"],
+                                    max_rows=100,
+                                    chunksize=30))
+    assert [len(batch) for batch in batches] == [30, 30, 30, 10]
+    documents = loader.load(file_path=file_path, label_columns=label_columns, combine_columns=combine_columns,
+                            metadata_columns=["permitnumber"], max_rows=100)
+    assert [document.page_content for batch in batches for document in batch] == \
+           [document.page_content for document in documents]
+    assert documents[0].page_content.startswith("Permit Number: A1000569\nINTEXT")
+    assert documents[0].page_content.endswith("02109")
+    assert documents[0].metadata == {"permitnumber": "A1000569"}
@@ -0,0 +1,159 @@
+from langchain_core.documents import Document
+
+from aiasearch.data.bm25_keyword_store import Bm25KeywordStore
+from aiasearch.data.chroma_vector_store import ChromaVectorStore
+from aiasearch.data.document_id import document_id
+from aiasearch.data.document_store import DocumentStore
+from aiasearch.data.embedding_backend import HashingEmbeddingBackend
+from aiasearch.data.flat_vector_store import FlatVectorStore
+from aiasearch.data.metadata_filter import MetadataIndex
+
+WORK = ["Roof repair", "Kitchen remodel", "Install fire alarm", "Replace plumbing"]
+STREETS = ["Newbury ST", "Boylston ST", "Tremont ST"]
+DOCUMENTS = [Document(page_content=f"{WORK[number % 4]} on {STREETS[number % 3]} – unit {number}",
+                      metadata={"permitnumber": f"P{number}", "declared_valuation": number * 1000.0,
+                                "sq_feet": number, **({"owners": ["Ann", f"Bo {number}"]} if number % 5 == 0 else {}),
+                                **({"historic": True} if number % 2 == 0 else {})})
+             for number in range(40)]
+
+
+def test_add_and_get(tmp_path):
+    document_store = DocumentStore(store_dir=tmp_path / "documents")
+    for start in range(0, 40, 6):
+        assert document_store.add(DOCUMENTS[start:start + 6]).tolist() == list(range(start, min(start + 6, 40)))
+    assert document_store.add([DOCUMENTS[3], Document(page_content="new")]).tolist() == [3, 40]
+    # batches are merged as they are added
+    assert len(document_store._state[0]) < 8
+
+    reopened = DocumentStore(store_dir=tmp_path / "documents", read_only=True)
+    assert len(reopened) == 41
+    assert [(document.page_content, document.metadata) for document in reopened.get(range(40))] == \
+           [(document.page_content, document.metadata) for document in DOCUMENTS]
+    assert type(reopened[7].metadata["sq_feet"]) is int
+    assert reopened.ids([40, 0]) == [document_id(Document(page_content="new")), document_id(DOCUMENTS[0])]
+    assert reopened.lookup([document_id(DOCUMENTS[39]), "missing"]).tolist() == [39, -1]
+
+
+def test_mask():
+    document_store = DocumentStore()
+    document_store.add(DOCUMENTS[:25])
+    document_store.add(DOCUMENTS[25:])
+    index = MetadataIndex(document.metadata for document in DOCUMENTS)
+
+    for filter in [{"declared_valuation": {"$gte": 12000, "$lt": 30000}}, {"permitnumber": {"$prefix": "P3"}},
+                   {"historic": True, "sq_feet": {"$in": [2, 3, 4]}}, {"owners": {"$ne": 1}},
+                   {"permitnumber": {"$gte": "P25"}}]:
+        assert document_store.mask(filter).tolist() == index.mask(filter).tolist()
+
+    # adding documents builds the columns of the new batch only
+    columns = document_store._metadata[document_store._state[0][0].name]._columns
+    document_store.add([Document(page_content="new", metadata={"permitnumber": "P40"})])
+    assert document_store.mask({"permitnumber": {"$prefix": "P4"}}).nonzero()[0].tolist() == [4, 40]
+    assert document_store._metadata[document_store._state[0][0].name]._columns is columns
+
+
+def test_shared_stores(tmp_path):
+    document_store = DocumentStore(store_dir=tmp_path / "documents")
+    keyword_store = Bm25KeywordStore(index_dir=tmp_path / "keywords", id_key="permitnumber", max_segments=2,
+                                     background_compaction=False, document_store=document_store)
+    vector_store = FlatVectorStore(store_dir=tmp_path / "vectors", id_key="permitnumber",
+                                   embedding_backend=HashingEmbeddingBackend(), document_store=document_store)
+    for start in range(0, 40, 10):
+        keyword_store.add_documents(DOCUMENTS[start:start + 10])
+        vector_store.add_documents(DOCUMENTS[start:start + 10])
+    keyword_store.delete_documents([document_id(DOCUMENTS[1], "permitnumber")])
+
+    # the chunks of the vector store are the documents of the keyword store, stored once
+    assert len(document_store) == 40
+    assert not (tmp_path / "keywords" / "segment_000000" / "documents.jsonl").exists()
+    assert keyword_store.search_documents("kitchen unit 13", 1)[0].metadata == DOCUMENTS[13].metadata
+    assert vector_store.search_documents(DOCUMENTS[13].page_content, 1)[0].page_content == \
+           DOCUMENTS[13].page_content
+    results = keyword_store.search_documents("kitchen", 10, filter={"declared_valuation": {"$gte": 20000}})
+    assert [document.metadata["permitnumber"] for document in results] == ["P21", "P25", "P29", "P33", "P37"]
+
+    reopened_store = DocumentStore(store_dir=tmp_path / "documents", read_only=True)
+    reopened = Bm25KeywordStore(index_dir=tmp_path / "keywords", document_store=reopened_store)
+    assert reopened.get_document_count() == 39
+    assert reopened.search_documents("alarm unit 2", 1)[0].page_content == DOCUMENTS[2].page_content
+    reopened_vectors = FlatVectorStore(store_dir=tmp_path / "vectors", read_only=True,
+                                       embedding_backend=HashingEmbeddingBackend(), document_store=reopened_store)
+    results = reopened_vectors.search_documents("plumbing", 2, filter={"sq_feet": {"$lt": 10}})
+    assert {document.metadata["permitnumber"] for document in results} == {"P3", "P7"}
+
+
+
+def test_move_to_document_store(tmp_path):
+    keyword_store = Bm25KeywordStore(index_dir=tmp_path / "keywords", id_key="permitnumber",
+                                     background_compaction=False)
+    keyword_store.add_documents(DOCUMENTS[:20])
+    keyword_store.add_documents(DOCUMENTS[20:])
+    vector_store = FlatVectorStore(store_dir=tmp_path / "vectors", id_key="permitnumber",
+                                   embedding_backend=HashingEmbeddingBackend())
+    vector_store.add_documents(DOCUMENTS)
+
+    # stores saved without a DocumentStore move their documents into the one they are opened with
+    document_store = DocumentStore(store_dir=tmp_path / "documents")
+    keyword_store = Bm25KeywordStore(index_dir=tmp_path / "keywords", id_key="permitnumber",
+                                     document_store=document_store)
+    vector_store = FlatVectorStore(store_dir=tmp_path / "vectors", embedding_backend=HashingEmbeddingBackend(),
+                                   document_store=document_store)
+    assert len(document_store) == 40
+    assert not (tmp_path / "keywords" / "segment_000001" / "documents.jsonl").exists()
+    assert keyword_store.search_documents("kitchen unit 13", 1)[0].metadata == DOCUMENTS[13].metadata
+
+    reopened_store = DocumentStore(store_dir=tmp_path / "documents", read_only=True)
+    reopened = FlatVectorStore(store_dir=tmp_path / "vectors", read_only=True,
+                               embedding_backend=HashingEmbeddingBackend(), document_store=reopened_store)
+    assert reopened.search_documents(DOCUMENTS[13].page_content, 1)[0].metadata == DOCUMENTS[13].metadata
+
+
+
+def test_compact(tmp_path):
+    document_store = DocumentStore(store_dir=tmp_path / "documents")
+    keyword_store = Bm25KeywordStore(index_dir=tmp_path / "keywords", id_key="permitnumber",
+                                     background_compaction=False, document_store=document_store)
+    vector_store = FlatVectorStore(store_dir=tmp_path / "vectors", id_key="permitnumber",
+                                   embedding_backend=HashingEmbeddingBackend(), document_store=document_store)
+    keyword_store.sync_documents(DOCUMENTS)
+    vector_store.sync_documents(DOCUMENTS)
+    # the old versions of the changed documents are no longer used by either store
+    changed = [Document(page_content=f"Changed {document.page_content}", metadata=document.metadata)
+               for document in DOCUMENTS[:10]]
+    keyword_store.sync_documents(changed + DOCUMENTS[10:])
+    vector_store.sync_documents(changed + DOCUMENTS[10:])
+    old_id = document_id(DOCUMENTS[0], "permitnumber")
+    assert len(document_store) == 50
+
+    assert document_store.compact([keyword_store.document_numbers(), vector_store.document_numbers()]) == 10
+    assert document_store.compact([keyword_store.document_numbers(), vector_store.document_numbers()]) == 0
+    assert len(document_store) == 50
+    assert document_store.lookup([old_id]).tolist() == [-1]
+    assert int(document_store.mask({"sq_feet": {"$lt": 10}}).sum()) == 10
+    assert keyword_store.search_documents("changed kitchen unit 1", 1)[0].page_content == changed[1].page_content
+    assert vector_store.search_documents(DOCUMENTS[13].page_content, 1)[0].metadata == DOCUMENTS[13].metadata
+
+    reopened = DocumentStore(store_dir=tmp_path / "documents", read_only=True)
+    assert len(list((tmp_path / "documents").glob("batch_*"))) == len(reopened._state[0])
+    assert reopened.lookup([old_id, document_id(changed[0], "permitnumber")]).tolist()[0] == -1
+    reopened_keywords = Bm25KeywordStore(index_dir=tmp_path / "keywords", document_store=reopened)
+    assert reopened_keywords.search_documents("changed roof", 1)[0].page_content.startswith("Changed")
+
+
+def test_chroma_document_store(tmp_path):
+    document_store = DocumentStore(store_dir=tmp_path / "documents")
+    vector_store = ChromaVectorStore(vectorstore_dir=str(tmp_path / "vectorstore"), id_key="permitnumber",
+                                     embedding_backend=HashingEmbeddingBackend(), document_store=document_store)
+    vector_store.add_documents(DOCUMENTS[:12])
+
+    stored = vector_store._vectorstore._collection.get(include=["documents"])
+    assert stored["documents"] == [None] * 12
+    result = vector_store.search_documents(DOCUMENTS[5].page_content, 1)[0]
+    assert result.page_content == DOCUMENTS[5].page_content
+    results = vector_store.search_documents_batch(["roof"], 10, filter={"permitnumber": {"$prefix": "P1"}})
+    assert {document.metadata["permitnumber"] for document in results[0]} == {"P1", "P10", "P11"}
+
+    vector_store.delete_documents([document_id(DOCUMENTS[1], "permitnumber")])
+    assert document_store.compact([vector_store.document_numbers()]) == 1
+    results = vector_store.search_documents_batch(["roof"], 10, filter={"permitnumber": {"$prefix": "P1"}})
+    assert {document.metadata["permitnumber"] for document in results[0]} == {"P10", "P11"}
@@ -0,0 +1,29 @@
+import numpy as np
+from langchain_core.documents import Document
+
+from aiasearch.data.chroma_vector_store import ChromaVectorStore
+from aiasearch.data.embedding_backend import HashingEmbeddingBackend
+
+
+def test_hashing_embedding_backend():
+    backend = HashingEmbeddingBackend(dimension=64)
+    texts = ["Install new fire alarm system", "Replace roof on garage", "Fire alarm upgrade", ""]
+    vectors = np.asarray(backend.embed_documents(texts))
+
+    assert vectors.shape == (4, 64)
+    assert np.allclose(np.linalg.norm(vectors[:3], axis=1), 1.0)
+    assert not vectors[3].any()
+    assert np.allclose(vectors[0], HashingEmbeddingBackend(dimension=64).embed_query(texts[0]))
+    assert vectors[2] @ vectors[0] > vectors[2] @ vectors[1]
+    assert backend.name == "hashing-64-bigrams-" + backend._analyzer.name
+
+
+def test_chroma_vector_store_hashing_backend(tmp_path):
+    vector_store = ChromaVectorStore(vectorstore_dir=str(tmp_path / "vectorstore"),
+                                     embedding_backend=HashingEmbeddingBackend())
+    vector_store.add_documents([Document(page_content="Install new fire alarm system on Newbury ST"),
+                                Document(page_content="Replace roof on garage on Boylston ST"),
+                                Document(page_content="Kitchen remodel with new cabinets")])
+
+    assert vector_store.get_document_count() == 3
+    assert vector_store.search_documents("fire alarm", 1)[0].page_content.startswith("Install new fire alarm")
@@ -0,0 +1,118 @@
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from aiasearch.data.embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.calls += 1
+        return super().embed_query(text)
+
+
+def _float32(vector: list[float]) -> list[float]:
+    return np.asarray(vector, dtype=np.float32).tolist()
+
+
+def test_cached_embeddings(tmp_path):
+    embeddings = CountingEmbeddings(size=8)
+    cache = CachedEmbeddings(embeddings, tmp_path, model_name="fake")
+    texts = [f"permit {i}" for i in range(2000)]
+    vectors = cache.embed_documents(texts)
+    assert embeddings.calls == 2000
+    assert cache.embed_documents(texts) == vectors
+    # queries are cached apart from documents, as a model may embed them differently
+    assert cache.embed_query("permit 7") == _float32(embeddings.embed_query("permit 7"))
+    assert embeddings.calls == 2002
+    assert cache.embed_query("permit 7") == _float32(embeddings.embed_query("permit 7"))
+    assert embeddings.calls == 2003
+
+    cache.flush()
+    del cache
+    reopened = CachedEmbeddings(embeddings, tmp_path, model_name="fake")
+    assert len(reopened) == 2001
+    assert reopened.embed_documents(texts[:10]) == vectors[:10]
+    assert embeddings.calls == 2003
+
+
+def test_cached_embeddings_single_writer(tmp_path):
+    embeddings = CountingEmbeddings(size=8)
+    writer = CachedEmbeddings(embeddings, tmp_path, model_name="fake")
+    vectors = writer.embed_documents(["a", "b"])
+    # a second cache on the same directory reads the cached vectors but does not write
+    reader = CachedEmbeddings(embeddings, tmp_path, model_name="fake")
+    assert reader.read_only
+    assert reader.embed_documents(["a", "c"]) == [vectors[0], _float32(embeddings.embed_query("c"))]
+    assert len(reader) == 2
+    writer.embed_documents(["d"])
+    assert len(writer) == 3
+
+
+def test_cached_embeddings_eviction(tmp_path):
+    embeddings = CountingEmbeddings(size=8)
+    cache = CachedEmbeddings(embeddings, tmp_path, model_name="fake", max_entries=2)
+    cache.embed_query("a")
+    cache.embed_query("b")
+    cache.embed_query("a")
+    cache.embed_query("c")
+    assert len(cache) == 2
+    assert embeddings.calls == 3
+    cache.embed_query("a")
+    assert embeddings.calls == 3
+    cache.embed_query("b")
+    assert embeddings.calls == 4
+
+
+def test_cached_embeddings_reader_skips_rewritten_slots(tmp_path):
+    embeddings = CountingEmbeddings(size=8)
+    writer = CachedEmbeddings(embeddings, tmp_path, model_name="fake")
+    writer.embed_documents(["a"])
+    reader = CachedEmbeddings(embeddings, tmp_path, model_name="fake")
+    assert reader.read_only
+
+    class RewrittenDuringCopy:
+        # the writer evicts "a" while the reader copies its vector, and has not written the new key yet
+        def __init__(self, vectors):
+            self.vectors = vectors
+
+        def __getitem__(self, slots):
+            writer._keys[slots] = b""
+            writer._vectors[slots] = np.ones(8, dtype=np.float32)
+            return self.vectors[slots]
+
+    reader._vectors = RewrittenDuringCopy(reader._vectors)
+    assert reader.embed_documents(["a"]) == [_float32(embeddings.embed_query("a"))]
+    assert reader.hits == 1
+
+
+def test_cached_embeddings_writes_keys_around_vectors(tmp_path):
+    cache = CachedEmbeddings(CountingEmbeddings(size=8), tmp_path, model_name="fake")
+    cache.embed_query("a")
+    writes = []
+
+    class Recording:
+        def __init__(self, name, array):
+            self.name = name
+            self.array = array
+
+        def __setitem__(self, slots, values):
+            writes.append((self.name, bytes(values) if isinstance(values, bytes) else None))
+            self.array[slots] = values
+
+        def __getattr__(self, name):
+            return getattr(self.array, name)
+
+        def __len__(self):
+            return len(self.array)
+
+    cache._keys = Recording("keys", cache._keys)
+    cache._vectors = Recording("vectors", cache._vectors)
+    cache.embed_query("b")
+    # readers of other processes never see the new vector under the key of the entry it replaces
+    assert writes == [("keys", b""), ("vectors", None), ("keys", None)]
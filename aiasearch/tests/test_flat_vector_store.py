@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from aiasearch.data.embedding_backend import HashingEmbeddingBackend
+from aiasearch.data.flat_vector_store import FlatVectorStore
+
+DOCUMENTS = [Document(page_content="Install new fire alarm system on Newbury ST", metadata={"permitnumber": "A1"}),
+             Document(page_content="Replace roof on garage on Boylston ST", metadata={"permitnumber": "A2"}),
+             Document(page_content="Kitchen remodel with new cabinets", metadata={"permitnumber": "A3"})]
+
+
+def test_add_and_search(tmp_path):
+    vector_store = FlatVectorStore(store_dir=tmp_path / "store", id_key="permitnumber",
+                                   embedding_backend=HashingEmbeddingBackend())
+    vector_store.add_documents(DOCUMENTS)
+    vector_store.add_documents(DOCUMENTS)
+
+    assert vector_store.get_document_count() == 3
+    results = vector_store.search_documents("fire alarm", 2)
+    assert [document.metadata["permitnumber"] for document in results][0] == "A1"
+    assert len(results) == 2
+    assert results[0].id.startswith("A1:")
+    batch = vector_store.search_documents_batch(["fire alarm", "kitchen cabinets"], 1)
+    assert [results[0].metadata["permitnumber"] for results in batch] == ["A1", "A3"]
+
+
+def test_reopen_read_only(tmp_path):
+    vector_store = FlatVectorStore(store_dir=tmp_path / "store", id_key="permitnumber", dtype="float16",
+                                   embedding_backend=HashingEmbeddingBackend())
+    vector_store.add_documents(DOCUMENTS[:2])
+    vector_store.add_documents(DOCUMENTS[2:])
+
+    reopened = FlatVectorStore(store_dir=tmp_path / "store", read_only=True,
+                               embedding_backend=HashingEmbeddingBackend())
+    assert reopened.get_document_count() == 3
+    assert reopened.search_documents("kitchen cabinets", 1)[0].metadata["permitnumber"] == "A3"
+    with pytest.raises(PermissionError):
+        reopened.add_documents(DOCUMENTS)
+
+
+def test_sync_delete_and_compact(tmp_path):
+    vector_store = FlatVectorStore(store_dir=tmp_path / "store", id_key="permitnumber", max_deleted_ratio=0.5,
+                                   embedding_backend=HashingEmbeddingBackend())
+    vector_store.add_documents(DOCUMENTS)
+    version = vector_store.version
+    changed = Document(page_content="Replace roof and gutters on garage", metadata={"permitnumber": "A2"})
+    vector_store.sync_documents([DOCUMENTS[0], changed, DOCUMENTS[2]])
+
+    assert vector_store.version > version
+    assert vector_store.get_document_count() == 3
+    assert "gutters" in vector_store.search_documents("roof garage", 1)[0].page_content
+
+    reopened = FlatVectorStore(store_dir=tmp_path / "store", embedding_backend=HashingEmbeddingBackend())
+    reopened.delete_documents([document.id for document in reopened.search_documents("fire alarm kitchen", 2)])
+    assert reopened.get_document_count() == 1
+    assert reopened._count == 1
+    assert [document.metadata["permitnumber"] for document in reopened.search_documents("fire", 10)] == ["A2"]
+
+
+def test_int8_quantization(tmp_path):
+    documents = [Document(page_content=f"Permit {number} for {work} work on {street} ST",
+                          metadata={"permitnumber": f"P{number}"})
+                 for number, (work, street) in enumerate((work, street)
+                                                         for work in ["roof", "kitchen", "alarm", "plumbing"]
+                                                         for street in ["Newbury", "Boylston", "Tremont"])]
+    exact = FlatVectorStore(id_key="permitnumber", embedding_backend=HashingEmbeddingBackend())
+    exact.add_documents(documents)
+    quantized = FlatVectorStore(store_dir=tmp_path / "store", id_key="permitnumber", quantization="int8",
+                                embedding_backend=HashingEmbeddingBackend())
+    quantized.add_documents(documents)
+    reopened = FlatVectorStore(store_dir=tmp_path / "store", read_only=True,
+                               embedding_backend=HashingEmbeddingBackend())
+
+    assert reopened._codes.dtype == np.int8
+    vectors = quantized._vectors[:len(documents)]
+    assert np.abs(quantized._codes[:len(documents)] * quantized._scales[:len(documents), None] - vectors).max() < 0.01
+    for query in ["kitchen work on Tremont", "alarm Newbury", "plumbing"]:
+        assert [document.id for document in reopened.search_documents(query, 3)] == \
+               [document.id for document in exact.search_documents(query, 3)]
+
+    with pytest.raises(ValueError):
+        FlatVectorStore(quantization="int8", embedding_backend=HashingEmbeddingBackend())
+
+
+def test_interrupted_compaction(tmp_path, monkeypatch):
+    vector_store = FlatVectorStore(store_dir=tmp_path / "store", id_key="permitnumber", max_deleted_ratio=1.0,
+                                   embedding_backend=HashingEmbeddingBackend())
+    vector_store.add_documents(DOCUMENTS)
+    vector_store.delete_documents([vector_store.search_documents("fire alarm", 1)[0].id])
+
+    def fail(f, count):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(FlatVectorStore, "_truncate_ids", staticmethod(fail))
+    with pytest.raises(OSError):
+        vector_store.compact()
+    monkeypatch.undo()
+
+    # the manifest still names the files from before the compaction
+    reopened = FlatVectorStore(store_dir=tmp_path / "store", read_only=True,
+                               embedding_backend=HashingEmbeddingBackend())
+    assert (reopened.get_document_count(), reopened._count) == (2, 3)
+    assert reopened.search_documents("kitchen cabinets", 1)[0].metadata["permitnumber"] == "A3"
+    assert vector_store.get_document_count() == 2
+    assert not (tmp_path / "store" / "generation_000001").exists()
+
+    vector_store.compact()
+    assert not (tmp_path / "store" / "vectors.npy").exists()
+    reopened = FlatVectorStore(store_dir=tmp_path / "store", read_only=True,
+                               embedding_backend=HashingEmbeddingBackend())
+    assert (reopened.get_document_count(), reopened._count) == (2, 2)
+    assert {document.metadata["permitnumber"] for document in reopened.search_documents("roof kitchen", 2)} == \
+           {"A2", "A3"}
+
+
+def test_sync_metadata_change(tmp_path):
+    vector_store = FlatVectorStore(store_dir=tmp_path / "store", id_key="permitnumber",
+                                   embedding_backend=HashingEmbeddingBackend())
+    vector_store.sync_documents(DOCUMENTS)
+    # a metadata column added to unchanged text replaces the stored documents
+    documents = [Document(page_content=document.page_content, metadata={**document.metadata, "worktype": "RESRF"})
+                 for document in DOCUMENTS]
+    vector_store.sync_documents(documents)
+
+    assert vector_store.get_document_count() == 3
+    results = vector_store.search_documents("garage", 3, filter={"worktype": "RESRF"})
+    assert {document.metadata["permitnumber"] for document in results} == {"A1", "A2", "A3"}
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+
+from aiasearch.data.hybrid_retriever import HybridRetriever
+from aiasearch.data.keyword_store import KeywordStore
+from aiasearch.data.vector_store import VectorStore
+
+
+class ListVectorStore(VectorStore):
+    def __init__(self, documents, barrier: threading.Barrier = None):
+        self.documents = documents
+        self.barrier = barrier
+
+    def add_documents(self, documents):
+        self.documents.extend(documents)
+
+    def search_documents(self, text, k=10, filter=None):
+        # a search waiting on a barrier only returns once the other searches reach it, so they run at the same time
+        if self.barrier is not None:
+            self.barrier.wait()
+        return self.documents[:k]
+
+    def get_document_count(self):
+        return len(self.documents)
+
+
+class ListKeywordStore(KeywordStore):
+    def __init__(self, documents, barrier: threading.Barrier = None):
+        self.documents = documents
+        self.barrier = barrier
+
+    def add_documents(self, documents):
+        self.documents.extend(documents)
+
+    def delete_documents(self, ids):
+        self.documents = [document for document in self.documents if document.id not in ids]
+
+    def search_documents(self, text, k=10, filter=None):
+        # a search waiting on a barrier only returns once the other searches reach it, so they run at the same time
+        if self.barrier is not None:
+            self.barrier.wait()
+        return self.documents[:k]
+
+
+def test_fusion():
+    a = Document(id="a", page_content="a", metadata={"permitnumber": "1"})
+    b = Document(id="b", page_content="b", metadata={"permitnumber": "2"})
+    c = Document(id="c", page_content="c", metadata={"permitnumber": "3"})
+    retriever = HybridRetriever(ListVectorStore([a, b]), ListKeywordStore([c, b]))
+    results = retriever.search_documents("question", k=10)
+    assert [document.id for document in results] == ["b", "a", "c"]
+    candidates = HybridRetriever(ListVectorStore([a, b]), ListKeywordStore([c, b]), candidate_k=10)
+    assert [document.id for document in candidates.search_documents("question", k=1)] == ["b"]
+
+    weighted = HybridRetriever(ListVectorStore([a, b]), ListKeywordStore([c, b]), keyword_weight=3.0)
+    assert [document.id for document in weighted.search_documents("question", k=10)] == ["b", "c", "a"]
+
+    chunk = Document(id="d", page_content="chunk of a", metadata={"permitnumber": "1"})
+    by_permit = HybridRetriever(ListVectorStore([chunk]), ListKeywordStore([a]), dedupe_key="permitnumber")
+    assert [document.id for document in by_permit.search_documents("question")] == ["d"]
+
+
+def test_split_documents():
+    whole = Document(id="1:aaaa", page_content="whole permit")
+    chunk = Document(id="1:bbbb", page_content="chunk of the permit")
+    other = Document(id="2:cccc", page_content="other permit")
+    retriever = HybridRetriever(ListVectorStore([chunk, other]), ListKeywordStore([whole]))
+    # the chunk and the whole permit share the source of their IDs
+    assert [document.id for document in retriever.search_documents("question")] == ["1:bbbb", "2:cccc"]
+
+
+def test_concurrent_search():
+    a = Document(id="a", page_content="a")
+    barrier = threading.Barrier(2, timeout=5)
+    with HybridRetriever(ListVectorStore([a], barrier), ListKeywordStore([a], barrier)) as retriever:
+        assert len(retriever.search_documents("question")) == 1
+        assert len(retriever.search_documents_batch(["question", "other question"])) == 2
+    assert retriever._executor._shutdown
+
+
+def test_async_search():
+    a = Document(id="a", page_content="a")
+    b = Document(id="b", page_content="b")
+    # the five searches of both stores all run at the same time
+    barrier = threading.Barrier(10, timeout=5)
+    retriever = HybridRetriever(ListVectorStore([a, b], barrier), ListKeywordStore([b], barrier))
+
+    async def search():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=10))
+        return await asyncio.gather(*[retriever.asearch_documents("question") for _ in range(5)])
+
+    results = asyncio.run(search())
+    assert [[document.id for document in documents] for documents in results] == [["b", "a"]] * 5
@@ -0,0 +1,107 @@
+import pandas as pd
+from langchain_core.documents import Document
+
+from aiasearch.data.bm25_keyword_store import Bm25KeywordStore
+from aiasearch.data.csv_loader import CsvLoader
+from aiasearch.data.embedding_backend import HashingEmbeddingBackend
+from aiasearch.data.flat_vector_store import FlatVectorStore
+from aiasearch.ingest import ingest_csv
+
+WORK = ["Roof repair", "Kitchen remodel", "Install fire alarm", "Replace plumbing"]
+STREETS = ["Newbury ST", "Boylston ST", "Tremont ST"]
+
+
+def _write_csv(path, rows=40):
+    df = pd.DataFrame({"permitnumber": [f"P{number}" for number in range(rows)],
+                       "description": [f"{WORK[number % 4]}\non \"{STREETS[number % 3]}\", unit {number}"
+                                       for number in range(rows)],
+                       "declared_valuation": [str(number * 1000) for number in range(rows)]})
+    df.to_csv(path, index=False)
+    return df
+
+
+def test_partition(tmp_path):
+    path = tmp_path / "permits.csv"
+    _write_csv(path)
+    expected = CsvLoader().load(file_path=str(path), metadata_columns=["permitnumber"])
+
+    for partitions in [1, 3, 7, 100]:
+        ranges = CsvLoader.partition(path, partitions)
+        # the header is read by every partition and is not part of any range
+        assert ranges[0][0] == len(b"permitnumber,description,declared_valuation\n")
+        assert ranges[-1][1] == path.stat().st_size
+        assert all(previous[1] == current[0] for previous, current in zip(ranges, ranges[1:]))
+        documents = [document for byte_range in ranges
+                     for batch in CsvLoader().load_iter(file_path=str(path), metadata_columns=["permitnumber"],
+                                                        byte_range=byte_range, chunksize=None)
+                     for document in batch]
+        assert documents == expected
+
+
+
+def test_partition_stray_quotes(tmp_path):
+    # quotes inside unquoted values are text and do not start a quoted value
+    path = tmp_path / "permits.csv"
+    lines = ["permitnumber,description,comments"]
+    for number in range(60):
+        if number % 3 == 0:
+            lines.append(f'P{number},Install 3/4" pipe on {STREETS[number % 3]},"Inspected\nsee ""note"" {number}"')
+        elif number % 3 == 1:
+            lines.append(f'P{number},"Kitchen remodel, unit {number}",Customer said "ok"')
+        else:
+            lines.append(f'P{number},Replace 1/2"" valve,"Two\nline, comment {number}"')
+    path.write_text("\n".join(lines) + "\n")
+    expected = CsvLoader().load(file_path=str(path), metadata_columns=["permitnumber"])
+    assert len(expected) == 60
+
+    for partitions in [2, 5, 13, 60]:
+        documents = [document for byte_range in CsvLoader.partition(path, partitions)
+                     for batch in CsvLoader().load_iter(file_path=str(path), metadata_columns=["permitnumber"],
+                                                        byte_range=byte_range, chunksize=None)
+                     for document in batch]
+        assert documents == expected
+
+
+def test_ingest_csv(tmp_path):
+    path = tmp_path / "permits.csv"
+    _write_csv(path)
+    keyword_store = Bm25KeywordStore(index_dir=tmp_path / "keywords", id_key="permitnumber",
+                                     background_compaction=False)
+    vector_store = FlatVectorStore(store_dir=tmp_path / "vectors", id_key="permitnumber",
+                                   embedding_backend=HashingEmbeddingBackend())
+
+    summary = ingest_csv(str(path), keyword_store=keyword_store, vector_store=vector_store,
+                         combine_columns=["description"], metadata_columns=["permitnumber", "declared_valuation"],
+                         metadata_types={"declared_valuation": "int"}, id_key="permitnumber", workers=2,
+                         partition_bytes=512, work_dir=tmp_path)
+
+    assert summary["partitions"] > 2
+    assert summary["documents"] == 40
+    assert keyword_store.get_document_count() == 40
+    assert len(keyword_store._segments) == 1
+    assert vector_store.get_document_count() == 40
+    assert list(tmp_path.glob("ingest-*")) == []
+    results = keyword_store.search_documents("kitchen unit 13", 1, filter={"declared_valuation": {"$gte": 10000}})
+    assert results[0].metadata == {"permitnumber": "P13", "declared_valuation": 13000,
+                                   "normalized_text": 'Kitchen remodel on "Boylston ST", unit 13'}
+
+    reopened = Bm25KeywordStore(index_dir=tmp_path / "keywords", id_key="permitnumber")
+    assert reopened.search_documents("unit 13", 1)[0].metadata["permitnumber"] == "P13"
+
+
+def test_add_segments(tmp_path):
+    documents = [Document(page_content=f"{WORK[number % 4]} on {STREETS[number % 3]}",
+                          metadata={"permitnumber": f"P{number}"}) for number in range(12)]
+    builder = Bm25KeywordStore(id_key="permitnumber")
+    assert builder.build_segment(documents[:6], tmp_path / "first") == 6
+    assert builder.build_segment(documents[6:], tmp_path / "second") == 6
+
+    keyword_store = Bm25KeywordStore(id_key="permitnumber", background_compaction=False)
+    keyword_store.add_documents(documents[:1])
+    keyword_store.add_segments([tmp_path / "first", tmp_path / "second"])
+
+    assert keyword_store.get_document_count() == 12
+    serial = Bm25KeywordStore(id_key="permitnumber")
+    serial.add_documents(documents)
+    for query in ["roof Newbury", "kitchen", "plumbing Tremont"]:
+        assert keyword_store.search_documents(query, 4) == serial.search_documents(query, 4)
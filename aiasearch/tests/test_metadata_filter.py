@@ -0,0 +1,145 @@
+import operator
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from langchain_core.documents import Document
+
+from aiasearch.data.bm25_keyword_store import Bm25KeywordStore
+from aiasearch.data.cached_store import CachedKeywordStore
+from aiasearch.data.chroma_vector_store import ChromaVectorStore
+from aiasearch.data.csv_loader import CsvLoader
+from aiasearch.data.embedding_backend import HashingEmbeddingBackend
+from aiasearch.data.flat_vector_store import FlatVectorStore
+from aiasearch.data.hybrid_retriever import HybridRetriever
+from aiasearch.data.metadata_filter import MetadataIndex, TextColumn, to_chroma_where
+from aiasearch.data.rank_bm25_keyword_store import RankBm25KeywordStore
+
+DOCUMENTS = [
+    Document(page_content="Roof repair on Newbury ST",
+             metadata={"permitnumber": "A1", "address": "12 Newbury ST", "worktype": "RESRF",
+                       "declared_valuation": 5000.0, "issued_date": 1609459200}),
+    Document(page_content="Roof replacement on Boylston ST",
+             metadata={"permitnumber": "A2", "address": "40 Boylston ST", "worktype": "RESRF",
+                       "declared_valuation": 25000.0, "issued_date": 1640995200}),
+    Document(page_content="Kitchen remodel on Newbury ST",
+             metadata={"permitnumber": "A3", "address": "19 Newbury ST", "worktype": "INTEXT",
+                       "declared_valuation": 80000.0}),
+]
+
+
+def test_mask():
+    index = MetadataIndex(document.metadata for document in DOCUMENTS)
+
+    assert index.mask({"worktype": "RESRF"}).tolist() == [True, True, False]
+    assert index.mask({"declared_valuation": {"$gte": 25000, "$lt": 80000}}).tolist() == [False, True, False]
+    assert index.mask({"address": {"$prefix": "1"}}).tolist() == [True, False, True]
+    assert index.mask({"permitnumber": {"$nin": ["A1", "A3"]}}).tolist() == [False, True, False]
+    assert index.mask({"issued_date": {"$ne": datetime(2021, 1, 1)}}).tolist() == [False, True, False]
+    assert index.mask({"$or": [{"permitnumber": "A1"}, {"worktype": "INTEXT"}],
+                       "missing": {"$ne": 1}}).tolist() == [False, False, False]
+    with pytest.raises(ValueError):
+        index.mask({"worktype": {"$like": "RES"}})
+
+
+
+def test_append():
+    index = MetadataIndex([DOCUMENTS[0].metadata])
+    assert index.mask({"worktype": "RESRF"}).tolist() == [True]
+    # the built columns are extended with the appended documents, including keys the first documents do not have
+    index.append([DOCUMENTS[1].metadata, {"permitnumber": "A4", "stories": 2}])
+    index.append([DOCUMENTS[2].metadata])
+    assert len(index) == 4
+    assert index.mask({"worktype": "RESRF"}).tolist() == [True, True, False, False]
+    assert index.mask({"stories": {"$gte": 1}}).tolist() == [False, False, True, False]
+    assert index.mask({"address": {"$prefix": "1"}}).tolist() == [True, False, False, True]
+    index.append([DOCUMENTS[0].metadata])
+    assert index.mask({"permitnumber": {"$in": ["A1", "A4"]}}).tolist() == [True, False, True, False, True]
+
+
+def test_text_column():
+    values = ["", "a", "ab", "abc", "b", "Newbury", "Newbury ST", "Ä", "é", "éa", "z\U0001F600", "\U0001F600"]
+    column = TextColumn.build(values)
+    for value in ["", "a", "ab", "aa", "Newbury", "New", "é", "\U0001F600", "zz"]:
+        for op, compare in [("$eq", operator.eq), ("$ne", operator.ne), ("$lt", operator.lt), ("$lte", operator.le),
+                            ("$gt", operator.gt), ("$gte", operator.ge)]:
+            assert column.compare(op, value).tolist() == [compare(text, value) for text in values], (op, value)
+        assert column.startswith(value).tolist() == [text.startswith(value) for text in values]
+    assert TextColumn.concatenate([column, TextColumn.empty(2)]).compare("$eq", "").tolist() == \
+           [text == "" for text in values] + [True, True]
+
+
+def test_to_chroma_where():
+    assert to_chroma_where({"worktype": "RESRF"}) == {"worktype": {"$eq": "RESRF"}}
+    assert to_chroma_where({"issued_date": {"$gte": datetime(2021, 1, 1)}, "worktype": {"$in": ["A", "B"]}}) == \
+           {"$and": [{"issued_date": {"$gte": 1609459200}}, {"worktype": {"$in": ["A", "B"]}}]}
+    assert to_chroma_where({"address": {"$prefix": "12"}}) is None
+    assert to_chroma_where({"address": {"$gt": "12"}}) is None
+
+
+def test_csv_metadata_types():
+    df = pd.DataFrame({"permitnumber": ["A1", "A2"], "declared_valuation": ["$36,500.00", ""],
+                       "issued_date": ["2021-01-28 16:29:26+00", "not a date"], "sq_feet": ["120", "0"]})
+    documents = CsvLoader.documents_from_frame(df, {}, ["permitnumber"], list(df.columns),
+                                               {"declared_valuation": "float", "issued_date": "datetime",
+                                                "sq_feet": "int"})
+
+    assert documents[0].metadata == {"permitnumber": "A1", "declared_valuation": 36500.0,
+                                     "issued_date": 1611851366, "sq_feet": 120}
+    assert documents[1].metadata == {"permitnumber": "A2", "sq_feet": 0}
+    assert type(documents[0].metadata["sq_feet"]) is int
+
+
+@pytest.mark.parametrize("store", [
+    lambda tmp_path: FlatVectorStore(id_key="permitnumber", embedding_backend=HashingEmbeddingBackend()),
+    lambda tmp_path: FlatVectorStore(store_dir=tmp_path / "flat", id_key="permitnumber", quantization="int8",
+                                     embedding_backend=HashingEmbeddingBackend()),
+    lambda tmp_path: Bm25KeywordStore(index_dir=tmp_path / "bm25", id_key="permitnumber"),
+    lambda tmp_path: RankBm25KeywordStore(id_key="permitnumber"),
+])
+def test_store_filter(store, tmp_path):
+    store = store(tmp_path)
+    store.add_documents(DOCUMENTS[:2])
+    store.add_documents(DOCUMENTS[2:])
+
+    results = store.search_documents("roof Newbury", 10, filter={"address": {"$prefix": "19 "}})
+    assert [document.metadata["permitnumber"] for document in results] == ["A3"]
+    results = store.search_documents("roof", 10, filter={"declared_valuation": {"$gt": 1000},
+                                                         "issued_date": {"$gte": datetime(2021, 6, 1)}})
+    assert [document.metadata["permitnumber"] for document in results] == ["A2"]
+    assert store.search_documents("roof", 10, filter={"worktype": "NONE"}) == []
+
+
+def test_hybrid_filter(tmp_path):
+    vector_store = FlatVectorStore(id_key="permitnumber", embedding_backend=HashingEmbeddingBackend())
+    vector_store.add_documents(DOCUMENTS)
+    keyword_store = CachedKeywordStore(Bm25KeywordStore(id_key="permitnumber"))
+    keyword_store.add_documents(DOCUMENTS)
+    retriever = HybridRetriever(vector_store, keyword_store, dedupe_key="permitnumber")
+
+    assert len(retriever.search_documents("roof Newbury", 10)) == 3
+    results = retriever.search_documents("roof Newbury", 10, filter={"worktype": "RESRF"})
+    assert {document.metadata["permitnumber"] for document in results} == {"A1", "A2"}
+    batch = retriever.search_documents_batch(["roof", "kitchen"], 10, filter={"worktype": "INTEXT"})
+    assert [[document.metadata["permitnumber"] for document in results] for results in batch] == [["A3"], ["A3"]]
+
+
+def test_chroma_filter(tmp_path):
+    vector_store = ChromaVectorStore(vectorstore_dir=str(tmp_path / "vectorstore"), id_key="permitnumber",
+                                     embedding_backend=HashingEmbeddingBackend())
+    vector_store.add_documents(DOCUMENTS)
+
+    results = vector_store.search_documents("roof", 10, filter={"worktype": "RESRF",
+                                                                "declared_valuation": {"$lte": 5000}})
+    assert [document.metadata["permitnumber"] for document in results] == ["A1"]
+    results = vector_store.search_documents_batch(["roof"], 10, filter={"address": {"$prefix": "19 "}})
+    assert [document.metadata["permitnumber"] for document in results[0]] == ["A3"]
+
+    # the metadata index is built once and rebuilt after documents are added
+    index = vector_store._metadata_index
+    vector_store.search_documents("kitchen", 10, filter={"address": {"$prefix": "1"}})
+    assert vector_store._metadata_index is index
+    vector_store.add_documents([Document(page_content="Roof repair on Tremont ST",
+                                         metadata={"permitnumber": "A4", "address": "19 Tremont ST"})])
+    results = vector_store.search_documents("roof", 10, filter={"address": {"$prefix": "19 "}})
+    assert sorted(document.metadata["permitnumber"] for document in results) == ["A3", "A4"]
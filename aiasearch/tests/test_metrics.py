@@ -0,0 +1,77 @@
+import logging
+
+import pytest
+from langchain_core.documents import Document
+
+from aiasearch.data.bm25_keyword_store import Bm25KeywordStore
+from aiasearch.metrics import MetricsRegistry, REGISTRY, SPAN_ERRORS, SPAN_SECONDS, DOCUMENTS, span
+
+
+def test_counter_and_histogram():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_documents_total", "Documents.")
+    counter.inc(2, store="a")
+    counter.inc(store="a")
+    counter.inc(5, store="b")
+    histogram = registry.histogram("test_seconds", "Latency.", buckets=(0.1, 1.0))
+    for value in [0.05, 0.05, 0.5, 2.0]:
+        histogram.observe(value, span="search")
+
+    assert counter.value(store="a") == 3
+    assert registry.counter("test_documents_total", "Documents.") is counter
+    with pytest.raises(ValueError):
+        registry.histogram("test_documents_total", "Documents.")
+    assert histogram.count(span="search") == 4
+    assert histogram.sum(span="search") == pytest.approx(2.6)
+    assert histogram.quantile(0.5, span="search") == pytest.approx(0.1)
+    assert histogram.quantile(0.75, span="search") == pytest.approx(1.0)
+
+    assert registry.to_prometheus() == "\n".join([
+        "# HELP test_documents_total Documents.",
+        "# TYPE test_documents_total counter",
+        "test_documents_total{store=\"a\"} 3",
+        "test_documents_total{store=\"b\"} 5",
+        "# HELP test_seconds Latency.",
+        "# TYPE test_seconds histogram",
+        "test_seconds_bucket{span=\"search\",le=\"0.1\"} 2",
+        "test_seconds_bucket{span=\"search\",le=\"1.0\"} 3",
+        "test_seconds_bucket{span=\"search\",le=\"+Inf\"} 4",
+        "test_seconds_sum{span=\"search\"} 2.6",
+        "test_seconds_count{span=\"search\"} 4",
+    ]) + "\n"
+
+
+def test_log_metrics(caplog):
+    registry = MetricsRegistry()
+    registry.counter("test_cache_requests_total", "Cache lookups.").inc(cache="answer", result="hit")
+    registry.histogram("test_seconds", "Latency.").observe(0.003, span="embed")
+    with caplog.at_level(logging.INFO, logger="aiasearch.metrics"):
+        registry.log_metrics()
+
+    assert caplog.messages[0] == "metric=test_cache_requests_total cache=answer result=hit value=1"
+    assert caplog.messages[1].startswith("metric=test_seconds span=embed count=1 sum=0.003 p50=")
+
+
+def test_span():
+    before = SPAN_SECONDS.count(span="test_span")
+    with span("test_span"):
+        pass
+    with pytest.raises(RuntimeError):
+        with span("test_span"):
+            raise RuntimeError("failed")
+
+    assert SPAN_SECONDS.count(span="test_span") == before + 2
+    assert SPAN_ERRORS.value(span="test_span") >= 1
+
+
+def test_store_instrumentation():
+    keyword_store = Bm25KeywordStore()
+    keyword_store.add_documents([Document(page_content="new roof on Newbury ST"),
+                                 Document(page_content="fire alarm on Boylston ST")])
+    searches = SPAN_SECONDS.count(span="keyword_search", store="bm25")
+    retrieved = DOCUMENTS.value(stage="retrieved", store="bm25")
+    keyword_store.search_documents("roof", 10)
+
+    assert SPAN_SECONDS.count(span="keyword_search", store="bm25") == searches + 1
+    assert DOCUMENTS.value(stage="retrieved", store="bm25") == retrieved + 1
+    assert "aiasearch_span_seconds_count{span=\"keyword_search\",store=\"bm25\"}" in REGISTRY.to_prometheus()
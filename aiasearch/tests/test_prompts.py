@@ -14,3 +14,12 @@ def test_get_full_prompt():
     assert "user" in prompts
 
     assert True
+
+def test_get_prompt_version():
+    assert PromptManager("llama3.1").get_prompt_version("query_grounded") != \
+           PromptManager("default").get_prompt_version("query_grounded")
+
+def test_get_shared():
+    llama_prompts = PromptManager.get("llama3.1")
+    assert PromptManager.get("Llama3.1") is llama_prompts
+    assert PromptManager.get("default") is not llama_prompts
@@ -0,0 +1,179 @@
+import http.client
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from aiasearch.data.bm25_keyword_store import Bm25KeywordStore
+from aiasearch.data.embedding_backend import HashingEmbeddingBackend
+from aiasearch.data.embedding_batcher import MicroBatchingEmbeddings
+from aiasearch.data.flat_vector_store import FlatVectorStore
+from aiasearch.data.hybrid_retriever import HybridRetriever
+from aiasearch.server import QueryServer, QueryService
+
+STREETS = ["Newbury ST", "Boylston ST", "Tremont ST", "Beacon ST"]
+DOCUMENTS = [Document(page_content=f"Kitchen remodel on {STREETS[number % 4]} – unit {number}",
+                      metadata={"permitnumber": f"P{number}", "sq_feet": number})
+             for number in range(20)]
+
+
+class _CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = []
+        self._backend = HashingEmbeddingBackend()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls.append(len(texts))
+        time.sleep(0.01)
+        return self._backend.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+class _SlowRetriever:
+    def search_documents(self, text: str, k=10, filter: dict = None) -> list[Document]:
+        time.sleep(0.3)
+        return DOCUMENTS[:k]
+
+
+def _post(server: QueryServer, path: str, body) -> tuple[int, dict]:
+    request = urllib.request.Request(f"http://127.0.0.1:{server.server_port}{path}", method="POST",
+                                     data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def _serve(service: QueryService) -> QueryServer:
+    server = QueryServer(("127.0.0.1", 0), service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_micro_batching():
+    counting = _CountingEmbeddings()
+    embeddings = MicroBatchingEmbeddings(counting, max_wait=0.005)
+    texts = [f"query {number % 12}" for number in range(24)]
+    results = [None] * len(texts)
+
+    def embed(number):
+        results[number] = embeddings.embed_query(texts[number])
+
+    threads = [threading.Thread(target=embed, args=(number,)) for number in range(len(texts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    embeddings.close()
+
+    # concurrent queries share embedding calls and repeated queries are embedded once per batch
+    assert len(counting.calls) < len(texts)
+    assert sum(counting.calls) <= len(texts)
+    assert results == HashingEmbeddingBackend().embed_documents(texts)
+
+
+def test_micro_batching_worker_exit():
+    embeddings = MicroBatchingEmbeddings(_CountingEmbeddings(), max_batch_size=1)
+    embedding = threading.Event()
+    queued = threading.Event()
+
+    def fail(batch):
+        embedding.set()
+        queued.wait(5)
+        raise RuntimeError("worker failed")
+
+    embeddings._embed = fail
+    first = embeddings._submit("first")
+    embedding.wait(5)
+    second = embeddings._submit("second")
+    queued.set()
+    with pytest.raises(RuntimeError, match="worker failed"):
+        first.result(timeout=5)
+    # the query queued when the worker stopped fails instead of waiting forever
+    with pytest.raises(RuntimeError, match="closed"):
+        second.result(timeout=5)
+    with pytest.raises(RuntimeError, match="closed"):
+        embeddings.embed_query("third")
+    embeddings.close()
+
+
+def test_server(tmp_path):
+    embeddings = MicroBatchingEmbeddings(HashingEmbeddingBackend())
+    vector_store = FlatVectorStore(store_dir=tmp_path / "vectors", id_key="permitnumber", embeddings=embeddings)
+    keyword_store = Bm25KeywordStore(index_dir=tmp_path / "keywords", id_key="permitnumber")
+    vector_store.add_documents(DOCUMENTS)
+    keyword_store.add_documents(DOCUMENTS)
+    service = QueryService(HybridRetriever(vector_store, keyword_store, dedupe_key="permitnumber"))
+    server = _serve(service)
+    try:
+        status, body = _post(server, "/search", {"query": "remodel Tremont unit 6", "k": 3,
+                                                 "filter": {"sq_feet": {"$lt": 10}}})
+        assert status == 200
+        assert body["documents"][0]["metadata"]["permitnumber"] == "P6"
+        assert all(document["metadata"]["sq_feet"] < 10 for document in body["documents"])
+
+        assert _post(server, "/search", {"k": 3})[0] == 400
+        assert _post(server, "/search", {"query": "remodel", "k": 0})[0] == 400
+        assert _post(server, "/search", {"query": "remodel", "filter": {"sq_feet": {"$near": 1}}})[0] == 400
+        assert _post(server, "/unknown", {"query": "remodel"})[0] == 404
+        # no provider is configured
+        assert _post(server, "/query", {"query": "remodel"})[0] == 501
+
+        # requests answered without reading their body leave a keep-alive connection usable
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=10)
+        connection.request("POST", "/unknown", body=json.dumps({"query": "remodel"}))
+        assert connection.getresponse().read() and connection.sock is not None
+        connection.request("POST", "/search", body=json.dumps({"query": "remodel", "k": 1}))
+        response = connection.getresponse()
+        assert response.status == 200 and len(json.loads(response.read())["documents"]) == 1
+        connection.putrequest("POST", "/search")
+        connection.putheader("Content-Length", str(2 << 20))
+        connection.endheaders()
+        response = connection.getresponse()
+        assert (response.status, response.getheader("Connection")) == (413, "close")
+        connection.close()
+
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics", timeout=10) as response:
+            assert 'aiasearch_server_requests_total{endpoint="search",status="200"}' in response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+        embeddings.close()
+
+
+def test_server_overload_and_timeout():
+    service = QueryService(_SlowRetriever(), max_concurrent=1, queue_timeout=0, search_timeout=1.0)
+    server = _serve(service)
+    try:
+        statuses = []
+        threads = [threading.Thread(target=lambda: statuses.append(_post(server, "/search", {"query": "a"})[0]))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # one request is admitted and the others are turned away rather than queued
+        assert sorted(statuses) == [200, 503, 503]
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+    service = QueryService(_SlowRetriever(), search_timeout=0.05)
+    server = _serve(service)
+    try:
+        assert _post(server, "/search", {"query": "a"})[0] == 504
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()